@@ -0,0 +1,75 @@
+"""
+Measure how quickly the SSE releases a read that is cancelled by the client.
+
+The SSE is started with a single slot for reads. A large file is read and the call is cancelled after a number of
+bundles. A small file is then read repeatedly until it is admitted, which shows when the cancelled read released its
+slot. The release time is compared with the average time to stream a chunk of the large file.
+
+Usage:
+python cancellation.py <large file> <small file> [--args "chunksize=1000"] [--bundles 20] [--server_args "--aio"]
+"""
+import argparse
+import os
+import time
+
+import grpc
+
+from sse_client import ROOT_DIR, start_server, stop_server, get_stub, read_sas, SSE
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('large')
+    parser.add_argument('small')
+    parser.add_argument('--args', default='chunksize=1000')
+    parser.add_argument('--bundles', type=int, default=20)
+    parser.add_argument('--port', type=int, default=50195)
+    parser.add_argument('--server_args', default='')
+    args = parser.parse_args()
+
+    server = start_server(args.port, ['--max_reads', '1', '--max_queue', '0'] + args.server_args.split())
+
+    try:
+        stub = get_stub(args.port)
+
+        # Start the large read and cancel it after a number of bundles
+        header = SSE.FunctionRequestHeader(functionId=0, version='1').SerializeToString()
+        request = iter([SSE.BundledRows(rows=[SSE.Row(duals=[SSE.Dual(strData=args.large), SSE.Dual(strData=args.args)])])])
+        call = stub.ExecuteFunction(request, metadata=[('qlik-functionrequestheader-bin', header)])
+
+        start = time.perf_counter()
+        rows = 0
+        for i, bundle in enumerate(call):
+            rows += len(bundle.rows)
+            if i + 1 == args.bundles:
+                break
+        streaming = time.perf_counter() - start
+
+        call.cancel()
+        cancelled = time.perf_counter()
+
+        # Retry the small read until the slot has been released
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                _, elapsed = read_sas(stub, args.small, args.args)
+                break
+            except grpc.RpcError as e:
+                if e.code() != grpc.StatusCode.RESOURCE_EXHAUSTED:
+                    raise
+                time.sleep(0.005)
+        released = time.perf_counter() - cancelled - elapsed
+    finally:
+        stop_server(server)
+
+    chunksize = int(dict(kv.strip().split('=') for kv in args.args.split(',')).get('chunksize', 1000))
+
+    print('Large read cancelled after {0} rows in {1:.2f}s, {2:.3f}s per chunk of {3} rows'.format(\
+        rows, streaming, streaming / rows * chunksize, chunksize))
+    print('Slot released within {0:.3f}s of the cancellation ({1} attempts)'.format(max(released, 0), attempts))
+
+    # Show how the SSE logged the cancelled read
+    with open(os.path.join(ROOT_DIR, 'core', 'logs', 'SSEPlugin.log')) as f:
+        lines = [line.strip() for line in f if 'cancelled' in line]
+    if lines:
+        print('SSE log: {}'.format(lines[-1]))
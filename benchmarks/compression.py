@@ -0,0 +1,76 @@
+"""
+Measure the bytes sent and the throughput of Read_SAS with response compression on and off.
+
+For each compression setting the SSE is started on a local port behind a TCP proxy that counts the bytes sent from
+the SSE to the client. The file is read a number of times and the bytes on the wire and rows per second are reported.
+
+Usage:
+python compression.py <file> [--args "chunksize=1000"] [--runs 3] [--modes none,gzip,deflate]
+"""
+import argparse
+import socket
+import threading
+
+from sse_client import start_server, stop_server, get_stub, read_sas, percentile
+
+class CountingProxy:
+    """
+    A TCP proxy that forwards connections to the SSE and counts the bytes sent back to the client.
+    """
+
+    def __init__(self, port, target_port):
+        self.target_port = target_port
+        self.received = 0
+        self._lock = threading.Lock()
+        self._listener = socket.create_server(('localhost', port))
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            client, _ = self._listener.accept()
+            server = socket.create_connection(('localhost', self.target_port))
+            threading.Thread(target=self._forward, args=(client, server, False), daemon=True).start()
+            threading.Thread(target=self._forward, args=(server, client, True), daemon=True).start()
+
+    def _forward(self, source, destination, count):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                if count:
+                    with self._lock:
+                        self.received += len(data)
+                destination.sendall(data)
+        except OSError:
+            pass
+        finally:
+            destination.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('file')
+    parser.add_argument('--args', default='chunksize=1000')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--modes', default='none,gzip,deflate')
+    parser.add_argument('--port', type=int, default=50196)
+    parser.add_argument('--server_args', default='')
+    args = parser.parse_args()
+
+    proxy = CountingProxy(args.port + 1, args.port)
+
+    for mode in args.modes.split(','):
+        server = start_server(args.port, args.server_args.split() + ['--compression', mode])
+
+        try:
+            stub = get_stub(args.port + 1)
+            proxy.received = 0
+            results = [read_sas(stub, args.file, args.args) for _ in range(args.runs)]
+        finally:
+            stop_server(server)
+
+        rows = results[0][0]
+        elapsed = percentile([result[1] for result in results], 50)
+
+        print('{0}: {1:.2f} MB sent per read, {2} rows in {3:.2f}s, {4:.0f} rows/s'.format(\
+            mode, proxy.received / args.runs / 1024 / 1024, rows, elapsed, rows / elapsed))
@@ -0,0 +1,75 @@
+"""
+Measure the latency that debug=true adds to Read_SAS.
+
+The SSE is started on a local port and a file is read a number of times with and without debug=true. The time to the
+first bundle is measured, as the debug output for a request is written before data is sent. Concurrent readers can be
+added to show the effect of logging from several requests at the same time.
+
+Usage:
+python debug_logging.py <file> [--args "chunksize=1000"] [--runs 10] [--clients 1]
+"""
+import argparse
+import threading
+import time
+
+from sse_client import start_server, stop_server, get_stub, read_sas, percentile, SSE
+
+def first_bundle(stub, path, args):
+    """
+    Call Read_SAS and return the time until the first bundle is received, which includes the debug output.
+    """
+    header = SSE.FunctionRequestHeader(functionId=0, version='1').SerializeToString()
+    request = iter([SSE.BundledRows(rows=[SSE.Row(duals=[SSE.Dual(strData=path), SSE.Dual(strData=args)])])])
+
+    start = time.perf_counter()
+    call = stub.ExecuteFunction(request, metadata=[('qlik-functionrequestheader-bin', header)])
+    next(call)
+    elapsed = time.perf_counter() - start
+    call.cancel()
+
+    return elapsed
+
+def run(port, path, args, runs, clients):
+    """
+    Read the file the given number of times in each client thread and return the latencies.
+    """
+    latencies = []
+
+    def client():
+        stub = get_stub(port)
+        for _ in range(runs):
+            latencies.append(first_bundle(stub, path, args))
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return latencies
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('file')
+    parser.add_argument('--args', default='chunksize=1000')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--clients', type=int, default=1)
+    parser.add_argument('--port', type=int, default=50192)
+    args = parser.parse_args()
+
+    server = start_server(args.port, ['--max_reads', str(max(args.clients, 4)), '--workers', str(args.clients + 10)])
+
+    try:
+        # Warm up the server so that library imports are not included
+        read_sas(get_stub(args.port), args.file, args.args)
+
+        results = {}
+        for debug in ['false', 'true']:
+            results[debug] = run(args.port, args.file, '{0}, debug={1}'.format(args.args, debug), args.runs, args.clients)
+    finally:
+        stop_server(server)
+
+    for debug, latencies in results.items():
+        print('debug={0}: time to first bundle p50 {1:.4f}s, p95 {2:.4f}s'.format(debug, percentile(latencies, 50), percentile(latencies, 95)))
+
+    print('Added by debug=true: {0:.4f}s at the median'.format(percentile(results['true'], 50) - percentile(results['false'], 50)))
@@ -0,0 +1,87 @@
+"""
+Measure the time to decode character columns that pandas returns as raw bytes.
+
+Columns of padded byte strings are generated with a given number of distinct values, and decoded a chunk at a time
+with a decode per cell, and with SASReader, which factorizes each chunk, decodes each distinct value once and memoizes
+the decoded values across chunks for low cardinality columns. The time for each and the number of distinct string
+objects in the result are reported. Fewer string objects means less memory for the decoded chunks, and Duals built
+once per value for dictionary encoded columns.
+
+Usage:
+python decode.py [--rows 200000] [--chunksize 1000] [--distinct 10,1000,50000] [--length 32] [--runs 5]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'core'))
+
+from sse_client import percentile, SSE
+from _cache import _BackgroundContext
+from _sas_reader import SASReader
+
+def generate(rows, distinct, length, seed=0):
+    """
+    Generate a column of byte strings padded with spaces to the length, as SAS stores character values.
+    """
+    rng = np.random.RandomState(seed)
+    pool = np.array(['{0:<{1}}'.format('VALUE {0} é'.format(i), length).encode('utf_8') for i in range(distinct)],\
+        dtype=object)
+    values = pool.take(rng.randint(0, distinct, rows))
+    values[rng.random_sample(rows) < 0.05] = None
+    return values
+
+def decode_cells(values, chunksize):
+    """
+    Decode each cell, as in a loop over the values of each chunk.
+    """
+    chunks = []
+    for i in range(0, len(values), chunksize):
+        chunk = values[i : i + chunksize]
+        chunks.append(np.array([v.decode('utf_8').rstrip(' ') if v is not None else np.nan for v in chunk], dtype=object))
+    return chunks
+
+def decode_reader(values, chunksize):
+    """
+    Decode each chunk with SASReader, sharing the memo across chunks as for a read of one file.
+    """
+    request = [SSE.BundledRows(rows=[SSE.Row(duals=[SSE.Dual(strData='data.sas7bdat'), SSE.Dual(strData='')])])]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        reader = SASReader(request, _BackgroundContext(threading.Event()))
+    return [reader._decode_column('C', values[i : i + chunksize]) for i in range(0, len(values), chunksize)]
+
+def measure(function, values, chunksize, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        chunks = function(values, chunksize)
+        times.append(time.perf_counter() - start)
+    strings = len({id(v) for chunk in chunks for v in chunk if isinstance(v, str)})
+    return percentile(times, 50), strings, chunks
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--chunksize', type=int, default=1000)
+    parser.add_argument('--distinct', default='10,1000,50000', type=lambda s: [int(n) for n in s.split(',')])
+    parser.add_argument('--length', type=int, default=32)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    print('{0} rows in chunks of {1}, values of {2} bytes'.format(args.rows, args.chunksize, args.length))
+    for distinct in args.distinct:
+        values = generate(args.rows, distinct, args.length)
+        cells, cell_strings, expected = measure(decode_cells, values, args.chunksize, args.runs)
+        reader, reader_strings, chunks = measure(decode_reader, values, args.chunksize, args.runs)
+
+        same = all(pd.Series(a).equals(pd.Series(b)) for a, b in zip(expected, chunks))
+        print('{0:>6} distinct: per cell {1:.3f}s ({2} strings), SASReader {3:.3f}s ({4} strings), {5:.2f}x{6}'.format(\
+            distinct, cells, cell_strings, reader, reader_strings, cells / reader, '' if same else ', DO NOT MATCH'))
@@ -0,0 +1,428 @@
+"""
+Generate synthetic SAS datasets for the benchmarks.
+
+Datasets are written as XPORT files with pyreadstat, or as SAS7BDAT files with the minimal writer in this module,
+which supports uncompressed and RLE compressed files in the 32-bit little-endian layout. The data is generated from a
+seed, so the same parameters always give the same file, and files that already exist are reused.
+
+Usage:
+python fixtures.py <directory> [--rows 10000] [--columns 10] [--string_length 16] [--missing 0.0]
+    [--compression none|rle] [--format sas7bdat|xport] [--seed 0]
+"""
+import argparse
+import os
+import struct
+import time
+
+import numpy as np
+import pandas as pd
+
+# SAS counts dates in days, and datetimes in seconds, from 1960-01-01
+_SAS_EPOCH = pd.Timestamp('1960-01-01')
+
+# Dates in the generated data fall in this range, as days since the SAS epoch
+_DATE_RANGE = (14610, 23011)
+
+# Characters used in generated strings
+_CHARACTERS = np.array([ord(c) for c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 '])
+
+# SAS7BDAT layout for 32-bit little-endian files
+_MAGIC = b'\x00' * 12 + b'\xc2\xea\x81\x60\xb3\x14\x11\xcf\xbd\x92\x08\x00\x09\xc7\x31\x8c\x18\x1f\x10\x11'
+_HEADER_LENGTH = 1024
+_PAGE_LENGTH = 65536
+_PAGE_HEADER_LENGTH = 24
+_POINTER_LENGTH = 12
+_PAGE_META = 0x0000
+_PAGE_DATA = 0x0100
+
+# Subheader signatures
+_ROW_SIZE = b'\xf7\xf7\xf7\xf7'
+_COLUMN_SIZE = b'\xf6\xf6\xf6\xf6'
+_COLUMN_TEXT = b'\xfd\xff\xff\xff'
+_COLUMN_NAME = b'\xff\xff\xff\xff'
+_COLUMN_ATTRIBUTES = b'\xfc\xff\xff\xff'
+_FORMAT_AND_LABEL = b'\xfe\xfb\xff\xff'
+
+# Compression flag and type for rows stored as subheaders
+_COMPRESSED_ROW = (4, 1)
+_RAW_ROW = (0, 1)
+
+# Strings in a text block start after the compression literal and creator fields, and blocks are kept under 32 KB
+_TEXT_START = 40
+_MAX_TEXT_BLOCK = 32000
+
+_COMPRESSION_LITERALS = {'none': b'', 'rle': b'SASYZCRL'}
+
+def generate(rows, columns, string_length=16, missing=0.0, seed=0):
+    """
+    Generate a data frame with a mix of numeric, character and date variables.
+    Character values are drawn from a pool so that columns have the repeated values typical of SAS datasets.
+    :param rows: the number of rows
+    :param columns: the number of variables, including an ID and a date variable
+    :param string_length: the maximum length of character values
+    :param missing: the share of values in each variable, other than the ID, that are missing
+    :param seed: the seed for the random number generator
+    :return: the data frame, and a dictionary with the format and label for each variable
+    """
+    rng = np.random.RandomState(seed)
+    data = {}
+    meta = {}
+
+    for i in range(columns):
+        if i == 0:
+            name, values, fmt = 'ID', np.arange(1, rows + 1, dtype=float), 'BEST12.'
+        elif i == 1:
+            name, values, fmt = 'DT', rng.randint(*_DATE_RANGE, size=rows).astype(float), 'DATE9.'
+        elif i % 2 == 0:
+            name, values, fmt = 'N{}'.format(i), np.round(rng.normal(1000, 250, rows), 2), 'BEST12.'
+        else:
+            name, fmt = 'C{}'.format(i), '$CHAR{}.'.format(string_length)
+
+            # Pools range from low to high cardinality across the character variables
+            pool_size = min(rows, 10 ** (1 + (i // 2) % 4))
+            pool = np.array([_random_string(rng, string_length) for _ in range(pool_size)], dtype=object)
+            values = pool[rng.randint(0, pool_size, size=rows)]
+
+        if i > 0 and missing > 0:
+            mask = rng.random_sample(rows) < missing
+            values = values.copy()
+            values[mask] = np.nan if values.dtype == float else ''
+
+        data[name] = values
+        meta[name] = (fmt, 'Synthetic variable {}'.format(i))
+
+    return pd.DataFrame(data), meta
+
+def _random_string(rng, length):
+    """
+    Return a random string of upper case letters and digits, between a quarter of the length and the full length.
+    """
+    size = rng.randint(max(1, length // 4), length + 1)
+    return ''.join(chr(c) for c in rng.choice(_CHARACTERS, size))
+
+def fixture_name(rows, columns, string_length, missing, compression, file_format, seed):
+    """
+    Return the file name for a fixture, encoding the parameters used to generate it.
+    """
+    return 'r{0}_c{1}_s{2}_m{3:g}_{4}_{5}.{6}'.format(rows, columns, string_length, missing, compression, seed,\
+        'xpt' if file_format == 'xport' else 'sas7bdat')
+
+def get_fixture(directory, rows=10000, columns=10, string_length=16, missing=0.0, compression='none',\
+    file_format='sas7bdat', seed=0):
+    """
+    Return the path to a fixture, generating it if it does not exist.
+    XPORT files are never compressed, so compression must be 'none' for that format.
+    """
+    if file_format == 'xport' and compression != 'none':
+        raise ValueError('XPORT files do not support compression')
+    if compression not in _COMPRESSION_LITERALS:
+        raise ValueError('Unsupported compression: {}'.format(compression))
+
+    path = os.path.join(directory, fixture_name(rows, columns, string_length, missing, compression, file_format, seed))
+
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        df, meta = generate(rows, columns, string_length, missing, seed)
+
+        # Write to a temporary file so that an interrupted run does not leave a partial fixture
+        temp = path + '.tmp'
+        if file_format == 'xport':
+            write_xport(temp, df, meta)
+        else:
+            write_sas7bdat(temp, df, meta, compression)
+        os.replace(temp, path)
+
+    return path
+
+def write_xport(path, df, meta):
+    """
+    Write a data frame to a version 5 XPORT file with pyreadstat.
+    """
+    import pyreadstat
+
+    pyreadstat.write_xport(df, path, table_name='BENCH', file_format_version=5,\
+        column_labels=[meta[col][1] for col in df.columns], variable_format={col: meta[col][0] for col in df.columns})
+
+def write_sas7bdat(path, df, meta, compression='none'):
+    """
+    Write a data frame to a SAS7BDAT file.
+    Numeric variables are stored as 8 byte doubles. Character variables are encoded as UTF-8 and padded with spaces.
+    :param path: the output file
+    :param df: a data frame with float and string columns
+    :param meta: a dictionary with the format and label for each column
+    :param compression: 'none', or 'rle' to store each row as an RLE compressed subheader
+    """
+    columns = _get_columns(df)
+    row_length = sum(length for _, _, length, _ in columns)
+    rows = _get_rows(df, columns, row_length)
+
+    # Text for variable names, formats and labels, and the compression literal at the start of the first block
+    text = _TextBlocks(_COMPRESSION_LITERALS[compression])
+    names = [text.add(name) for name, _, _, _ in columns]
+    formats = [text.add(meta[name][0].rstrip('.0123456789').lstrip('$')) for name, _, _, _ in columns]
+    labels = [text.add(meta[name][1]) for name, _, _, _ in columns]
+
+    subheaders = [(_row_size_subheader(row_length, len(df), len(columns)), 0, 0),\
+        (_COLUMN_SIZE + struct.pack('<ii', len(columns), 0), 0, 0)]
+    subheaders += [(block, 0, 0) for block in text.subheaders()]
+    subheaders.append((_column_name_subheader(names), 0, 0))
+    subheaders.append((_column_attributes_subheader(columns), 0, 0))
+    subheaders += [(_format_and_label_subheader(f, l), 0, 0) for f, l in zip(formats, labels)]
+
+    if compression == 'rle':
+        # Rows are stored as subheaders on meta pages, raw if compression would not make them shorter
+        for row in rows:
+            packed = _rle_compress(row)
+            subheaders.append((packed, ) + _COMPRESSED_ROW if len(packed) < row_length else (row, ) + _RAW_ROW)
+        pages = _meta_pages(subheaders)
+    else:
+        pages = _meta_pages(subheaders) + _data_pages(rows, row_length)
+
+    with open(path, 'wb') as f:
+        f.write(_header(len(pages)))
+        for page in pages:
+            f.write(page)
+
+def _get_columns(df):
+    """
+    Return the name, type, length and offset in the row for each column. Types are 1 for numeric and 2 for character.
+    """
+    columns = []
+    offset = 0
+
+    for name in df.columns:
+        if df[name].dtype == object:
+            length = max(1, int(df[name].str.encode('utf-8').str.len().max()))
+            columns.append((name, 2, length, offset))
+        else:
+            length = 8
+            columns.append((name, 1, length, offset))
+        offset += length
+
+    return columns
+
+def _get_rows(df, columns, row_length):
+    """
+    Return a list with the bytes for each row, built column by column with numpy.
+    """
+    buffer = np.zeros((len(df), row_length), dtype=np.uint8)
+
+    for name, kind, length, offset in columns:
+        if kind == 1:
+            values = df[name].values.astype('<f8')
+        else:
+            values = np.char.ljust(df[name].str.encode('utf-8').values.astype('S{}'.format(length)), length)
+        buffer[:, offset : offset + length] = np.frombuffer(values.tobytes(), dtype=np.uint8).reshape(len(df), length)
+
+    return [row.tobytes() for row in buffer]
+
+class _TextBlocks:
+    """
+    Column text subheaders holding the variable names, formats and labels.
+    """
+
+    def __init__(self, literal):
+        self.blocks = [bytearray(12) + literal.ljust(_TEXT_START - 12, b'\x00')]
+
+    def add(self, value):
+        """
+        Add a string and return its block index, offset and length.
+        """
+        data = value.encode('utf-8')
+        if len(self.blocks[-1]) + len(data) > _MAX_TEXT_BLOCK:
+            self.blocks.append(bytearray(_TEXT_START))
+
+        block = self.blocks[-1]
+        offset = len(block)
+
+        # Strings are aligned to 4 bytes
+        block.extend(data + b'\x00' * (-len(data) % 4))
+        return len(self.blocks) - 1, offset, len(data)
+
+    def subheaders(self):
+        """
+        Return the subheaders, each with the block size in the first two bytes of the block.
+        """
+        result = []
+        for block in self.blocks:
+            block[0:2] = struct.pack('<h', len(block))
+            result.append(_COLUMN_TEXT + bytes(block))
+        return result
+
+def _row_size_subheader(row_length, row_count, column_count):
+    data = bytearray(480)
+    data[0:4] = _ROW_SIZE
+    struct.pack_into('<ii', data, 20, row_length, row_count)
+    struct.pack_into('<ii', data, 36, column_count, 0)
+    return bytes(data)
+
+def _column_name_subheader(names):
+    data = bytearray(8 * len(names) + 20)
+    data[0:4] = _COLUMN_NAME
+    struct.pack_into('<i', data, 4, len(data) - 12)
+    for i, (index, offset, length) in enumerate(names):
+        struct.pack_into('<hhh', data, 12 + 8 * i, index, offset, length)
+    return bytes(data)
+
+def _column_attributes_subheader(columns):
+    data = bytearray(12 * len(columns) + 20)
+    data[0:4] = _COLUMN_ATTRIBUTES
+    struct.pack_into('<i', data, 4, len(data) - 12)
+    for i, (_, kind, length, offset) in enumerate(columns):
+        struct.pack_into('<iihb', data, 12 + 12 * i, offset, length, 0, kind)
+    return bytes(data)
+
+def _format_and_label_subheader(fmt, label):
+    data = bytearray(64)
+    data[0:4] = _FORMAT_AND_LABEL
+    struct.pack_into('<hhh', data, 34, *fmt)
+    struct.pack_into('<hhh', data, 40, *label)
+    return bytes(data)
+
+def _header(page_count):
+    """
+    Return the file header for a 32-bit little-endian file with UTF-8 encoding, created on Unix.
+    """
+    data = bytearray(_HEADER_LENGTH)
+    data[0:32] = _MAGIC
+    data[32:36] = b'2222'
+    data[37] = 1
+    data[39:40] = b'1'
+    data[70] = 20
+    data[84:92] = b'SAS FILE'
+    data[92:156] = b'BENCH'.ljust(64)
+    data[156:164] = b'DATA    '
+
+    # Created and modified times, in seconds since the SAS epoch
+    stamp = (pd.Timestamp(time.time(), unit='s') - _SAS_EPOCH).total_seconds()
+    struct.pack_into('<dd', data, 164, stamp, stamp)
+
+    struct.pack_into('<iii', data, 196, _HEADER_LENGTH, _PAGE_LENGTH, page_count)
+    data[216:224] = b'9.0401M6'
+    data[224:240] = b'X64_SR12R2'.ljust(16, b'\x00')
+    data[240:256] = b'Linux'.ljust(16, b'\x00')
+    return bytes(data)
+
+def _meta_pages(subheaders):
+    """
+    Pack subheaders into meta pages. Pointers are written from the start of the page and subheaders from the end.
+    """
+    pages = []
+    pending = list(subheaders)
+
+    while pending:
+        page = bytearray(_PAGE_LENGTH)
+        end = _PAGE_LENGTH
+        count = 0
+
+        while pending:
+            data, compression, kind = pending[0]
+            if _PAGE_HEADER_LENGTH + (count + 1) * _POINTER_LENGTH > end - len(data):
+                break
+
+            end -= len(data)
+            page[end : end + len(data)] = data
+            struct.pack_into('<iibb', page, _PAGE_HEADER_LENGTH + count * _POINTER_LENGTH, end, len(data), compression, kind)
+            count += 1
+            pending.pop(0)
+
+        if count == 0:
+            raise ValueError('A subheader of {} bytes does not fit on a page'.format(len(pending[0][0])))
+
+        struct.pack_into('<hhh', page, 16, _PAGE_META, 0, count)
+        pages.append(bytes(page))
+
+    return pages
+
+def _data_pages(rows, row_length):
+    """
+    Pack uncompressed rows into data pages.
+    """
+    per_page = (_PAGE_LENGTH - _PAGE_HEADER_LENGTH) // row_length
+    pages = []
+
+    for i in range(0, len(rows), per_page):
+        block = rows[i : i + per_page]
+        page = bytearray(_PAGE_LENGTH)
+        struct.pack_into('<hhh', page, 16, _PAGE_DATA, len(block), 0)
+        data = b''.join(block)
+        page[_PAGE_HEADER_LENGTH : _PAGE_HEADER_LENGTH + len(data)] = data
+        pages.append(bytes(page))
+
+    return pages
+
+def _rle_compress(row):
+    """
+    Compress a row with the SAS RLE scheme, using runs for repeated bytes and literal copies for everything else.
+    """
+    out = bytearray()
+    literal = bytearray()
+    i = 0
+
+    while i < len(row):
+        byte = row[i]
+        run = 1
+        while i + run < len(row) and row[i + run] == byte and run < 4112:
+            run += 1
+
+        # Spaces and zeros have dedicated codes for runs of 2 or more, other bytes for runs of 3 or more
+        if (byte in (0x20, 0x00) and run >= 2) or run >= 3:
+            _flush_literal(out, literal)
+            out.extend(_run_code(byte, run))
+            i += run
+        else:
+            literal.append(byte)
+            i += 1
+
+    _flush_literal(out, literal)
+    return bytes(out)
+
+def _flush_literal(out, literal):
+    for i in range(0, len(literal), 16):
+        part = literal[i : i + 16]
+        out.append(0x80 | (len(part) - 1))
+        out.extend(part)
+    del literal[:]
+
+def _run_code(byte, run):
+    """
+    Return the code for a run of a repeated byte, splitting runs that are too long for one code.
+    """
+    codes = bytearray()
+
+    while run > 0:
+        if byte in (0x20, 0x00):
+            short, long = (0xE0, 0x60) if byte == 0x20 else (0xF0, 0x70)
+            if run >= 17:
+                n = min(run, 4112)
+                codes.extend((long | ((n - 17) >> 8), (n - 17) & 0xFF))
+            elif run >= 2:
+                n = run
+                codes.append(short | (n - 2))
+            else:
+                n = 1
+                codes.extend((0x80, byte))
+        elif run >= 3:
+            n = min(run, 18)
+            codes.extend((0xC0 | (n - 3), byte))
+        else:
+            n = run
+            codes.extend((0x80 | (n - 1), ) + (byte, ) * n)
+        run -= n
+
+    return codes
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--columns', type=int, default=10)
+    parser.add_argument('--string_length', type=int, default=16)
+    parser.add_argument('--missing', type=float, default=0.0)
+    parser.add_argument('--compression', choices=sorted(_COMPRESSION_LITERALS), default='none')
+    parser.add_argument('--format', choices=['sas7bdat', 'xport'], default='sas7bdat')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(get_fixture(args.directory, args.rows, args.columns, args.string_length, args.missing, args.compression,\
+        args.format, args.seed))
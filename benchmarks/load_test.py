@@ -0,0 +1,255 @@
+"""
+Load test a running SSE with a local client that calls it as the Qlik engine would.
+
+Each session opens its own channel, as each Qlik engine does, and requests the capabilities before calling functions.
+Functions are called with the function and common request headers sent by the engine, and the response is validated:
+- the table description must be sent as initial metadata
+- every row must have one Dual per field in the table description, and numeric fields must have numeric values
+- Get_Labels must return the variable and label fields
+- calls for the same function must return the same number of rows in every session
+
+Latency percentiles, time to first bundle and aggregate throughput are reported, and can be written as JSON.
+
+Usage:
+python load_test.py <file> [--host localhost] [--port 50056] [--sessions 4] [--requests 5]
+    [--function Read_SAS|Get_Labels|mixed] [--args "chunksize=1000"] [--output results.json]
+"""
+import argparse
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import grpc
+from sse_client import percentile, SSE
+
+# Functions and the fields they are expected to return, or None if the fields depend on the file
+_EXPECTED_FIELDS = {'Read_SAS': None, 'Get_Labels': ['variable', 'label']}
+
+_MB = 1024 * 1024
+
+class ValidationError(Exception):
+    """
+    Raised when the response from the SSE is not what the Qlik engine expects.
+    """
+    pass
+
+class Session:
+    """
+    A client session with the SSE, on its own channel.
+    """
+
+    def __init__(self, target, session_id):
+        """
+        Class initializer.
+        :param target: the host and port of the SSE
+        :param session_id: a number for the session, sent as the user in the common request header
+        """
+        self.channel = grpc.insecure_channel(target, options=[('grpc.max_receive_message_length', -1),\
+            ('grpc.use_local_subchannel_pool', 1)])
+        self.stub = SSE.ConnectorStub(self.channel)
+        self.user = 'UserDirectory=LOADTEST; UserId=session{}'.format(session_id)
+        self.functions = None
+
+    def get_capabilities(self):
+        """
+        Request the capabilities and record the function ids by name.
+        """
+        capabilities = self.stub.GetCapabilities(SSE.Empty())
+        self.functions = {f.name: f for f in capabilities.functions}
+
+        missing = [name for name in _EXPECTED_FIELDS if name not in self.functions]
+        if missing:
+            raise ValidationError('Functions missing from capabilities: {}'.format(', '.join(missing)))
+
+        return capabilities
+
+    def call(self, function, path, args):
+        """
+        Call a function and consume and validate the response.
+        :return: a dictionary with the latency, time to first bundle, rows and bytes received
+        """
+        definition = self.functions[function]
+        function_header = SSE.FunctionRequestHeader(functionId=definition.functionId, version='1')
+        common_header = SSE.CommonRequestHeader(appId='loadtest', userId=self.user, cardinality=1)
+        metadata = [('qlik-functionrequestheader-bin', function_header.SerializeToString()),\
+            ('qlik-commonrequestheader-bin', common_header.SerializeToString())]
+
+        # The engine sends the arguments as a single row, with a Dual for each parameter
+        request = iter([SSE.BundledRows(rows=[SSE.Row(duals=[SSE.Dual(strData=path), SSE.Dual(strData=args)])])])
+
+        start = time.perf_counter()
+        first_bundle = None
+        rows = size = 0
+
+        call = self.stub.ExecuteFunction(request, metadata=metadata)
+        table = self._get_table_description(call.initial_metadata(), function)
+
+        for bundle in call:
+            if first_bundle is None:
+                first_bundle = time.perf_counter() - start
+            self._validate_bundle(bundle, table)
+            rows += len(bundle.rows)
+            size += bundle.ByteSize()
+
+        latency = time.perf_counter() - start
+
+        return {'function': function, 'latency': latency, 'first_bundle': latency if first_bundle is None else first_bundle,\
+            'rows': rows, 'bytes': size}
+
+    def close(self):
+        self.channel.close()
+
+    @staticmethod
+    def _get_table_description(metadata, function):
+        """
+        Parse and validate the table description sent as initial metadata.
+        """
+        for key, value in metadata:
+            if key == 'qlik-tabledescription-bin':
+                table = SSE.TableDescription()
+                table.ParseFromString(value)
+                break
+        else:
+            raise ValidationError('{} did not send a table description'.format(function))
+
+        if len(table.fields) == 0:
+            raise ValidationError('{} sent a table description without fields'.format(function))
+
+        expected = _EXPECTED_FIELDS.get(function)
+        if expected is not None and [field.name for field in table.fields] != expected:
+            raise ValidationError('{0} returned fields {1}, expected {2}'.format(function,\
+                [field.name for field in table.fields], expected))
+
+        return table
+
+    @staticmethod
+    def _validate_bundle(bundle, table):
+        """
+        Check that each row matches the table description.
+        """
+        for row in bundle.rows:
+            if len(row.duals) != len(table.fields):
+                raise ValidationError('Row with {0} values for {1} fields'.format(len(row.duals), len(table.fields)))
+
+            for dual, field in zip(row.duals, table.fields):
+                if field.dataType == SSE.NUMERIC and dual.strData:
+                    raise ValidationError('Text value {0!r} for numeric field {1}'.format(dual.strData, field.name))
+
+def run_session(target, session_id, path, args, functions, requests, results, errors, ready):
+    """
+    Run a session: request the capabilities, then call the functions in turn.
+    """
+    session = Session(target, session_id)
+
+    try:
+        session.get_capabilities()
+    except (grpc.RpcError, ValidationError) as e:
+        errors.append(('GetCapabilities', _describe(e)))
+        session.close()
+        return
+    finally:
+        # Sessions start calling functions together, after they have all connected
+        ready.wait()
+
+    try:
+        for i in range(requests):
+            function = functions[(session_id + i) % len(functions)]
+            try:
+                results.append(session.call(function, path, args))
+            except (grpc.RpcError, ValidationError) as e:
+                errors.append((function, _describe(e)))
+    finally:
+        session.close()
+
+def _describe(error):
+    if isinstance(error, grpc.RpcError):
+        return '{0}: {1}'.format(error.code().name, error.details())
+    return str(error)
+
+def run(target, path, args, sessions, requests, functions):
+    """
+    Run the sessions concurrently and return a summary of the results.
+    """
+    results, errors = [], []
+    ready = threading.Barrier(sessions + 1)
+    threads = [threading.Thread(target=run_session, args=(target, i, path, args, functions, requests, results, errors,\
+        ready)) for i in range(sessions)]
+
+    for thread in threads:
+        thread.start()
+
+    # Time from when every session has its capabilities
+    ready.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    # Calls for the same function must return the same rows in every session
+    for function in functions:
+        counts = set(r['rows'] for r in results if r['function'] == function)
+        if len(counts) > 1:
+            errors.append((function, 'Calls returned different row counts: {}'.format(sorted(counts))))
+
+    summary = OrderedDict([
+        ('sessions', sessions),
+        ('requests', len(results) + len(errors)),
+        ('completed', len(results)),
+        ('errors', [{'function': f, 'error': e} for f, e in errors]),
+        ('elapsed_seconds', elapsed),
+        ('rows_per_second', sum(r['rows'] for r in results) / elapsed if elapsed else 0),
+        ('mb_per_second', sum(r['bytes'] for r in results) / _MB / elapsed if elapsed else 0),
+    ])
+
+    for function in functions:
+        calls = [r for r in results if r['function'] == function]
+        if calls:
+            summary[function] = OrderedDict([
+                ('calls', len(calls)),
+                ('rows', calls[0]['rows']),
+                ('latency', _percentiles([r['latency'] for r in calls])),
+                ('first_bundle', _percentiles([r['first_bundle'] for r in calls])),
+            ])
+
+    return summary
+
+def _percentiles(values):
+    return OrderedDict((p, percentile(values, int(p[1:]))) for p in ['p50', 'p90', 'p99'])
+
+def print_summary(summary):
+    print('{0} sessions, {1} of {2} calls completed in {3:.2f}s'.format(summary['sessions'], summary['completed'],\
+        summary['requests'], summary['elapsed_seconds']))
+    print('Throughput: {0:.0f} rows/s, {1:.2f} MB/s'.format(summary['rows_per_second'], summary['mb_per_second']))
+
+    for function in _EXPECTED_FIELDS:
+        if function in summary:
+            stats = summary[function]
+            print('\n{0}: {1} calls, {2} rows per call'.format(function, stats['calls'], stats['rows']))
+            for name in ['latency', 'first_bundle']:
+                print('  {0:<14}'.format(name) + '  '.join('{0} {1:.3f}s'.format(p, v) for p, v in stats[name].items()))
+
+    if summary['errors']:
+        print('\n{} errors:'.format(len(summary['errors'])))
+        for error in summary['errors']:
+            print('  {function}: {error}'.format(**error))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('file')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=50056)
+    parser.add_argument('--sessions', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=5)
+    parser.add_argument('--function', choices=list(_EXPECTED_FIELDS) + ['mixed'], default='Read_SAS')
+    parser.add_argument('--args', default='chunksize=1000')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    functions = list(_EXPECTED_FIELDS) if args.function == 'mixed' else [args.function]
+    summary = run('{0}:{1}'.format(args.host, args.port), args.file, args.args, args.sessions, args.requests, functions)
+    print_summary(summary)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
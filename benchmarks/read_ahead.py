@@ -0,0 +1,126 @@
+"""
+Measure the time to read a SAS file over a slow file system, reading directly and through the read-ahead layer.
+
+A network share is simulated by a file object that sleeps for a fixed latency on every read call, plus the time to
+transfer the bytes at the given bandwidth. The file is read in chunks with pandas, or with the SAS7BDAT module, once
+directly (depth 0) and once for each read-ahead depth. The time and the number of reads from the file are reported.
+
+Usage:
+python read_ahead.py <file> [--latency 0.002] [--bandwidth 100] [--block_size 1024] [--depths 0,2,4,8]
+    [--backends pandas,sas7bdat] [--chunksize 10000] [--runs 3]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'core'))
+
+from sas7bdat import SAS7BDAT
+from _read_ahead import ReadAheadFile
+from sse_client import percentile
+
+class ThrottledFile(io.RawIOBase):
+    """
+    A local file that is slowed down to behave like a file on a network share.
+    """
+
+    def __init__(self, path, latency, bandwidth):
+        """
+        :param path: the file to read
+        :param latency: the time in seconds added to every read
+        :param bandwidth: the transfer rate in MB/s
+        """
+        self.name = path
+        self.latency = latency
+        self.bandwidth = bandwidth * 1024 * 1024
+        self.reads = 0
+        self._file = open(path, 'rb', buffering=0)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self.reads += 1
+        time.sleep(self.latency + len(data) / self.bandwidth)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+def read_pandas(handle, path, chunksize):
+    fmt = 'xport' if path.lower().endswith('.xpt') else 'sas7bdat'
+    rows = 0
+    for chunk in pd.read_sas(handle, format=fmt, encoding='latin_1', chunksize=chunksize):
+        rows += len(chunk)
+    return rows
+
+def read_sas7bdat(handle, path, chunksize):
+    reader = SAS7BDAT(path, skip_header=True, fh=handle)
+    rows = sum(1 for _ in reader.readlines())
+    reader.close()
+    return rows
+
+_BACKENDS = {'pandas': read_pandas, 'sas7bdat': read_sas7bdat}
+
+def run(path, backend, depth, args):
+    """
+    Read the file once and return the number of rows, the time taken and the number of reads from the file.
+    """
+    raw = ThrottledFile(path, args.latency, args.bandwidth)
+    handle = ReadAheadFile(raw, args.block_size * 1024, depth, name=path) if depth else raw
+
+    start = time.time()
+    try:
+        rows = _BACKENDS[backend](handle, path, args.chunksize)
+    finally:
+        handle.close()
+
+    return rows, time.time() - start, raw.reads
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('file')
+    parser.add_argument('--latency', type=float, default=0.002)
+    parser.add_argument('--bandwidth', type=float, default=100)
+    parser.add_argument('--block_size', type=int, default=1024)
+    parser.add_argument('--depths', default='0,2,4,8')
+    parser.add_argument('--backends', default='pandas,sas7bdat')
+    parser.add_argument('--chunksize', type=int, default=10000)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    print('{0}: {1:.1f} MB, {2:.1f}ms latency, {3:.0f} MB/s, {4} KB blocks'.format(args.file,\
+        os.path.getsize(args.file) / 1024 / 1024, args.latency * 1000, args.bandwidth, args.block_size))
+
+    for backend in args.backends.split(','):
+        if backend == 'sas7bdat' and not args.file.lower().endswith('.sas7bdat'):
+            continue
+
+        for depth in [int(depth) for depth in args.depths.split(',')]:
+            results = [run(args.file, backend, depth, args) for _ in range(args.runs)]
+            rows, reads = results[0][0], results[0][2]
+            elapsed = percentile([result[1] for result in results], 50)
+
+            print('{0} {1}: {2} rows in {3:.2f}s, {4:.0f} rows/s, {5} reads'.format(backend,\
+                'direct' if depth == 0 else 'read-ahead depth {}'.format(depth), rows, elapsed, rows / elapsed, reads))
@@ -0,0 +1,68 @@
+"""
+Measure the latency of small Read_SAS requests while large reads are in flight.
+
+The SSE is started on a local port and large files are read in background threads. Once the large reads are
+streaming, a small file is read a number of times and its latency is compared with the same read on an idle server.
+
+Usage:
+python scheduler_latency.py <large file> <small file> [--port 50199] [--args "chunksize=1000"] [--priority high]
+    [--large_count 3] [--server_args "--chunk_slots 1"]
+"""
+import argparse
+import threading
+import time
+
+from sse_client import start_server, stop_server, get_stub, read_sas, percentile
+
+def small_reads(stub, path, args, count):
+    """
+    Read the small file a number of times and return the latencies.
+    """
+    return [read_sas(stub, path, args)[1] for _ in range(count)]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('large')
+    parser.add_argument('small')
+    parser.add_argument('--port', type=int, default=50199)
+    parser.add_argument('--args', default='chunksize=1000')
+    parser.add_argument('--priority', default='high')
+    parser.add_argument('--count', type=int, default=5)
+    parser.add_argument('--large_count', type=int, default=3)
+    parser.add_argument('--server_args', default='')
+    args = parser.parse_args()
+
+    server = start_server(args.port, args.server_args.split())
+
+    try:
+        stub = get_stub(args.port)
+
+        # Latency on an idle server
+        idle = small_reads(stub, args.small, args.args, args.count)
+
+        results = {}
+        for priority in ['normal', args.priority]:
+            # Start the large reads, each on its own channel, and wait for them to start streaming
+            large = []
+            threads = [threading.Thread(target=lambda: large.append(read_sas(get_stub(args.port), args.large, args.args)))\
+                for _ in range(args.large_count)]
+            for thread in threads:
+                thread.start()
+            time.sleep(2)
+
+            results[priority] = small_reads(stub, args.small, '{}, priority={}'.format(args.args, priority), args.count)
+            in_flight = all(thread.is_alive() for thread in threads)
+            for thread in threads:
+                thread.join()
+
+            if not in_flight:
+                print('Warning: a large read finished before the small reads. Use a larger file.')
+            for result in large:
+                print('Large read: {0} rows in {1:.2f}s'.format(*result))
+
+        print('\nSmall read latency in seconds (median of {}):'.format(args.count))
+        print('Idle server: {:.3f}'.format(percentile(idle, 50)))
+        for priority, latencies in results.items():
+            print('During large reads, priority={0}: {1:.3f}'.format(priority, percentile(latencies, 50)))
+    finally:
+        stop_server(server)
@@ -0,0 +1,47 @@
+"""
+Compare the thread pool server with the asyncio server under concurrent Read_SAS calls.
+
+For each server mode the SSE is started on a local port and a number of clients, each in its own process, read the
+same file at the same time. Latency percentiles and aggregate throughput are reported for each mode.
+
+Usage:
+python server_concurrency.py <file> [--clients 8] [--args "chunksize=1000"] [--server_args "--max_reads 8 --workers 20"]
+"""
+import argparse
+import time
+from multiprocessing import Pool
+
+from sse_client import start_server, stop_server, get_stub, read_sas, percentile
+
+def client(params):
+    """
+    Read the file in a client process.
+    """
+    port, path, args = params
+    return read_sas(get_stub(port), path, args)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('file')
+    parser.add_argument('--port', type=int, default=50198)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--args', default='chunksize=1000')
+    parser.add_argument('--server_args', default='--max_reads 8 --max_queue 8 --workers 20')
+    args = parser.parse_args()
+
+    for mode, mode_args in [('threads', []), ('asyncio', ['--aio'])]:
+        server = start_server(args.port, args.server_args.split() + mode_args)
+
+        try:
+            with Pool(args.clients) as pool:
+                start = time.perf_counter()
+                results = pool.map(client, [(args.port, args.file, args.args)] * args.clients)
+                elapsed = time.perf_counter() - start
+        finally:
+            stop_server(server)
+
+        latencies = [result[1] for result in results]
+        rows = sum(result[0] for result in results)
+
+        print('{0}: {1} clients, {2} rows in {3:.2f}s, {4:.0f} rows/s, latency p50 {5:.2f}s, p95 {6:.2f}s'.format(\
+            mode, args.clients, rows, elapsed, rows / elapsed, percentile(latencies, 50), percentile(latencies, 95)))
@@ -0,0 +1,87 @@
+"""
+Measure Read_SAS in coordinator mode, with the file read in shards by peer SSE instances running as local processes.
+
+A SAS7BDAT file is read from a single SSE, and then from a coordinator with 2 or more peers on consecutive ports. The
+coordinator is one of the peers. The rows returned are compared with the single SSE, and the time and speedup are
+reported. With --kill, one of the peers is stopped part way through each read, so that its shard is retried on another
+peer. On one machine the speedup is limited by the number of cores, as every peer decodes its shard in parallel.
+
+Usage:
+python sharding.py <file.sas7bdat> [--args "chunksize=5000"] [--peers 2,4] [--shard_pages 16] [--runs 3]
+    [--kill 2.0] [--port 50180]
+"""
+import argparse
+import threading
+import time
+
+from sse_client import start_server, stop_server, get_stub, percentile, SSE
+
+def read_rows(stub, path, args):
+    """
+    Call Read_SAS and collect the rows as tuples of strings and numbers.
+    :return: the rows and the elapsed time in seconds
+    """
+    header = SSE.FunctionRequestHeader(functionId=0, version='1').SerializeToString()
+    request = iter([SSE.BundledRows(rows=[SSE.Row(duals=[SSE.Dual(strData=path), SSE.Dual(strData=args)])])])
+
+    start = time.perf_counter()
+    rows = []
+    for bundle in stub.ExecuteFunction(request, metadata=[('qlik-functionrequestheader-bin', header)]):
+        rows.extend(tuple((d.strData, d.numData) for d in row.duals) for row in bundle.rows)
+
+    return rows, time.perf_counter() - start
+
+def same_rows(a, b):
+    """
+    Compare rows, treating missing numbers as equal.
+    """
+    return len(a) == len(b) and all(x == y or (x[0] == y[0] and x[1] != x[1] and y[1] != y[1])\
+        for row_a, row_b in zip(a, b) for x, y in zip(row_a, row_b))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('file')
+    parser.add_argument('--args', default='chunksize=5000')
+    parser.add_argument('--peers', default='2,4', type=lambda s: [int(n) for n in s.split(',')])
+    parser.add_argument('--shard_pages', type=int, default=16)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--kill', type=float, help='Stop the last peer this many seconds into each read')
+    parser.add_argument('--port', type=int, default=50180)
+    args = parser.parse_args()
+
+    server = start_server(args.port)
+    try:
+        expected, _ = read_rows(get_stub(args.port), args.file, args.args)
+        times = [read_rows(get_stub(args.port), args.file, args.args)[1] for _ in range(args.runs)]
+    finally:
+        stop_server(server)
+
+    baseline = percentile(times, 50)
+    print('Single SSE: {0} rows in {1:.2f}s'.format(len(expected), baseline))
+
+    for count in args.peers:
+        ports = [args.port + i for i in range(count)]
+        peers = ','.join('localhost:{}'.format(port) for port in ports)
+        times = []
+        matched = True
+
+        for _ in range(args.runs):
+            # Peers are started for each run, so that a peer stopped with --kill is replaced
+            servers = [start_server(port) for port in ports[1:]]
+            servers.insert(0, start_server(ports[0], ['--peers', peers, '--shard_pages', str(args.shard_pages)]))
+
+            try:
+                if args.kill:
+                    threading.Timer(args.kill, stop_server, [servers[-1]]).start()
+
+                rows, seconds = read_rows(get_stub(ports[0]), args.file, args.args)
+                matched = matched and same_rows(rows, expected)
+                times.append(seconds)
+            finally:
+                for server in servers:
+                    if server.poll() is None:
+                        stop_server(server)
+
+        median = percentile(times, 50)
+        print('{0} peers{1}: {2:.2f}s, {3:.2f}x speedup, rows {4}'.format(count, ', one stopped' if args.kill else '',\
+            median, baseline / median, 'match' if matched else 'DO NOT MATCH'))
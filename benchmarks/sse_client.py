@@ -0,0 +1,67 @@
+"""
+Helpers for benchmarks that start the SSE locally and call it as the Qlik engine would.
+"""
+import os
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT_DIR, 'generated'))
+
+import grpc
+import ServerSideExtension_pb2 as SSE
+
+def start_server(port, server_args=None):
+    """
+    Start the SSE in a separate process and wait for the port to accept connections.
+    :param port: the port for the SSE
+    :param server_args: a list of additional command line arguments for the SSE
+    :return: the server process
+    """
+    server = subprocess.Popen([sys.executable, '__main__.py', '--port', str(port)] + (server_args or []),\
+        cwd=os.path.join(ROOT_DIR, 'core'), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    channel = grpc.insecure_channel('localhost:{}'.format(port))
+    grpc.channel_ready_future(channel).result(timeout=60)
+    channel.close()
+
+    return server
+
+def stop_server(server):
+    """
+    Stop the SSE process.
+    """
+    server.terminate()
+    server.wait()
+
+def get_stub(port):
+    """
+    Create a stub for the SSE on a new channel.
+    """
+    # A local subchannel pool stops a new channel reusing a connection to a server that has been restarted
+    channel = grpc.insecure_channel('localhost:{}'.format(port), options=[('grpc.max_receive_message_length', -1),\
+        ('grpc.use_local_subchannel_pool', 1)])
+    return SSE.ConnectorStub(channel)
+
+def read_sas(stub, path, args, function_id=0):
+    """
+    Call Read_SAS, or another function with the same parameters, and consume the response.
+    :return: the number of rows and the elapsed time in seconds
+    """
+    header = SSE.FunctionRequestHeader(functionId=function_id, version='1').SerializeToString()
+    request = iter([SSE.BundledRows(rows=[SSE.Row(duals=[SSE.Dual(strData=path), SSE.Dual(strData=args)])])])
+
+    start = time.perf_counter()
+    rows = 0
+    for bundle in stub.ExecuteFunction(request, metadata=[('qlik-functionrequestheader-bin', header)]):
+        rows += len(bundle.rows)
+
+    return rows, time.perf_counter() - start
+
+def percentile(values, p):
+    """
+    Return the p-th percentile of a list of values, using the nearest rank.
+    """
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
@@ -0,0 +1,66 @@
+"""
+Measure the startup time of the SSE.
+
+The SSE is started a number of times and the time until the port accepts connections, the time until the first
+GetCapabilities response, and optionally the time until the first Read_SAS response are reported.
+
+Usage:
+python startup_time.py [--file data.sas7bdat] [--args "chunksize=1000"] [--runs 5] [--port 50197]
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from sse_client import ROOT_DIR, stop_server, get_stub, read_sas, percentile, SSE
+
+def wait_for_port(port, timeout=60):
+    """
+    Poll the port until it accepts connections.
+    """
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            socket.create_connection(('localhost', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.005)
+    raise TimeoutError('The SSE did not start listening within {} seconds'.format(timeout))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--file')
+    parser.add_argument('--args', default='chunksize=1000')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--port', type=int, default=50197)
+    parser.add_argument('--server_args', default='')
+    args = parser.parse_args()
+
+    results = {'listen': [], 'capabilities': [], 'read': []}
+
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        server = subprocess.Popen([sys.executable, '__main__.py', '--port', str(args.port)] + args.server_args.split(),\
+            cwd=os.path.join(ROOT_DIR, 'core'), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        try:
+            wait_for_port(args.port)
+            results['listen'].append(time.perf_counter() - start)
+
+            stub = get_stub(args.port)
+            stub.GetCapabilities(SSE.Empty())
+            results['capabilities'].append(time.perf_counter() - start)
+
+            if args.file:
+                read_sas(stub, args.file, args.args)
+                results['read'].append(time.perf_counter() - start)
+        finally:
+            stop_server(server)
+
+    print('Startup time in seconds over {} runs (median / max):'.format(args.runs))
+    for name, label in [('listen', 'Time to listen'), ('capabilities', 'Time to first capabilities'),\
+        ('read', 'Time to first Read_SAS response')]:
+        if results[name]:
+            print('{0}: {1:.3f} / {2:.3f}'.format(label, percentile(results[name], 50), max(results[name])))
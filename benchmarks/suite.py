@@ -0,0 +1,304 @@
+"""
+Benchmark the stages of Read_SAS on synthetic SAS datasets and write the results as JSON.
+
+Fixtures are generated locally with fixtures.py, varying the row count, column count, string length, share of missing
+values, compression and file format. Each case is run in a separate process, without a server or Qlik, and the time
+spent in each stage is measured:
+- open: opening the file with pandas, reading the formats and sending the table description
+- decode: reading chunks of the file and decoding the values
+- encode: building BundledRows of Duals from each chunk
+- serialize: serializing the BundledRows as gRPC would before sending them
+
+Throughput is reported in rows/s and in MB/s of the SAS file, along with the peak resident memory of the process.
+Results from two runs, e.g. before and after a commit, can be compared with --compare.
+
+Usage:
+python suite.py [--output results.json] [--fixtures <directory>] [--repeat 3] [--quick] [--args "chunksize=1000"]
+    [--cases base,rle]
+python suite.py --compare <baseline.json> <results.json>
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from collections import OrderedDict
+
+import fixtures
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Parameters for the fixture in each case. Each case varies one parameter from the base case.
+_BASE = OrderedDict([('rows', 50000), ('columns', 10), ('string_length', 16), ('missing', 0.0), ('compression', 'none'),\
+    ('file_format', 'sas7bdat')])
+_CASES = OrderedDict([
+    ('base', {}),
+    ('xport', {'file_format': 'xport'}),
+    ('rle', {'compression': 'rle'}),
+    ('many_rows', {'rows': 200000}),
+    ('wide', {'rows': 10000, 'columns': 200}),
+    ('long_strings', {'string_length': 200}),
+    ('long_strings_rle', {'string_length': 200, 'compression': 'rle'}),
+    ('missing_50', {'missing': 0.5}),
+])
+
+# Row counts are divided by this factor with --quick
+_QUICK_FACTOR = 10
+
+# The maximum number of cells per bundle, as used by Read_SAS
+_MAX_CELLS = 10000
+
+_MB = 1024 * 1024
+
+class _Context:
+    """
+    A stand-in for the gRPC context of a call that is never cancelled.
+    """
+
+    def send_initial_metadata(self, metadata):
+        pass
+
+    def is_active(self):
+        return True
+
+    def add_callback(self, callback):
+        return True
+
+def _load_service():
+    """
+    Import the SSE from the core directory and the libraries it loads in the background when the server starts.
+    """
+    import importlib.util
+
+    sys.path.insert(0, os.path.join(ROOT_DIR, 'core'))
+    spec = importlib.util.spec_from_file_location('sse_service', os.path.join(ROOT_DIR, 'core', '__main__.py'))
+    service = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(service)
+    service._import_libraries()
+
+    return service
+
+def run_case(path, args):
+    """
+    Read a file through the Read_SAS stages in this process and return the measurements.
+    """
+    service = _load_service()
+    SSE = service.SSE
+    pd = service.pd
+    from _metrics import get_rss
+    baseline_rss = get_rss()
+
+    request = [SSE.BundledRows(rows=[SSE.Row(duals=[SSE.Dual(strData=path), SSE.Dual(strData=args)])])]
+    stages = OrderedDict((stage, 0.0) for stage in ['open', 'decode', 'encode', 'serialize'])
+    rows = size = 0
+    start, cpu = time.perf_counter(), time.process_time()
+
+    reader = service.SASReader(request, _Context())
+    response = reader.read()
+    stages['open'] = time.perf_counter() - start
+
+    if isinstance(response, pd.DataFrame):
+        chunks = iter([response.iloc[i : i + reader.chunksize] for i in range(0, len(response), reader.chunksize)])
+    else:
+        chunks = iter(response)
+
+    dual_cache = {}
+
+    while True:
+        mark = time.perf_counter()
+        chunk = next(chunks, None)
+        stages['decode'] += time.perf_counter() - mark
+        if chunk is None:
+            break
+
+        bundles = service.ExtensionService._get_bundles(chunk, dual_cache, reader.column_types, _MAX_CELLS)
+
+        while True:
+            mark = time.perf_counter()
+            bundle = next(bundles, None)
+            stages['encode'] += time.perf_counter() - mark
+            if bundle is None:
+                break
+
+            mark = time.perf_counter()
+            data = bundle.SerializeToString()
+            stages['serialize'] += time.perf_counter() - mark
+
+            rows += len(bundle.rows)
+            size += len(data)
+
+    total = time.perf_counter() - start
+    file_size = os.path.getsize(path)
+
+    peak_rss = _get_peak_rss()
+
+    return OrderedDict([
+        ('rows', rows),
+        ('file_mb', file_size / _MB),
+        ('serialized_mb', size / _MB),
+        ('seconds', OrderedDict((stage, round(seconds, 4)) for stage, seconds in stages.items())),
+        ('total_seconds', total),
+        ('cpu_seconds', time.process_time() - cpu),
+        ('rows_per_second', rows / total if total else 0),
+        ('mb_per_second', file_size / _MB / total if total else 0),
+        ('peak_rss_mb', peak_rss / _MB),
+        ('peak_rss_increase_mb', (peak_rss - baseline_rss) / _MB if baseline_rss else None),
+    ])
+
+def _get_peak_rss():
+    """
+    Return the peak resident memory of the process in bytes.
+    VmHWM is used on Linux because ru_maxrss carries over the peak of the parent process when a process is spawned.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def run_suite(cases, directory, args, repeat, quick):
+    """
+    Run each case in a separate process and return the median of each measurement across the repeats.
+    """
+    results = []
+
+    for name in cases:
+        params = OrderedDict(_BASE)
+        params.update(_CASES[name])
+        if quick:
+            params['rows'] = max(1, params['rows'] // _QUICK_FACTOR)
+
+        path = fixtures.get_fixture(directory, **params)
+        runs = []
+
+        for _ in range(repeat):
+            with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+                output = f.name
+            try:
+                subprocess.run([sys.executable, os.path.abspath(__file__), '--run', path, '--args', args,\
+                    '--output', output], check=True, stdout=subprocess.DEVNULL)
+                with open(output) as f:
+                    runs.append(json.load(f, object_pairs_hook=OrderedDict))
+            finally:
+                os.remove(output)
+
+        result = _median(runs)
+        results.append(OrderedDict([('case', name), ('parameters', params)] + list(result.items())))
+
+        print('{0:<20}{1:>10} rows{2:>12.0f} rows/s{3:>9.2f} MB/s{4:>9.1f} MB peak'.format(name, result['rows'],\
+            result['rows_per_second'], result['mb_per_second'], result['peak_rss_mb']))
+
+    return results
+
+def _median(runs):
+    """
+    Return the median of each numeric measurement across runs.
+    """
+    result = OrderedDict()
+
+    for key, value in runs[0].items():
+        if isinstance(value, dict):
+            result[key] = _median([run[key] for run in runs])
+        elif isinstance(value, int) and not isinstance(value, bool):
+            result[key] = statistics.median_low(run[key] for run in runs)
+        elif isinstance(value, float):
+            result[key] = statistics.median(run[key] for run in runs)
+        else:
+            result[key] = value
+
+    return result
+
+def _environment():
+    """
+    Return the commit and library versions, so that results can be matched to the code that produced them.
+    """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR, stderr=subprocess.DEVNULL)\
+            .decode().strip()
+        dirty = bool(subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT_DIR,\
+            stderr=subprocess.DEVNULL).strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+
+    import numpy
+    import pandas
+    import google.protobuf
+
+    return OrderedDict([
+        ('commit', commit),
+        ('uncommitted_changes', dirty),
+        ('created', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('numpy', numpy.__version__),
+        ('pandas', pandas.__version__),
+        ('protobuf', google.protobuf.__version__),
+    ])
+
+def compare(baseline, results):
+    """
+    Print the change in throughput and peak memory for each case found in both results.
+    """
+    before = {case['case']: case for case in baseline['cases']}
+
+    print('Baseline: {0}\nResults:  {1}\n'.format(baseline['environment']['commit'], results['environment']['commit']))
+    print('{0:<20}{1:>14}{2:>14}{3:>9}{4:>12}{5:>12}'.format('Case', 'Base rows/s', 'New rows/s', 'Change',\
+        'Base MB', 'New MB'))
+
+    for case in results['cases']:
+        old = before.get(case['case'])
+        if old is None:
+            continue
+        if old['parameters'] != case['parameters']:
+            print('{0:<20}parameters differ, not compared'.format(case['case']))
+            continue
+
+        change = 100 * (case['rows_per_second'] / old['rows_per_second'] - 1) if old['rows_per_second'] else 0
+        print('{0:<20}{1:>14.0f}{2:>14.0f}{3:>8.1f}%{4:>12.1f}{5:>12.1f}'.format(case['case'], old['rows_per_second'],\
+            case['rows_per_second'], change, old['peak_rss_mb'], case['peak_rss_mb']))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--fixtures', default=os.path.join(tempfile.gettempdir(), 'qlik-sas-benchmarks'))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--quick', action='store_true')
+    parser.add_argument('--args', default='chunksize=1000')
+    parser.add_argument('--cases', type=lambda s: [c.strip() for c in s.split(',')], default=list(_CASES))
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'RESULTS'))
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        # Run a single case in this process and write the measurements to the output file
+        # pandas warns for each chunk when converting missing values in date variables
+        warnings.simplefilter('ignore', RuntimeWarning)
+        result = run_case(args.run, args.args)
+        with open(args.output, 'w') as f:
+            json.dump(result, f)
+    elif args.compare:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            compare(json.load(f), json.load(g))
+    else:
+        unknown = [case for case in args.cases if case not in _CASES]
+        if unknown:
+            parser.error('Unknown cases: {0}. Valid cases are: {1}'.format(', '.join(unknown), ', '.join(_CASES)))
+
+        results = OrderedDict([('environment', _environment()), ('args', args.args), ('repeat', args.repeat),\
+            ('quick', args.quick), ('cases', run_suite(args.cases, args.fixtures, args.args, args.repeat, args.quick))])
+
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('\nResults written to {}'.format(args.output))
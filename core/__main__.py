@@ -1,10 +1,12 @@
 import argparse
 import json
+import glob
 import logging
 import logging.config
 import os
 import sys
 import time
+import threading
 from concurrent import futures
 
 # Add Generated folder to module path.
@@ -14,10 +16,12 @@ sys.path.append(os.path.join(PARENT_DIR, 'generated'))
 import ServerSideExtension_pb2 as SSE
 import grpc
 
-# Import libraries for added functions
-import numpy as np
-import pandas as pd
-from _sas_reader import SASReader
+from _admission import AdmissionControl, AdmissionError
+from _scheduler import ChunkScheduler, PriorityError
+from _metrics import Metrics
+from _memory import MemoryTracker, MemoryLimitError
+from _cache import SASCache, DirectoryWatcher
+from _coordinator import Coordinator, ShardError
 
 # Set the default port for this SSE Extension
 _DEFAULT_PORT = '50056'
@@ -25,25 +29,135 @@ _DEFAULT_PORT = '50056'
 # Set the maximum message length for gRPC in bytes
 _MAX_MESSAGE_LENGTH = 4 * 1024 * 1024
 
+# Compression algorithms that can be applied to responses
+_COMPRESSION = {'none': grpc.Compression.NoCompression, 'gzip': grpc.Compression.Gzip, 'deflate': grpc.Compression.Deflate}
+
+# Set the default number of worker threads, and the limits for concurrently executing and queued reads
+_DEFAULT_WORKERS = 10
+_DEFAULT_MAX_READS = 4
+_DEFAULT_MAX_QUEUE = 5
+_DEFAULT_QUEUE_TIMEOUT = 600
+
+# Set the default number of chunks that can be decoded and encoded at the same time
+_DEFAULT_CHUNK_SLOTS = 2
+
+# Set the default address for the metrics endpoint, so that metrics are only exposed to local clients
+_DEFAULT_METRICS_HOST = '127.0.0.1'
+
+# Set the defaults for the directory watcher, which loads new SAS files into the cache in the background
+_DEFAULT_CACHE_DIR = 'cache'
+_DEFAULT_WATCH_INTERVAL = 30
+_DEFAULT_WATCH_SETTLE = 60
+_DEFAULT_WATCH_THREADS = 1
+
+# Set the defaults for coordinator mode, where large SAS7BDAT files are read in shards by peer SSE instances
+_DEFAULT_SHARD_PAGES = 64
+_DEFAULT_SHARD_BUFFER = 64
+
 _ONE_DAY_IN_SECONDS = 60 * 60 * 24
 _MINFLOAT = float('-inf')
 
+# Maximum number of Duals kept for each categorical column across chunks
+_MAX_CACHED_DUALS = 10000
+
+# Dual used for missing values in categorical and date columns
+_NULL_DUAL = SSE.Dual(numData=float('nan'), strData='')
+
+# Output formats for Convert_SAS
+_OUTPUT_FORMATS = ('qvd', 'csv')
+
+# Libraries for added functions are slow to load, so they are imported after the server starts listening
+np = pd = SASReader = AggregationError = CompressedFileError = ResumeError = get_date_values = get_writer = None
+_import_lock = threading.Lock()
+
+def _import_libraries():
+    """
+    Import the libraries for added functions if they have not been imported yet.
+    This is called in the background when the server starts, and before executing a function.
+    """
+    global np, pd, SASReader, AggregationError, CompressedFileError, ResumeError, get_date_values, get_writer
+
+    with _import_lock:
+        if SASReader is None:
+            start = time.time()
+            import numpy as np
+            import pandas as pd
+            from _sas_reader import SASReader
+            from _aggregate import AggregationError
+            from _compressed import CompressedFileError
+            from _checkpoint import ResumeError
+            from _writers import get_date_values, get_writer
+            logging.info('Libraries imported in {0:.2f}s'.format(time.time() - start))
+
 
 class ExtensionService(SSE.ConnectorServicer):
     """
     A SSE-plugin to provide Python data science functions for Qlik.
     """
 
-    def __init__(self, funcdef_file):
+    def __init__(self, funcdef_file, max_reads=_DEFAULT_MAX_READS, max_queue=_DEFAULT_MAX_QUEUE, queue_timeout=_DEFAULT_QUEUE_TIMEOUT,\
+        chunk_slots=_DEFAULT_CHUNK_SLOTS, compression='none', compress_functions=None, max_request_memory=None,\
+        trace_memory=False, watch_dirs=None, cache_dir=_DEFAULT_CACHE_DIR, watch_interval=_DEFAULT_WATCH_INTERVAL,\
+        watch_settle=_DEFAULT_WATCH_SETTLE, watch_threads=_DEFAULT_WATCH_THREADS, watch_io_rate=None, peers=None,\
+        shard_pages=_DEFAULT_SHARD_PAGES, shard_buffer=_DEFAULT_SHARD_BUFFER, peer_pem_dir=None):
         """
         Class initializer.
         :param funcdef_file: a function definition JSON file
+        :param max_reads: the maximum number of function calls executing at a time
+        :param max_queue: the maximum number of function calls waiting to execute
+        :param queue_timeout: the maximum time in seconds that a function call can wait in the queue
+        :param chunk_slots: the number of chunks that can be decoded and encoded at the same time
+        :param compression: the compression algorithm for responses: none, gzip or deflate
+        :param compress_functions: a list of function names or ids to compress. All functions are compressed by default.
+        :param max_request_memory: the maximum growth in resident memory in MB during a read, or None for no limit.
+        This is the growth of the whole process, so it includes memory used by concurrent reads.
+        :param trace_memory: trace Python allocations with tracemalloc to report the memory used by each read
+        :param watch_dirs: a list of directories to watch for new SAS files, which are loaded into the cache
+        :param cache_dir: the directory for decoded copies of SAS files
+        :param watch_interval: the time in seconds between polls of the watched directories
+        :param watch_settle: the time in seconds that a file must be unchanged before it is loaded into the cache
+        :param watch_threads: the number of files loaded into the cache at the same time
+        :param watch_io_rate: the maximum rate in MB/s for loading files into the cache, or None for no limit
+        :param peers: a list of peer SSE instances as host:port for reading large SAS7BDAT files in shards
+        :param shard_pages: the minimum number of pages in a shard
+        :param shard_buffer: the size in MB of the rows buffered in memory for each shard before spilling to disk
+        :param peer_pem_dir: a directory with client certificates for peers running in secure mode
         """
         self._function_definitions = funcdef_file
+        self.admission = AdmissionControl(max_reads, max_queue, queue_timeout)
+        self.scheduler = ChunkScheduler(chunk_slots)
         os.makedirs('logs', exist_ok=True)
         log_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logger.config')
         logging.config.fileConfig(log_file)
         logging.info('Logging enabled')
+        self.capabilities = self._get_capabilities()
+        self.function_names = {f.functionId: f.name for f in self.capabilities.functions}
+
+        # Metrics are collected for every call and can be scraped if the metrics endpoint is enabled
+        self.metrics = Metrics()
+        self.metrics.gauge('sse_active_requests', lambda: self.admission.active)
+        self.metrics.gauge('sse_queued_requests', lambda: self.admission.queued)
+        self.compression = _COMPRESSION[compression]
+        self.compressed_ids = self._get_function_ids(compress_functions)
+
+        # Memory is reported for every read, and reads are stopped if they exceed the limit
+        self.max_request_memory = max_request_memory * 1024 * 1024 if max_request_memory else None
+        if trace_memory:
+            MemoryTracker.start_tracing()
+
+        # Reads are served from the cache for files loaded by the directory watcher
+        self.cache = self.watcher = None
+        if watch_dirs:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), cache_dir)
+            self.cache = SASCache(cache_dir)
+            self.watcher = DirectoryWatcher(watch_dirs, self.cache, self.scheduler, watch_interval, watch_settle,\
+                watch_threads, watch_io_rate, self.metrics)
+
+        # In coordinator mode, reads of large SAS7BDAT files are split by page and read in parallel by the peers
+        self.coordinator = None
+        if peers:
+            self.coordinator = Coordinator(peers, shard_pages, shard_buffer * 1024 * 1024, peer_pem_dir, self.metrics)
+            logging.info('Coordinator mode with peers: {}'.format(', '.join(peers)))
 
     @property
     def function_definitions(self):
@@ -59,15 +173,17 @@ class ExtensionService(SSE.ConnectorServicer):
         """
         return {
             0: '_read_sas',
-            1: '_read_sas'
+            1: '_read_sas',
+            2: '_convert_sas',
+            3: '_read_sas',
+            4: '_read_sas'
         }
 
     """
     Implementation of added functions.
     """
     
-    @staticmethod
-    def _read_sas(request, context):
+    def _read_sas(self, request, context):
         """
         Read SAS files stored as either XPORT or SAS7BDAT format files.
         :
@@ -76,74 +192,435 @@ class ExtensionService(SSE.ConnectorServicer):
         :return: the SAS file as row data
         :Qlik expression examples:
         :<AAI Connection Name>.Read_SAS('data/airline.sas7bdat', 'format=sas7bdat')
+        :<AAI Connection Name>.Get_Distinct('data/airline.sas7bdat', 'REGION, STATUS', 'counts=true')
+        :<AAI Connection Name>.Profile_SAS('data/airline.sas7bdat', 'sample=0.1, top=10')
         """
         # Get the function id from the header to determine the variant being called
         function = ExtensionService._get_function_id(context)
         
         # Get a list from the generator object so that it can be iterated over multiple times
         request_list = [request_rows for request_rows in request]
+
+        # Make sure the libraries have been imported if the call arrived before the background import finished
+        _import_libraries()
+            
+        # Track the memory used by the read, from before the file is opened
+        memory = MemoryTracker(self.max_request_memory)
             
         # Create an instance of the SASReader class
         # This will take the SAS file information from Qlik and prepare the data to be read
-        reader = SASReader(request_list, context)
-        
-        if function == 1:
-            # Get labels for the variables in the SAS file
-            response = reader.get_labels()
-        else:
-            # Read the SAS data file. This returns a Pandas Data Frame or an interator if the file is to be read in chunks
-            response = reader.read()
+        try:
+            reader = SASReader(request_list, context, cache=self.cache, distinct=function == 3, statistics=function == 4,\
+                memory=memory)
+            
+            # In coordinator mode, large SAS7BDAT files are split into shards of pages that are read by the peers
+            shards = None
+            if self.coordinator is not None and function == 0:
+                shards = self.coordinator.plan(reader.get_pages())
+            
+            if shards:
+                response = None
+            elif function == 1:
+                # Get labels for the variables in the SAS file
+                response = reader.get_labels()
+            else:
+                # Read the SAS data file. This returns an iterator to read the file in chunks
+                response = reader.read()
+        except (AggregationError, CompressedFileError, ResumeError, PriorityError) as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        except MemoryLimitError as e:
+            # Files loaded with the SAS7BDAT module are read in full before the first chunk is sent
+            self.metrics.inc('sse_requests_memory_limit_total', function=self.function_names.get(function))
+            path = request_list[0].rows[0].duals[0].strData
+            message = 'Read of {0} stopped before sending any rows. {1}'.format(path, e)
+            logging.warning(message)
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, message)
+
+        if shards:
+            for bundle in self._read_shards(reader, request_list, shards, context, function):
+                yield bundle
+            return
 
         # The function will only send a maximum number of cells per bundle
         _MAX_CELLS = 10000
         
-        if isinstance(response, pd.DataFrame):
-            # Convert the response to a list of rows
-            response_list = response.values.tolist()
+        # Duals built for categorical columns are reused across chunks
+        dual_cache = {}
+        
+        chunks = ExtensionService._get_chunks(response, reader.chunksize)
+        
+        # Register with the scheduler, which interleaves the decoding and encoding of chunks across requests
+        ticket = self.scheduler.register(reader.priority)
 
-            # We convert values to type SSE.Dual, and group columns into a iterable
-            response_rows = []
+        # Stop reading as soon as the call is cancelled, e.g. when a reload is aborted in Qlik
+        cancelled = threading.Event()
+        context.add_callback(cancelled.set)
+        rows_sent = 0
+        complete = False
 
-            for row in response_list:
-                response_rows.append(ExtensionService._get_duals(row))
+        # Time the decoding of chunks and encoding of bundles for the metrics
+        name = self.function_names.get(function)
+        chunks = self.metrics.timed('sse_chunk_decode_seconds', chunks, function=name)
+        chunks = reader.timer.timed('decode', chunks, rows=len)
 
-            # Values are then structured as SSE.Rows
-            response_rows = [SSE.Row(duals=duals) for duals in response_rows]      
+        try:
+            # Each chunk is decoded in a turn, and each bundle is encoded in a turn, with the cost measured in cells
+            for chunk in self.scheduler.interleave(ticket, chunks, reader.get_cost):
+                # Aggregated reads yield empty chunks until the aggregation is complete
+                if len(chunk) == 0:
+                    if cancelled.is_set() or not context.is_active():
+                        return
+                    memory.sample()
+                    continue
+
+                bundles = ExtensionService._get_bundles(chunk, dual_cache, reader.column_types, _MAX_CELLS)
+                bundles = self.metrics.timed('sse_bundle_encode_seconds', bundles, function=name)
+                bundles = reader.timer.timed('encode', bundles, rows=lambda b: len(b.rows), size=lambda b: b.ByteSize())
+                
+                # Stream the chunk as BundledRows
+                for bundle in self.scheduler.interleave(ticket, bundles, lambda bundle: len(bundle.rows) * chunk.shape[1]):
+                    if cancelled.is_set() or not context.is_active():
+                        return
+                    
+                    # Memory is sampled once a chunk has been decoded and each bundle encoded
+                    memory.sample()
+
+                    # The size is cached in the message, so gRPC does not calculate it again when serializing
+                    self.metrics.inc('sse_bytes_total', bundle.ByteSize(), function=name)
+                    self.metrics.inc('sse_rows_total', len(bundle.rows), function=name)
+                    self.metrics.inc('sse_bundles_total', function=name)
+                    
+                    # Time spent in gRPC, including waiting for Qlik to accept more data
+                    with reader.timer.stage('send'):
+                        yield bundle
+                    rows_sent += len(bundle.rows)
+            
+            complete = True
+        except MemoryLimitError as e:
+            # Stop the read before the host runs out of memory
+            self.metrics.inc('sse_requests_memory_limit_total', function=name)
+            message = 'Read of {0} stopped after sending {1} rows. {2}'.format(reader.filepath, rows_sent, e)
+            logging.warning(message)
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, message)
+        finally:
+            self.metrics.inc('sse_decode_memo_hits_total', reader.memo_hits, function=name)
+            self.metrics.inc('sse_decode_memo_misses_total', reader.memo_misses, function=name)
+            if self.cache is not None:
+                self.metrics.inc('sse_cache_hits_total' if reader.cache_hit else 'sse_cache_misses_total', function=name)
+
+            # Log the work skipped if the read was cancelled, or if gRPC stopped consuming the response
+            if not complete:
+                total = reader.get_row_count()
+                if cancelled.is_set() or not context.is_active():
+                    self.metrics.inc('sse_requests_cancelled_total', function=name)
+                logging.info('Read {0} after sending {1} of {2} rows. Skipped {3} rows.'.format(\
+                    'cancelled by the client' if cancelled.is_set() or not context.is_active() else 'stopped',\
+                    rows_sent, 'unknown' if total is None else total, 'remaining' if total is None else total - rows_sent))
+
+            # Close the file reader
+            if not isinstance(response, pd.DataFrame):
+                response.close()
+
+            # Write the time spent in each stage to the log if profile = true
+            reader.log_profile()
+
+            # Report the memory used by the read, with the file and parameters to identify reads that need the most memory
+            if memory.rss_growth is not None:
+                self.metrics.observe('sse_request_rss_growth_bytes', memory.rss_growth, function=name)
+            if memory.traced_growth is not None:
+                self.metrics.observe('sse_request_python_growth_bytes', memory.traced_growth, function=name)
+            logging.info('Memory for {0} of {1} ({2} rows sent, parameters: {3}): {4}'.format(name, reader.filepath,\
+                rows_sent, reader.get_params(), memory.summary()))
+    
+    def _read_shards(self, reader, request_list, shards, context, function):
+        """
+        Stream the rows of a SAS file read in shards by the peers, in the order of the file.
+        :param reader: the SASReader for the request
+        :param request_list: the request, which is passed on to the peers with the pages for each shard
+        :param shards: a list of page ranges from Coordinator.plan
+        :param context: the context
+        :param function: the function id
+        :return: the SAS file as row data
+        """
+        name = self.function_names.get(function)
+        start = time.time()
+        rows_sent = 0
+        complete = False
 
-            # Calculate number of rows per bundle, adjusting for overheads of data structures
-            rows_per_bundle = _MAX_CELLS//response.shape[1]
+        logging.info('Read of {0} split into {1} shards of pages: {2}'.format(reader.filepath, len(shards),\
+            ', '.join('{0}:{1}'.format(first, last) for first, last in shards)))
+        self.metrics.inc('sse_shards_total', len(shards), function=name)
 
-            # Stream response as BundledRows
-            for i in range(0, len(response_rows), rows_per_bundle):
-                # Yield Row data as Bundled rows
-                yield SSE.BundledRows(rows=response_rows[i : i + rows_per_bundle])
-        
-        else:
-             for chunk in response:              
-                # Convert the chunk to a list of rows
-                response_list = chunk.values.tolist()
+        try:
+            # BundledRows from the peers are forwarded as they were serialized
+            for data, rows in self.coordinator.read(request_list, shards, context, function):
+                self.metrics.inc('sse_bytes_total', len(data), function=name)
+                self.metrics.inc('sse_rows_total', rows, function=name)
+                self.metrics.inc('sse_bundles_total', function=name)
+
+                with reader.timer.stage('send'):
+                    yield data
+                rows_sent += rows
+            
+            complete = True
+        except ShardError as e:
+            # Errors are not sent if the call was cancelled by the client
+            if context.is_active():
+                logging.warning('Read of {0} failed after sending {1} rows. {2}'.format(reader.filepath, rows_sent, e))
+                context.abort(e.code, str(e))
+        finally:
+            if not complete and not context.is_active():
+                self.metrics.inc('sse_requests_cancelled_total', function=name)
+            logging.info('Read of {0} in {1} shards {2} after sending {3} rows in {4:.2f}s'.format(reader.filepath,\
+                len(shards), 'completed' if complete else 'stopped', rows_sent, time.time() - start))
+            reader.log_profile()
+    
+    def _convert_sas(self, request, context):
+        """
+        Convert SAS files to QVD or CSV files on the server, without streaming the data to Qlik.
+        :
+        :param request: an iterable sequence of RowData
+        :param context:
+        :return: a status row for each file with the output file, rows written and elapsed time
+        :Qlik expression examples:
+        :<AAI Connection Name>.Convert_SAS('data/*.sas7bdat', 'output=qvd, threads=4', 'C:/QVDs')
+        """
+        request_list = [request_rows for request_rows in request]
+        _import_libraries()
 
-                # We convert values to type SSE.Dual, and group columns into a iterable
-                response_rows = []
+        # The path can be a pattern to convert several files. The target is a directory or, for a single file, a file.
+        row = request_list[0].rows[0]
+        pattern = row.duals[0].strData
+        target = row.duals[2].strData if len(row.duals) > 2 else ''
+        files = sorted(glob.glob(pattern)) or [pattern]
 
-                # Append rows to the response
-                for row in response_list:
-                    response_rows.append(ExtensionService._get_duals(row))
+        # Memory is tracked across the files, and sampled as each chunk is read
+        memory = MemoryTracker(self.max_request_memory)
 
-                # Values are then structured as SSE.Rows
-                response_rows = [SSE.Row(duals=duals) for duals in response_rows]      
+        # Each file gets its own reader, so that each is logged and scheduled as a separate read
+        try:
+            readers = [SASReader(request_list, context, filepath=path, cache=self.cache, memory=memory) for path in files]
+        except (AggregationError, CompressedFileError, ResumeError, PriorityError) as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+        output, threads = readers[0].output, readers[0].threads
+
+        if output not in _OUTPUT_FORMATS:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "Unsupported output format: {0}. Valid formats are: {1}"\
+                .format(output, ', '.join(_OUTPUT_FORMATS)))
+
+        # Send the description of the status table
+        table = SSE.TableDescription(name='SAS_Conversion')
+        table.fields.add(name='file')
+        table.fields.add(name='output')
+        table.fields.add(name='rows', dataType=SSE.NUMERIC)
+        table.fields.add(name='seconds', dataType=SSE.NUMERIC)
+        table.fields.add(name='status')
+        context.send_initial_metadata((('qlik-tabledescription-bin', table.SerializeToString()),))
+
+        # Stop the conversions if the call is cancelled
+        cancelled = threading.Event()
+        context.add_callback(cancelled.set)
+        executor = futures.ThreadPoolExecutor(max_workers=max(1, min(threads, len(files))))
+
+        try:
+            pending = {}
+            outputs = {}
 
-                # Calculate number of rows per bundle, adjusting for overheads of data structures
-                rows_per_bundle = _MAX_CELLS//chunk.shape[1]
+            for reader in readers:
+                path = self._get_output_path(reader.filepath, reader.get_dataset_name(), target, output, len(files))
 
-                # Stream response as BundledRows
-                for i in range(0, len(response_rows), rows_per_bundle):
-                    # Yield Row data as Bundled rows
-                    yield SSE.BundledRows(rows=response_rows[i : i + rows_per_bundle])
+                # Files with the same name but a different format, e.g. data.xpt and data.sas7bdat, are not overwritten
+                if path in outputs:
+                    yield self._get_status_row(reader.filepath, path, 0, 0, 'Error: {0} is also the output for {1}'\
+                        .format(path, outputs[path]))
+                    continue
+
+                outputs[path] = reader.filepath
+                pending[executor.submit(self._convert_file, reader, path, output, cancelled, memory)] = reader
+
+            # Send a status row as each file is completed
+            for future in futures.as_completed(pending):
+                yield self._get_status_row(pending[future].filepath, *future.result())
+        finally:
+            cancelled.set()
+            executor.shutdown(wait=True)
+
+    def _convert_file(self, reader, path, output, cancelled, memory):
+        """
+        Convert a file in chunks, taking turns with other requests to decode and write each chunk.
+        :return: the output path, rows written, elapsed time and status
+        """
+        start = time.time()
+        name = self.function_names.get(2)
+        rows = 0
+        writer = None
+        response = None
+
+        try:
+            writer = get_writer(path, output, os.path.splitext(os.path.basename(reader.filepath))[0])
+            response = reader.read(describe=False)
+            ticket = self.scheduler.register(reader.priority)
+            chunks = reader.timer.timed('decode', ExtensionService._get_chunks(response, reader.chunksize), rows=len)
+
+            for chunk in self.scheduler.interleave(ticket, chunks, reader.get_cost):
+                if cancelled.is_set():
+                    writer.discard()
+                    return path, rows, time.time() - start, 'Cancelled'
+
+                # Aggregated reads yield empty chunks until the aggregation is complete
+                if len(chunk) == 0:
+                    memory.sample()
+                    continue
+
+                with self.scheduler.turn(ticket) as turn, reader.timer.stage('write'):
+                    writer.write(chunk, reader.column_types)
+                    turn.cost = chunk.size
+
+                rows += len(chunk)
+                self.metrics.inc('sse_rows_converted_total', len(chunk), function=name)
+                memory.sample()
+
+            with reader.timer.stage('close'):
+                writer.close()
+            status = 'OK'
+        except Exception as e:
+            if writer is not None:
+                writer.discard()
+            if isinstance(e, MemoryLimitError):
+                self.metrics.inc('sse_requests_memory_limit_total', function=name)
+            logging.warning('Conversion of {0} failed: {1}'.format(reader.filepath, e))
+            status = 'Error: {}'.format(e)
+        finally:
+            if response is not None and not isinstance(response, pd.DataFrame):
+                response.close()
+            reader.log_profile()
+
+        logging.info('Converted {0} to {1}: {2} rows in {3:.2f}s. {4}'.format(reader.filepath, path, rows,\
+            time.time() - start, memory.summary()))
+        return path, rows, time.time() - start, status
+
+    @staticmethod
+    def _get_status_row(filepath, path, rows, seconds, status):
+        """
+        Get a row of the status table returned by Convert_SAS.
+        """
+        return SSE.BundledRows(rows=[SSE.Row(duals=[SSE.Dual(strData=filepath), SSE.Dual(strData=path),\
+            SSE.Dual(numData=rows), SSE.Dual(numData=seconds), SSE.Dual(strData=status)])])
+
+    @staticmethod
+    def _get_output_path(path, name, target, output, count):
+        """
+        Get the output file for a SAS file.
+        :param path: the SAS file
+        :param name: the name of the dataset, which differs from the path for compressed files e.g. data.sas7bdat.gz
+        :param target: a directory, or an output file if a single file is being converted
+        :param output: the output format, used as the file extension in a directory
+        :param count: the number of files being converted
+        """
+        if count == 1 and target.lower().endswith('.' + output):
+            return target
+
+        directory = target or os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, os.path.splitext(os.path.basename(name))[0] + '.' + output)
+
+    @staticmethod
+    def _get_chunks(response, chunksize):
+        """
+        Get an iterator of data frames from the response of SASReader.read.
+        Data frames are sliced so that the work can be interleaved with other requests.
+        """
+        if isinstance(response, pd.DataFrame):
+            return (response.iloc[i : i + chunksize] for i in range(0, len(response), chunksize))
+        
+        return iter(response)
+
+    @staticmethod
+    def _get_bundles(df, cache, types, max_cells):
+        """
+        Transforms a data frame to an iterable of SSE.BundledRows.
+        Rows are added to each bundle in place to avoid copying the messages more than once.
+        :param df: a pandas data frame
+        :param cache: a dictionary of Duals already built for categorical columns, keyed by column name
+        :param types: a dictionary of date, datetime and numeric columns, keyed by column name
+        :param max_cells: the maximum number of cells per bundle
+        :return: a generator of SSE.BundledRows
+        """
+        # Calculate number of rows per bundle, adjusting for overheads of data structures
+        rows_per_bundle = max_cells//df.shape[1]
+
+        for i in range(0, len(df), rows_per_bundle):
+            bundle = SSE.BundledRows()
+            
+            # Values are structured as SSE.Rows within the bundle
+            for duals in zip(*ExtensionService._get_columns(df.iloc[i : i + rows_per_bundle], cache, types)):
+                bundle.rows.add().duals.extend(duals)
             
-             # Close the file reader
-             response.close()
+            yield bundle
     
+    @staticmethod
+    def _get_columns(df, cache, types):
+        """
+        Transforms each column in a data frame to a sequence of duals.
+        Categorical columns reuse a single Dual for each distinct value.
+        :param df: a pandas data frame
+        :param cache: a dictionary of Duals already built for categorical columns, keyed by column name
+        :param types: a dictionary of date, datetime and numeric columns, keyed by column name
+        :return: a list with a sequence of duals for each column
+        """
+        columns = []
+
+        for name in df.columns:
+            series = df[name]
+
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                duals = cache.setdefault(name, {})
+
+                # Start again for a column with more categories across chunks than the cache can hold
+                if len(duals) + len(series.cat.categories) > _MAX_CACHED_DUALS:
+                    duals.clear()
+                
+                # Build a Dual for each category not seen in previous chunks
+                for value in series.cat.categories:
+                    if value not in duals:
+                        duals[value] = next(ExtensionService._get_duals([value]))
+                
+                # Set up a lookup array with the null Dual placed last so that the code -1 maps to it
+                lookup = np.empty(len(series.cat.categories) + 1, dtype=object)
+                lookup[:-1] = [duals[value] for value in series.cat.categories]
+                lookup[-1] = _NULL_DUAL
+
+                columns.append(lookup.take(series.cat.codes.values))
+            elif types.get(name) == 'numeric':
+                # Numeric columns are sent without a text representation. Missing values are sent as NaN.
+                columns.append([SSE.Dual(numData=value) for value in series.tolist()])
+            elif name in types:
+                columns.append(ExtensionService._get_date_duals(series, types[name]))
+            else:
+                columns.append(list(ExtensionService._get_duals(series.tolist())))
+        
+        return columns
+
+    @staticmethod
+    def _get_date_duals(series, column_type):
+        """
+        Transforms a column of dates or datetimes to duals with Qlik serial numbers and formatted text.
+        :param series: a pandas series of timestamps, or numbers in the SAS date or datetime representation
+        :param column_type: 'date' or 'datetime'
+        :return: a list of duals
+        """
+        serials, texts = get_date_values(series, column_type)
+        
+        duals = []
+        for num, text in zip(serials.tolist(), texts.tolist()):
+            if pd.isnull(num):
+                duals.append(_NULL_DUAL)
+            else:
+                duals.append(SSE.Dual(numData=num, strData=text if isinstance(text, str) else str(num)))
+        
+        return duals
+
     @staticmethod
     def _get_duals(row):
         """
@@ -197,6 +674,14 @@ class ExtensionService(SSE.ConnectorServicer):
         """
         logging.info('GetCapabilities')
 
+        # The capabilities are built once when the service starts, as Qlik requests them each time it connects
+        return self.capabilities
+
+    def _get_capabilities(self):
+        """
+        Build the capabilities message from the function definitions.
+        :return: the capabilities.
+        """
         # Create an instance of the Capabilities grpc message
         # Enable(or disable) script evaluation
         # Set values for pluginIdentifier and pluginVersion
@@ -223,6 +708,22 @@ class ExtensionService(SSE.ConnectorServicer):
 
         return capabilities
 
+    def _get_function_ids(self, functions):
+        """
+        Get the ids for a list of function names or ids.
+        :param functions: a list of function names or ids, or None for all functions
+        :return: a set of function ids
+        """
+        ids = {f.name.lower(): f.functionId for f in self.capabilities.functions}
+
+        if not functions:
+            return set(ids.values())
+
+        try:
+            return set(int(f) if f.isdigit() else ids[f.lower()] for f in functions)
+        except KeyError as e:
+            raise AAIException("Unknown function {0}. Valid functions are: {1}".format(e, sorted(ids)))
+
     def ExecuteFunction(self, request_iterator, context):
         """
         Call corresponding function based on function id sent in header.
@@ -233,26 +734,174 @@ class ExtensionService(SSE.ConnectorServicer):
         # Retrieve function id
         func_id = self._get_function_id(context)
         logging.info('ExecuteFunction (functionId: {})'.format(func_id))
+        self.metrics.inc('sse_requests_total', function=self.function_names.get(func_id))
+
+        # Compress the response if required for this function
+        if self.compression != grpc.Compression.NoCompression and func_id in self.compressed_ids:
+            context.set_compression(self.compression)
+
+        return self._admit(getattr(self, self.functions[func_id]), request_iterator, context)
+
+    def _admit(self, function, request_iterator, context):
+        """
+        Execute the function once a slot is available, holding the slot until the response has been streamed.
+        Calls are rejected with RESOURCE_EXHAUSTED if the queue is full or the wait times out, and leave the queue as
+        soon as they are cancelled.
+        :param function: the function implementation
+        :param request_iterator: an iterable sequence of RowData.
+        :param context: the context.
+        :return: an iterable sequence of RowData.
+        """
+        # Stop waiting in the queue as soon as the call is cancelled
+        cancelled = threading.Event()
+
+        def cancel():
+            cancelled.set()
+            self.admission.wake()
 
-        return getattr(self, self.functions[func_id])(request_iterator, context)
+        context.add_callback(cancel)
+        if not context.is_active():
+            cancelled.set()
+
+        try:
+            wait = self.admission.acquire(cancelled)
+        except AdmissionError as e:
+            logging.warning('Function call rejected: {}'.format(e))
+            self.metrics.inc('sse_requests_rejected_total')
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(e))
+
+        if wait is None:
+            logging.info('Function call cancelled by the client while waiting in the queue')
+            return
+
+        logging.info('Function call admitted after waiting {0:.3f}s (executing: {1}, queue depth: {2})'\
+            .format(wait, self.admission.active, self.admission.queued))
+
+        # Skip the call if it was cancelled just as it was admitted
+        if not context.is_active():
+            logging.info('Function call cancelled by the client while waiting in the queue')
+            self.admission.release()
+            return
+
+        try:
+            for response in function(request_iterator, context):
+                yield response
+        finally:
+            self.admission.release()
 
     """
     Implementation of the Server connecting to gRPC.
     """
 
-    def Serve(self, port, pem_dir):
+    def Serve(self, port, pem_dir, workers=_DEFAULT_WORKERS, aio=False, max_message_length=_MAX_MESSAGE_LENGTH,\
+        window_size=None, keepalive_time=None, keepalive_timeout=None, metrics_port=None,\
+        metrics_host=_DEFAULT_METRICS_HOST):
         """
         Server
         :param port: port to listen on.
         :param pem_dir: Directory including certificates
+        :param workers: number of worker threads. Calls beyond this number are rejected by gRPC.
+        :param aio: use the asyncio server, where worker threads are only held while queued, decoding or encoding data
+        :param max_message_length: the maximum message length in bytes
+        :param window_size: the initial HTTP/2 flow control window in bytes for data received by this server.
+        Responses streamed to Qlik are governed by the client's window, so this does not limit them.
+        :param keepalive_time: the interval in seconds for sending keepalive pings
+        :param keepalive_timeout: the time in seconds to wait for a keepalive ping to be acknowledged
+        :param metrics_port: port for the HTTP endpoint serving metrics in the Prometheus text format
+        :param metrics_host: address for the metrics endpoint to bind to, e.g. 0.0.0.0 for all interfaces
         :return: None
         """
-        server = grpc.server(futures.ThreadPoolExecutor(max_workers=10),\
-        options=[('grpc.max_message_length', _MAX_MESSAGE_LENGTH),('grpc.max_send_message_length', _MAX_MESSAGE_LENGTH),\
-        ('grpc.max_receive_message_length', _MAX_MESSAGE_LENGTH),('grpc.max_metadata_size', _MAX_MESSAGE_LENGTH)])
+        # Queued calls hold a worker thread, also with the asyncio server, so leave a thread free for GetCapabilities
+        if workers <= self.admission.max_active + self.admission.max_queued:
+            logging.warning('Worker threads ({0}) should exceed max_reads + max_queue ({1})'\
+                .format(workers, self.admission.max_active + self.admission.max_queued))
+
+        if metrics_port:
+            self.metrics.serve(metrics_port, metrics_host)
+            logging.info('*** Serving metrics on {0}:{1} ***'.format(metrics_host, metrics_port))
+
+        options = self._get_options(max_message_length, window_size, keepalive_time, keepalive_timeout)
+
+        if self.watcher is not None:
+            self.watcher.start()
+
+        if aio:
+            # The asyncio server is only imported when required as it needs a recent version of grpcio
+            from _aio_server import serve_aio
+            serve_aio(self, port, pem_dir, workers, options)
+            return
+
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers), maximum_concurrent_rpcs=workers,\
+        options=options)
+
+        self._add_servicer(self, server)
+        self._add_port(server, port, pem_dir)
+
+        server.start()
+        self._prewarm()
+        try:
+            while True:
+                time.sleep(_ONE_DAY_IN_SECONDS)
+        except KeyboardInterrupt:
+            server.stop(0)
+
+    @staticmethod
+    def _get_options(max_message_length, window_size, keepalive_time, keepalive_timeout):
+        """
+        Get the gRPC channel options for the server.
+        :return: a list of channel options
+        """
+        options = [('grpc.max_message_length', max_message_length),('grpc.max_send_message_length', max_message_length),\
+        ('grpc.max_receive_message_length', max_message_length),('grpc.max_metadata_size', max_message_length)]
+
+        if window_size:
+            # This only sets the window for data received by the server. Bandwidth-delay probes still grow the window.
+            options.append(('grpc.http2.lookahead_bytes', window_size))
+
+        if keepalive_time:
+            options += [('grpc.keepalive_time_ms', int(keepalive_time * 1000)), ('grpc.keepalive_permit_without_calls', 1)]
 
-        SSE.add_ConnectorServicer_to_server(self, server)
+        if keepalive_timeout:
+            options.append(('grpc.keepalive_timeout_ms', int(keepalive_timeout * 1000)))
+
+        return options
+
+    @staticmethod
+    def _prewarm():
+        """
+        Import the libraries for added functions in a background thread, so that the port is open while they load.
+        """
+        threading.Thread(target=_import_libraries, name='prewarm', daemon=True).start()
 
+    @staticmethod
+    def _add_servicer(servicer, server):
+        """
+        Add the connector to the server, as in ServerSideExtension_pb2.add_ConnectorServicer_to_server.
+        Responses from ExecuteFunction can also be BundledRows that are already serialized, e.g. when they are forwarded
+        from peers in coordinator mode, and these are sent as they are.
+        :param servicer: the servicer implementing the connector
+        :param server: a grpc server
+        :return: None
+        """
+        handlers = {
+            'GetCapabilities': grpc.unary_unary_rpc_method_handler(servicer.GetCapabilities,\
+                request_deserializer=SSE.Empty.FromString, response_serializer=SSE.Capabilities.SerializeToString),
+            'ExecuteFunction': grpc.stream_stream_rpc_method_handler(servicer.ExecuteFunction,\
+                request_deserializer=SSE.BundledRows.FromString, response_serializer=_serialize_bundle),
+            'EvaluateScript': grpc.stream_stream_rpc_method_handler(servicer.EvaluateScript,\
+                request_deserializer=SSE.BundledRows.FromString, response_serializer=_serialize_bundle)
+        }
+        server.add_generic_rpc_handlers((grpc.method_handlers_generic_handler('qlik.sse.Connector', handlers),))
+
+    @staticmethod
+    def _add_port(server, port, pem_dir):
+        """
+        Add a secure port to the server if a certificate directory is provided, or an insecure port otherwise.
+        :param server: a grpc server
+        :param port: port to listen on.
+        :param pem_dir: Directory including certificates
+        :return: None
+        """
         if pem_dir:
             # Secure connection
             with open(os.path.join(pem_dir, 'sse_server_key.pem'), 'rb') as f:
@@ -269,12 +918,11 @@ class ExtensionService(SSE.ConnectorServicer):
             server.add_insecure_port('[::]:{}'.format(port))
             logging.info('*** Running server in insecure mode on port: {} ***'.format(port))
 
-        server.start()
-        try:
-            while True:
-                time.sleep(_ONE_DAY_IN_SECONDS)
-        except KeyboardInterrupt:
-            server.stop(0)
+def _serialize_bundle(bundle):
+    """
+    Serialize BundledRows for gRPC, passing through messages that have already been serialized.
+    """
+    return bundle if isinstance(bundle, bytes) else bundle.SerializeToString()
 
 class AAIException(Exception):
     """
@@ -283,14 +931,45 @@ class AAIException(Exception):
     pass
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
+    # Arguments can also be read from a file, one per line, e.g. python __main__.py @sse.args
+    parser = argparse.ArgumentParser(fromfile_prefix_chars='@')
     parser.add_argument('--port', nargs='?', default=_DEFAULT_PORT)
     parser.add_argument('--pem_dir', nargs='?')
     parser.add_argument('--definition_file', nargs='?', default='functions.json')
+    parser.add_argument('--workers', nargs='?', type=int, default=_DEFAULT_WORKERS)
+    parser.add_argument('--max_reads', nargs='?', type=int, default=_DEFAULT_MAX_READS)
+    parser.add_argument('--max_queue', nargs='?', type=int, default=_DEFAULT_MAX_QUEUE)
+    parser.add_argument('--queue_timeout', nargs='?', type=float, default=_DEFAULT_QUEUE_TIMEOUT)
+    parser.add_argument('--chunk_slots', nargs='?', type=int, default=_DEFAULT_CHUNK_SLOTS)
+    parser.add_argument('--aio', action='store_true')
+    parser.add_argument('--compression', nargs='?', choices=sorted(_COMPRESSION), default='none')
+    parser.add_argument('--compress_functions', nargs='?', type=lambda s: [f.strip() for f in s.split(',')])
+    parser.add_argument('--max_message_length', nargs='?', type=int, default=_MAX_MESSAGE_LENGTH)
+    parser.add_argument('--window_size', nargs='?', type=int)
+    parser.add_argument('--keepalive_time', nargs='?', type=float)
+    parser.add_argument('--keepalive_timeout', nargs='?', type=float)
+    parser.add_argument('--metrics_port', nargs='?', type=int)
+    parser.add_argument('--metrics_host', nargs='?', default=_DEFAULT_METRICS_HOST)
+    parser.add_argument('--max_request_memory', nargs='?', type=float)
+    parser.add_argument('--trace_memory', action='store_true')
+    parser.add_argument('--watch_dirs', nargs='?', type=lambda s: [d.strip() for d in s.split(',')])
+    parser.add_argument('--cache_dir', nargs='?', default=_DEFAULT_CACHE_DIR)
+    parser.add_argument('--watch_interval', nargs='?', type=float, default=_DEFAULT_WATCH_INTERVAL)
+    parser.add_argument('--watch_settle', nargs='?', type=float, default=_DEFAULT_WATCH_SETTLE)
+    parser.add_argument('--watch_threads', nargs='?', type=int, default=_DEFAULT_WATCH_THREADS)
+    parser.add_argument('--watch_io_rate', nargs='?', type=float)
+    parser.add_argument('--peers', nargs='?', type=lambda s: [p.strip() for p in s.split(',') if p.strip()])
+    parser.add_argument('--shard_pages', nargs='?', type=int, default=_DEFAULT_SHARD_PAGES)
+    parser.add_argument('--shard_buffer', nargs='?', type=float, default=_DEFAULT_SHARD_BUFFER)
+    parser.add_argument('--peer_pem_dir', nargs='?')
     args = parser.parse_args()
 
     # need to locate the file when script is called from outside it's location dir.
     def_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), args.definition_file)
 
-    calc = ExtensionService(def_file)
-    calc.Serve(args.port, args.pem_dir)
+    calc = ExtensionService(def_file, args.max_reads, args.max_queue, args.queue_timeout, args.chunk_slots,\
+        args.compression, args.compress_functions, args.max_request_memory, args.trace_memory, args.watch_dirs,\
+        args.cache_dir, args.watch_interval, args.watch_settle, args.watch_threads, args.watch_io_rate, args.peers,\
+        args.shard_pages, args.shard_buffer, args.peer_pem_dir)
+    calc.Serve(args.port, args.pem_dir, args.workers, args.aio, args.max_message_length, args.window_size,\
+        args.keepalive_time, args.keepalive_timeout, args.metrics_port, args.metrics_host)
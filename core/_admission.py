@@ -0,0 +1,87 @@
+import threading
+import time
+
+class AdmissionControl:
+    """
+    A class to limit the number of reads executing concurrently.
+    Requests beyond the limit wait in a bounded queue and are rejected if the queue is full or the wait times out.
+    """
+
+    def __init__(self, max_active, max_queued, timeout):
+        """
+        Class initializer.
+        :param max_active: the maximum number of requests executing at a time
+        :param max_queued: the maximum number of requests waiting to execute
+        :param timeout: the maximum time in seconds that a request can wait in the queue
+        """
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.timeout = timeout
+
+        # Counters for executing and waiting requests, protected by the condition's lock
+        self.active = 0
+        self.queued = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, cancelled=None):
+        """
+        Wait for a slot to execute a request.
+        :param cancelled: an optional threading.Event set when the request is cancelled. Call wake after setting it
+        so that the request stops waiting straight away.
+        :return: the time in seconds spent waiting in the queue, or None if the request was cancelled while waiting
+        :raises AdmissionError: if the queue is full or the request timed out while waiting
+        """
+        start = time.time()
+
+        with self._condition:
+            # Execute immediately if there is a free slot and no one is waiting ahead of this request
+            if self.active < self.max_active and self.queued == 0:
+                self.active += 1
+                return 0.0
+
+            # Reject the request quickly if the queue is full
+            if self.queued >= self.max_queued:
+                raise AdmissionError("Server busy: {0} requests executing and {1} waiting. Retry later."\
+                    .format(self.active, self.queued))
+
+            is_cancelled = cancelled.is_set if cancelled is not None else lambda: False
+
+            self.queued += 1
+            try:
+                if not self._condition.wait_for(lambda: self.active < self.max_active or is_cancelled(),\
+                    self.timeout):
+                    raise AdmissionError("Server busy: request timed out after waiting {0} seconds in the queue."\
+                        .format(self.timeout))
+
+                # Leave the slot for the next request if this one was cancelled
+                if is_cancelled():
+                    if self.active < self.max_active:
+                        self._condition.notify()
+                    return None
+
+                self.active += 1
+            finally:
+                self.queued -= 1
+
+        return time.time() - start
+
+    def wake(self):
+        """
+        Wake up waiting requests so that they check whether they have been cancelled.
+        """
+        with self._condition:
+            self._condition.notify_all()
+
+    def release(self):
+        """
+        Free the slot held by a request and wake up the next waiting request.
+        """
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+class AdmissionError(Exception):
+    """
+    Exception raised when a request cannot be admitted for execution
+    """
+    pass
@@ -0,0 +1,364 @@
+import os
+import pickle
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+from _writers import get_timestamps
+
+# Aggregation functions that can be passed in the agg argument
+FUNCTIONS = ('sum', 'count', 'min', 'max', 'mean', 'count_distinct')
+
+# Periods that date and datetime group keys can be truncated to, e.g. groupby=DT:month
+_PERIODS = {'year': 'Y', 'quarter': 'Q', 'month': 'M', 'day': 'D'}
+
+# Functions used to merge the partial aggregates from each chunk
+_MERGE = {'sum': 'sum', 'count': 'sum', 'size': 'sum', 'min': 'min', 'max': 'max'}
+
+# Partial aggregates are merged once the rows buffered from chunks reach this number, or the number of groups if larger
+_MIN_COMPACT_ROWS = 100000
+
+# Number of files that groups are spread across when the aggregate is spilled to disk
+_SPILL_PARTITIONS = 16
+
+class Aggregator:
+    """
+    A class to aggregate a SAS dataset by group keys one chunk at a time, so that only the result is sent to Qlik.
+    Each chunk is reduced to partial aggregates with vectorized pandas operations, e.g. a sum and count for a mean.
+    Partial aggregates are merged as they build up. If the number of groups held exceeds the limit, the groups are
+    spilled to files on disk, partitioned by a hash of the group keys, and each partition is merged separately at the end.
+    """
+
+    def __init__(self, groupby, agg, max_groups, spill_dir=None):
+        """
+        Class initializer.
+        :param groupby: a list of tuples of the column and the period to truncate dates to, or None
+        :param agg: a list of tuples of the column, or None to count rows, and the aggregation function.
+        An empty list gives the distinct combinations of the group keys.
+        :param max_groups: the maximum number of groups, and distinct values for count_distinct, held in memory
+        :param spill_dir: the directory for spill files. The system temporary directory is used by default.
+        """
+        self.groupby = groupby
+        self.agg = agg
+        self.max_groups = max_groups
+        self.spill_dir = spill_dir
+
+        # Names of the output columns for the group keys and aggregates
+        self.keys = [col if period is None else '{0}_{1}'.format(col, period) for col, period in self.groupby]
+        self.names = ['count' if col is None else '{0}_{1}'.format(col, func) for col, func in self.agg]
+        self.columns = self.keys + self.names
+
+        # Without group keys, every row is in a single group for the totals
+        self.group_keys = self.keys or ['__all']
+
+        # Source columns needed for the aggregation
+        self.source_columns = []
+        for col in [col for col, _ in self.groupby] + [col for col, _ in self.agg if col is not None]:
+            if col not in self.source_columns:
+                self.source_columns.append(col)
+
+        # Partial aggregates for each chunk. Every group has a row count so that groups exist without other aggregates.
+        self.partials = [('__rows', None, 'size')]
+        for name, (col, func) in zip(self.names, self.agg):
+            if col is None:
+                continue
+            elif func == 'mean':
+                self.partials += [(name + '__sum', col, 'sum'), (name + '__count', col, 'count')]
+            elif func != 'count_distinct':
+                self.partials.append((name, col, func))
+
+        self.distinct_columns = sorted(set(col for col, func in self.agg if func == 'count_distinct'))
+        self.source_types = {}
+
+        # Names of the min and max partial aggregates for string columns, which are set from the sample data
+        self.string_extremes = set()
+
+        # The merged partial aggregates, and the distinct values for each column, along with the chunks not yet merged
+        self.state = None
+        self.distinct = {}
+        self.buffer = []
+        self.buffered_rows = 0
+        self.spill_path = None
+
+    def describe(self, sample_data, column_types):
+        """
+        Check the columns against the dataset and get the column types for the output.
+        :param sample_data: a data frame with sample rows from the dataset
+        :param column_types: the date, datetime and numeric columns in the dataset, keyed by column name
+        :return: the date, datetime and numeric columns in the output, keyed by column name
+        :raises AggregationError: if a column is not in the dataset, or cannot be used with the aggregation function
+        """
+        unknown = [col for col in self.source_columns if col not in sample_data.columns]
+        if unknown:
+            raise AggregationError("Columns not found in the SAS file: {0}. Valid columns are: {1}"\
+                .format(', '.join(unknown), ', '.join(sample_data.columns)))
+
+        self.source_types = dict(column_types)
+        output_types = {}
+
+        for (col, period), key in zip(self.groupby, self.keys):
+            if period is not None:
+                if column_types.get(col) not in ('date', 'datetime'):
+                    raise AggregationError("{0} can only be used with date and datetime columns: {1}".format(period, col))
+                output_types[key] = 'date'
+            elif col in column_types:
+                output_types[key] = column_types[col]
+
+        for (col, func), name in zip(self.agg, self.names):
+            numeric = col is not None and pd.api.types.is_numeric_dtype(sample_data[col])
+
+            if func in ('sum', 'mean') and not numeric:
+                raise AggregationError("{0} can only be used with numeric columns: {1}".format(func, col))
+            elif func in ('min', 'max'):
+                if col in column_types:
+                    output_types[name] = column_types[col]
+                elif numeric:
+                    output_types[name] = 'numeric'
+                else:
+                    self.string_extremes.add(name)
+            else:
+                output_types[name] = 'numeric'
+
+        return output_types
+
+    def add(self, df):
+        """
+        Add the partial aggregates for a chunk of the dataset.
+        """
+        df = self._get_keys(df)
+        partial = self._group(df, self.partials)
+
+        self.buffer.append(partial)
+        self.buffered_rows += len(partial)
+
+        for col in self.distinct_columns:
+            columns = self.group_keys + ([col] if col not in self.group_keys else [])
+            self.distinct.setdefault(col, []).append(df[columns].drop_duplicates())
+            self.buffered_rows += len(self.distinct[col][-1])
+
+        # Merge the buffered partial aggregates once they are as large as the groups already held. Buffered rows are
+        # also held in memory, so they are merged sooner if the limit on groups is lower.
+        if self.buffered_rows >= max(min(_MIN_COMPACT_ROWS, self.max_groups), self._held_rows()):
+            self._compact()
+
+            if self._held_rows() > self.max_groups:
+                self._spill()
+
+    def result(self, chunksize):
+        """
+        Generator that yields the aggregated table in chunks.
+        """
+        if self.spill_path is None:
+            self._compact()
+            frames = [self._finalize(self.state, self.distinct)]
+        else:
+            self._compact()
+            self._spill()
+            frames = (self._finalize(*self._load_partition(i)) for i in range(_SPILL_PARTITIONS))
+
+        for df in frames:
+            for i in range(0, len(df), chunksize):
+                yield df.iloc[i : i + chunksize]
+
+    def empty(self):
+        """
+        Return an empty data frame with the output columns.
+        """
+        return pd.DataFrame(columns=self.columns)
+
+    def close(self):
+        """
+        Remove any spill files.
+        """
+        if self.spill_path is not None:
+            shutil.rmtree(self.spill_path, ignore_errors=True)
+            self.spill_path = None
+
+    def _get_keys(self, df):
+        """
+        Add the group keys to the chunk, truncating dates to the period if required.
+        """
+        df = df[self.source_columns].copy()
+
+        if not self.keys:
+            df['__all'] = 0
+
+        for (col, period), key in zip(self.groupby, self.keys):
+            series = df[col]
+
+            # Nulls in Categorical keys are dropped by groupby in some versions of pandas, even with dropna=False
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                series = series.astype(object)
+
+            if period is not None:
+                if pd.api.types.is_numeric_dtype(series):
+                    series = get_timestamps(series, self.source_types.get(col))
+                else:
+                    series = pd.to_datetime(series, errors='coerce')
+                series = series.dt.to_period(_PERIODS[period]).dt.to_timestamp()
+
+            df[key] = series
+
+        return df
+
+    def _held_rows(self):
+        rows = 0 if self.state is None else len(self.state)
+        return rows + sum(len(df) for frames in self.distinct.values() for df in frames)
+
+    def _compact(self):
+        """
+        Merge the buffered partial aggregates into the state.
+        """
+        frames = self.buffer if self.state is None else [self.state] + self.buffer
+        if frames:
+            self.state = self._merge(frames)
+        self.buffer = []
+        self.buffered_rows = 0
+
+        for col, frames in self.distinct.items():
+            if len(frames) > 1:
+                self.distinct[col] = [pd.concat(frames, ignore_index=True).drop_duplicates()]
+
+    def _merge(self, frames):
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        return self._group(df, [(name, name, _MERGE[func]) for name, col, func in self.partials])
+
+    def _group(self, df, partials):
+        """
+        Aggregate the data frame by the group keys.
+        The min and max of string columns are taken over the values that are not null, as nulls cannot be compared with
+        strings. Groups without any values get a null.
+        :param partials: a list of tuples of the output name, the column, or None to count rows, and the function
+        """
+        grouped = df.groupby(self.group_keys, sort=False, dropna=False)
+        result = grouped.agg(**{name: (col or self.group_keys[0], func) for name, col, func in partials\
+            if name not in self.string_extremes}).reset_index()
+
+        for name, col, func in partials:
+            if name in self.string_extremes:
+                values = df[col].astype(object)
+                present = values.notna()
+                keys = [df.loc[present, key] for key in self.group_keys]
+                extremes = values[present].groupby(keys, sort=False, dropna=False).agg(func)
+                result = result.merge(extremes.rename(name).reset_index(), how='left', on=self.group_keys)
+
+        return result
+
+    def _spill(self):
+        """
+        Append the state and distinct values to the spill files, partitioned by a hash of the group keys.
+        """
+        if self.spill_path is None:
+            self.spill_path = tempfile.mkdtemp(prefix='sas_aggregate_', dir=self.spill_dir)
+
+        frames = [('state', self.state)] + [(col, frames[0]) for col, frames in self.distinct.items() if frames]
+
+        for kind, df in frames:
+            if df is None or len(df) == 0:
+                continue
+
+            partitions = pd.util.hash_pandas_object(df[self.group_keys], index=False).values % _SPILL_PARTITIONS
+            for i in np.unique(partitions):
+                with open(self._get_spill_file(i), 'ab') as f:
+                    pickle.dump((kind, df[partitions == i]), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        self.state = None
+        self.distinct = {}
+
+    def _load_partition(self, i):
+        """
+        Load and merge the state and distinct values for a partition of the groups.
+        """
+        states, distinct = [], {}
+        path = self._get_spill_file(i)
+
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                while True:
+                    try:
+                        kind, df = pickle.load(f)
+                    except EOFError:
+                        break
+                    if kind == 'state':
+                        states.append(df)
+                    else:
+                        distinct.setdefault(kind, []).append(df)
+            os.remove(path)
+
+        state = self._merge(states) if states else None
+        distinct = {col: [pd.concat(frames, ignore_index=True).drop_duplicates()] for col, frames in distinct.items()}
+        return state, distinct
+
+    def _finalize(self, state, distinct):
+        """
+        Calculate the aggregates from the merged partial aggregates.
+        """
+        if state is None:
+            return self.empty()
+
+        for col, frames in distinct.items():
+            counts = frames[0].groupby(self.group_keys, sort=False, dropna=False)[col].nunique()
+            state = state.merge(counts.rename('__distinct_' + col).reset_index(), how='left', on=self.group_keys)
+
+        df = state[self.keys].copy()
+
+        for (col, func), name in zip(self.agg, self.names):
+            if col is None:
+                df[name] = state['__rows']
+            elif func == 'mean':
+                df[name] = state[name + '__sum'] / state[name + '__count'].replace(0, np.nan)
+            elif func == 'count_distinct':
+                df[name] = state['__distinct_' + col].fillna(0)
+            else:
+                df[name] = state[name]
+
+        return df
+
+    def _get_spill_file(self, i):
+        return os.path.join(self.spill_path, 'partition_{}.pkl'.format(i))
+
+class AggregationError(Exception):
+    """
+    Raised when the groupby or agg arguments are not valid for the dataset.
+    """
+    pass
+
+def parse_groupby(value):
+    """
+    Parse the groupby argument, e.g. REGION|DT:month
+    :return: a list of tuples of the column and the period, or None if the column is not truncated
+    """
+    groupby = []
+
+    for item in value.split('|'):
+        col, _, period = item.partition(':')
+        period = period.lower() or None
+
+        if period is not None and period not in _PERIODS:
+            raise AggregationError("Unsupported period in groupby: {0}. Valid periods are: {1}"\
+                .format(period, ', '.join(_PERIODS)))
+
+        groupby.append((col, period))
+
+    return groupby
+
+def parse_agg(value):
+    """
+    Parse the agg argument, e.g. AMOUNT:sum|AMOUNT:mean|ID:count_distinct|count
+    :return: a list of tuples of the column, or None to count rows, and the aggregation function
+    """
+    agg = []
+
+    for item in value.split('|'):
+        col, _, func = item.rpartition(':')
+        func = func.lower()
+
+        if func not in FUNCTIONS:
+            raise AggregationError("Unsupported aggregation: {0}. Valid functions are: {1}".format(func, ', '.join(FUNCTIONS)))
+        if not col and func != 'count':
+            raise AggregationError("A column is required for the {} aggregation".format(func))
+
+        agg.append((col or None, func))
+
+    return agg
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+from concurrent import futures
+
+import ServerSideExtension_pb2 as SSE
+from grpc import aio
+
+# Marker for the end of a response iterator
+_END = object()
+
+class AsyncConnector(SSE.ConnectorServicer):
+    """
+    An asyncio implementation of the SSE connector that wraps the thread-based ExtensionService.
+    Function calls are executed in a thread pool one bundle at a time, while the event loop handles streaming and
+    gRPC flow control. A call only holds a thread while it is decoding or encoding data, except while it waits in the
+    admission queue: the wait happens on the first bundle, so each queued call holds a thread until it is admitted or
+    times out. The thread pool should therefore exceed max_reads + max_queue.
+    """
+
+    def __init__(self, service, executor):
+        """
+        Class initializer.
+        :param service: the ExtensionService with the function implementations
+        :param executor: the thread pool used to execute function calls
+        """
+        self.service = service
+        self.executor = executor
+
+    async def GetCapabilities(self, request, context):
+        """
+        Get capabilities from the ExtensionService.
+        :param request: the request, not used in this method.
+        :param context: the context, not used in this method.
+        :return: the capabilities.
+        """
+        return self.service.GetCapabilities(request, context)
+
+    async def ExecuteFunction(self, request_iterator, context):
+        """
+        Call the corresponding function in the ExtensionService and stream the response.
+        :param request_iterator: an asynchronous iterable sequence of RowData.
+        :param context: the context.
+        :return: an asynchronous iterable sequence of RowData.
+        """
+        loop = asyncio.get_running_loop()
+
+        # The requests only carry the function arguments, so they are collected before the call
+        requests = [request async for request in request_iterator]
+
+        responses = self.service.ExecuteFunction(iter(requests), SyncContext(context, loop))
+        pending = None
+
+        try:
+            while True:
+                # Get the next bundle in the thread pool. gRPC applies flow control when the bundle is yielded.
+                pending = self.executor.submit(next, responses, _END)
+                response = await asyncio.wrap_future(pending)
+
+                if response is _END:
+                    break
+
+                yield response
+        except AbortError as e:
+            await context.abort(e.code, e.details)
+        finally:
+            # Release the file reader and the admission slot if the call ended early, e.g. when it is cancelled
+            await loop.run_in_executor(self.executor, _close, responses, pending)
+
+class SyncContext:
+    """
+    An adapter that exposes the asyncio servicer context to the synchronous function implementations.
+    Methods are called from the thread pool and coroutines are scheduled on the event loop.
+    """
+
+    def __init__(self, context, loop):
+        """
+        Class initializer.
+        :param context: the grpc.aio servicer context
+        :param loop: the event loop running the server
+        """
+        self._context = context
+        self._loop = loop
+
+    def invocation_metadata(self):
+        return self._context.invocation_metadata()
+
+    def send_initial_metadata(self, metadata):
+        asyncio.run_coroutine_threadsafe(self._context.send_initial_metadata(metadata), self._loop).result()
+
+    def abort(self, code, details):
+        # The call is aborted on the event loop by the AsyncConnector
+        raise AbortError(code, details)
+
+    def is_active(self):
+        return not self._context.done()
+
+    def add_callback(self, callback):
+        # The callback is called on the event loop when the call ends
+        self._context.add_done_callback(lambda context: callback())
+        return True
+
+    def set_compression(self, compression):
+        self._context.set_compression(compression)
+
+    def set_code(self, code):
+        self._context.set_code(code)
+
+    def set_details(self, details):
+        self._context.set_details(details)
+
+    def time_remaining(self):
+        return self._context.time_remaining()
+
+def _close(responses, pending):
+    """
+    Close the response generator once the bundle in progress is done, as a running generator cannot be closed.
+    """
+    if pending is not None:
+        futures.wait([pending])
+
+    responses.close()
+
+class AbortError(Exception):
+    """
+    Exception used to pass an abort from the synchronous function implementation to the event loop
+    """
+
+    def __init__(self, code, details):
+        super().__init__(details)
+        self.code = code
+        self.details = details
+
+def serve_aio(service, port, pem_dir, workers, options):
+    """
+    Run an asyncio gRPC server until it is interrupted.
+    :param service: the ExtensionService with the function implementations
+    :param port: port to listen on.
+    :param pem_dir: Directory including certificates
+    :param workers: number of threads for executing function calls
+    :param options: gRPC channel options
+    :return: None
+    """
+    try:
+        asyncio.run(_serve(service, port, pem_dir, workers, options))
+    except KeyboardInterrupt:
+        pass
+
+async def _serve(service, port, pem_dir, workers, options):
+    """
+    Start the asyncio gRPC server and wait for it to terminate.
+    """
+    executor = futures.ThreadPoolExecutor(max_workers=workers)
+    server = aio.server(options=options)
+
+    service._add_servicer(AsyncConnector(service, executor), server)
+    service._add_port(server, port, pem_dir)
+    logging.info('*** Using the asyncio server with {} worker threads ***'.format(workers))
+
+    await server.start()
+    service._prewarm()
+    try:
+        await server.wait_for_termination()
+    finally:
+        await server.stop(0)
+        executor.shutdown(wait=False)
@@ -0,0 +1,401 @@
+import os
+import sys
+import time
+import pickle
+import hashlib
+import logging
+import threading
+from concurrent import futures
+
+import ServerSideExtension_pb2 as SSE
+from _scheduler import PRIORITIES
+
+# Incremented when the layout of cache files changes, so that older files are rebuilt
+_CACHE_VERSION = 1
+
+# Rows per chunk in cache files. Chunks are sliced further if a request uses a smaller chunksize.
+_CACHE_CHUNKSIZE = 10000
+
+# Files picked up by the directory watcher
+_EXTENSIONS = ('.sas7bdat', '.xpt')
+
+_MB = 1024 * 1024
+
+class SASCache:
+    """
+    A class to keep decoded copies of SAS files, so that reads can skip opening and decoding the file.
+    Each cache file holds the metadata needed to describe the table, followed by the prepared data frames as pickled
+    chunks. Entries are only used while the size and modification time of the SAS file are unchanged.
+    """
+
+    def __init__(self, directory):
+        """
+        Class initializer.
+        :param directory: the directory for cache files
+        """
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get(self, filepath, encoding=None):
+        """
+        Get the cache entry for a SAS file.
+        :param filepath: the SAS file
+        :param encoding: the encoding requested for the file, or None if any encoding can be used
+        :return: a CacheEntry, or None if the file is not cached, the entry is stale or was decoded with another encoding
+        """
+        try:
+            handle = open(self._get_path(filepath), 'rb')
+        except OSError:
+            return None
+
+        try:
+            meta = pickle.load(handle)
+        except Exception:
+            handle.close()
+            return None
+
+        if not self._is_valid(meta, filepath) or (encoding is not None and encoding != meta['encoding']):
+            handle.close()
+            return None
+
+        return CacheEntry(handle, meta)
+
+    def is_fresh(self, filepath):
+        """
+        Check if there is a valid cache entry for a SAS file.
+        """
+        try:
+            with open(self._get_path(filepath), 'rb') as f:
+                return self._is_valid(pickle.load(f), filepath)
+        except Exception:
+            return False
+
+    def writer(self, filepath, meta):
+        """
+        Get a writer for the cache entry of a SAS file.
+        :param filepath: the SAS file
+        :param meta: a dictionary with the signature, encoding, formats, sample data, labels and row count of the file
+        """
+        meta = dict(meta, version=_CACHE_VERSION, python=sys.version_info[:2], pandas=_pandas_version())
+        return CacheWriter(self._get_path(filepath), meta)
+
+    def remove(self, filepath):
+        """
+        Remove the cache entry for a SAS file.
+        """
+        try:
+            os.remove(self._get_path(filepath))
+        except OSError:
+            pass
+
+    def _get_path(self, filepath):
+        key = hashlib.sha1(os.path.abspath(filepath).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key + '.cache')
+
+    @staticmethod
+    def _is_valid(meta, filepath):
+        # Pickled data frames may not load in other versions of Python or pandas
+        return meta.get('version') == _CACHE_VERSION and meta.get('python') == sys.version_info[:2]\
+            and meta.get('pandas') == _pandas_version() and meta.get('signature') == get_signature(filepath)
+
+class CacheEntry:
+    """
+    An open cache file, positioned at the first chunk.
+    """
+
+    def __init__(self, handle, meta):
+        self.handle = handle
+        self.meta = meta
+        self.row_count = meta['row_count']
+
+    def chunks(self, chunksize):
+        """
+        Generator that yields the prepared data frames, sliced to the chunksize if they are larger.
+        The cache file is closed when the generator is exhausted or closed.
+        """
+        try:
+            while True:
+                try:
+                    df = pickle.load(self.handle)
+                except EOFError:
+                    return
+
+                # Slices are copied, as columns are assigned on the chunks when they are filtered and sent
+                if len(df) <= chunksize:
+                    yield df
+                    continue
+                for i in range(0, len(df), chunksize):
+                    yield df.iloc[i : i + chunksize].copy()
+        finally:
+            self.close()
+
+    def close(self):
+        self.handle.close()
+
+class CacheWriter:
+    """
+    A writer for a cache file. The file is written to a temporary file and renamed when complete.
+    """
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.temp_path = '{0}.{1}.tmp'.format(path, threading.get_ident())
+        self.handle = open(self.temp_path, 'wb')
+        pickle.dump(meta, self.handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def write(self, df):
+        """
+        Write a prepared data frame to the cache file.
+        :return: the number of bytes written
+        """
+        start = self.handle.tell()
+        pickle.dump(df, self.handle, protocol=pickle.HIGHEST_PROTOCOL)
+        return self.handle.tell() - start
+
+    def close(self):
+        self.handle.close()
+        os.replace(self.temp_path, self.path)
+
+    def discard(self):
+        self.handle.close()
+        try:
+            os.remove(self.temp_path)
+        except OSError:
+            pass
+
+class DirectoryWatcher:
+    """
+    A class to pre-load new and changed SAS files in watched directories into the cache.
+    Directories are polled rather than watched with OS notifications, so that this works on network shares.
+    A file is cached once its size and modification time have not changed for the settle time, so files that are still
+    being written are not read. Files are read at low priority in the chunk scheduler, so requests are not held up.
+    """
+
+    def __init__(self, directories, cache, scheduler, interval=30, settle=60, threads=1, io_rate=None, metrics=None):
+        """
+        Class initializer.
+        :param directories: a list of directories to watch. Subdirectories are not watched.
+        :param cache: the SASCache to load files into
+        :param scheduler: the ChunkScheduler shared with requests
+        :param interval: the time in seconds between polls of the directories
+        :param settle: the time in seconds that a file must be unchanged before it is cached
+        :param threads: the number of files cached at the same time
+        :param io_rate: the maximum rate in MB/s for reading SAS files and writing cache files, or None for no limit
+        :param metrics: the Metrics for the service
+        """
+        self.directories = directories
+        self.cache = cache
+        self.scheduler = scheduler
+        self.interval = interval
+        self.settle = settle
+        self.metrics = metrics
+        self.limiter = _RateLimiter(io_rate * _MB) if io_rate else None
+        self.executor = futures.ThreadPoolExecutor(max_workers=threads)
+
+        # The signature of each file seen, and the time it was first seen with that signature
+        self.files = {}
+
+        # Files being cached, protected by the lock
+        self.pending = set()
+        self._lock = threading.Lock()
+
+        self.stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start polling the directories in a background thread.
+        """
+        self._thread = threading.Thread(target=self._run, name='watcher', daemon=True)
+        self._thread.start()
+        logging.info('Watching directories for SAS files: {}'.format(', '.join(self.directories)))
+
+    def stop(self):
+        """
+        Stop polling and stop caching files at the end of the current chunk.
+        """
+        self.stopped.set()
+        self.executor.shutdown(wait=True)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                logging.warning('Error polling directories for SAS files: {}'.format(e))
+            self.stopped.wait(self.interval)
+
+    def poll(self):
+        """
+        Check the directories for new, changed and deleted files, and cache the files that have settled.
+        """
+        now = time.time()
+        seen = set()
+
+        # Directories that could not be listed, e.g. while a network share is unavailable. Their files are kept.
+        unlisted = set()
+
+        for directory in self.directories:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError as e:
+                logging.warning('Unable to list {0}: {1}'.format(directory, e))
+                unlisted.add(os.path.normpath(directory))
+                continue
+
+            for entry in entries:
+                if not entry.name.lower().endswith(_EXTENSIONS):
+                    continue
+
+                path = entry.path
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError as e:
+                    # The file may have been deleted since the directory was listed. This is picked up on the next poll.
+                    logging.warning('Unable to check {0}: {1}'.format(path, e))
+                    seen.add(path)
+                    continue
+
+                signature = (stat.st_size, stat.st_mtime_ns)
+                seen.add(path)
+
+                # Restart the settle time whenever the file changes
+                if path not in self.files or self.files[path][0] != signature:
+                    self.files[path] = (signature, now)
+                    continue
+
+                with self._lock:
+                    if path in self.pending or now - self.files[path][1] < self.settle or self.cache.is_fresh(path):
+                        continue
+                    self.pending.add(path)
+
+                self.executor.submit(self._load, path)
+
+        # Remove the cache entries for files that have been deleted
+        for path in set(self.files) - seen:
+            if os.path.normpath(os.path.dirname(path)) in unlisted:
+                continue
+            del self.files[path]
+            self.cache.remove(path)
+
+    def _load(self, path):
+        """
+        Read a SAS file with the same steps as Read_SAS and write the prepared chunks to the cache.
+        """
+        # Imported here as the libraries are slow to load and the watcher starts with the server
+        import pandas as pd
+        from _sas_reader import SASReader
+
+        start = time.time()
+        writer = response = None
+        rows = 0
+
+        try:
+            signature = get_signature(path)
+            request = [SSE.BundledRows(rows=[SSE.Row(duals=[SSE.Dual(strData=path),\
+                SSE.Dual(strData='chunksize={}'.format(_CACHE_CHUNKSIZE))])])]
+            reader = SASReader(request, _BackgroundContext(self.stopped))
+            response = reader.read(describe=False)
+            labels = reader.read_labels() if path.lower().endswith('.sas7bdat') else None
+
+            meta = {'signature': signature, 'encoding': reader.encoding, 'formats': getattr(reader, 'formats', None),\
+                'sample_data': reader.sample_data, 'labels': labels, 'row_count': reader.get_row_count()}
+            writer = self.cache.writer(path, meta)
+
+            if isinstance(response, pd.DataFrame):
+                chunks = (response.iloc[i : i + _CACHE_CHUNKSIZE] for i in range(0, len(response), _CACHE_CHUNKSIZE))
+            else:
+                chunks = response
+
+            # Estimate the bytes read for each chunk from the size of the file
+            row_size = signature[0] / meta['row_count'] if meta['row_count'] else 0
+            ticket = self.scheduler.register(PRIORITIES['low'])
+
+            for chunk in self.scheduler.interleave(ticket, chunks, lambda chunk: chunk.size):
+                if self.stopped.is_set():
+                    writer.discard()
+                    return
+
+                written = writer.write(chunk)
+                rows += len(chunk)
+
+                if self.limiter is not None:
+                    self.limiter.consume(row_size * len(chunk) + written)
+
+            # Discard the entry if the file changed while it was being read
+            if get_signature(path) != signature:
+                writer.discard()
+                logging.info('{} changed while it was being cached. It will be cached once it settles.'.format(path))
+                return
+            writer.close()
+
+            if self.metrics is not None:
+                self.metrics.inc('sse_cache_files_loaded_total')
+            logging.info('Cached {0}: {1} rows in {2:.2f}s'.format(path, rows, time.time() - start))
+        except Exception as e:
+            if writer is not None:
+                writer.discard()
+            logging.warning('Unable to cache {0}: {1}'.format(path, e))
+        finally:
+            if response is not None and not isinstance(response, pd.DataFrame):
+                response.close()
+            with self._lock:
+                self.pending.discard(path)
+
+class _BackgroundContext:
+    """
+    A stand-in for the gRPC context when files are read by the watcher rather than a request.
+    """
+
+    def __init__(self, stopped):
+        self.stopped = stopped
+
+    def send_initial_metadata(self, metadata):
+        pass
+
+    def is_active(self):
+        return not self.stopped.is_set()
+
+    def add_callback(self, callback):
+        return False
+
+class _RateLimiter:
+    """
+    A limit on the rate of I/O, shared by the threads loading files into the cache.
+    """
+
+    def __init__(self, rate):
+        """
+        :param rate: the maximum rate in bytes per second
+        """
+        self.rate = rate
+        self.next_time = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, size):
+        """
+        Account for I/O of the given size, sleeping until it is within the rate.
+        """
+        with self._lock:
+            now = time.time()
+            self.next_time = max(self.next_time, now) + size / self.rate
+            delay = self.next_time - now
+
+        if delay > 0:
+            time.sleep(delay)
+
+def get_signature(filepath):
+    """
+    Return the size and modification time of a file, or None if it does not exist.
+    """
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+def _pandas_version():
+    import pandas
+    return pandas.__version__
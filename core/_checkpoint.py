@@ -0,0 +1,192 @@
+# Checkpoints for resuming reads of large SAS files with the pandas readers.
+# A checkpoint is a continuation token of the form row:offset:skip, where row is the number of rows read, offset is the
+# byte offset of the page holding the next row in a SAS7BDAT file, or of the next record in an XPORT file, and skip is
+# the number of rows on that page before the next row. Resuming seeks to the offset and only decodes the skipped rows.
+# A SAS7BDAT file can also be limited to a range of pages, so that a read can be split into shards read in parallel.
+# This relies on the internal state of the pandas readers, which is kept to this module.
+
+import struct
+
+from pandas.io.sas import sas_constants as const
+
+# Maximum number of rows read at a time when rows are skipped
+_SKIP_CHUNKSIZE = 10000
+
+# State of the page loaded by a pandas SAS7BDAT reader, which is restored after the rows in a range of pages are counted
+_PAGE_STATE = ('_cached_page', '_current_page_type', '_current_page_block_count', '_current_page_subheaders_count',\
+    '_current_page_data_subheader_pointers')
+
+class ResumeError(Exception):
+    """
+    Raised when a continuation token or range of pages is not valid for the file.
+    """
+    pass
+
+def parse_token(value):
+    """
+    Parse a continuation token.
+    :param value: a token of the form row:offset:skip, or just the row to resume from by reading through the earlier rows
+    :return: a tuple of the row, offset and skip. The offset and skip are None if only the row was given.
+    """
+    try:
+        parts = [int(part) for part in value.split(':')]
+    except ValueError:
+        parts = []
+
+    if len(parts) not in (1, 3) or min(parts) < 0:
+        raise ResumeError("Invalid value for resume_from: {}. Use a checkpoint from the service log.".format(value))
+
+    return tuple(parts) if len(parts) == 3 else (parts[0], None, None)
+
+def format_token(row, offset, skip):
+    return '{0}:{1}:{2}'.format(row, offset, skip)
+
+def get_checkpoint(reader):
+    """
+    Get the continuation token for the rows read so far.
+    :param reader: a pandas SAS7BDAT or XPORT reader
+    :return: a token, or None if the reader is not supported
+    """
+    if hasattr(reader, '_current_row_in_file_index'):
+        # The current page has been read, so it starts a page length before the file position
+        offset = reader._path_or_buf.tell() - reader._page_length
+        return format_token(reader._current_row_in_file_index, offset, reader._current_row_on_page_index)
+    elif hasattr(reader, '_lines_read'):
+        row = reader._lines_read
+        return format_token(row, reader.record_start + row * reader.record_length, 0)
+    return None
+
+def resume(reader, token):
+    """
+    Move a pandas reader to the position in a continuation token, so that the next chunk starts at the token's row.
+    :param reader: a pandas SAS7BDAT or XPORT reader that has not been read from
+    :param token: a tuple of the row, offset and skip from parse_token
+    :raises ResumeError: if the token does not match the layout of the file
+    """
+    row, offset, skip = token
+
+    if offset is None:
+        _skip_rows(reader, row)
+    elif hasattr(reader, '_current_row_in_file_index'):
+        if (offset - reader.header_length) % reader._page_length or skip > row or row > reader.row_count:
+            raise ResumeError("resume_from {0} does not match the pages of {1}. The file may have changed."\
+                .format(format_token(row, offset, skip), getattr(reader._path_or_buf, 'name', 'the file')))
+
+        # The page after the metadata is already loaded when the reader is opened, and is not read again
+        if offset != reader._path_or_buf.tell() - reader._page_length:
+            reader._path_or_buf.seek(offset)
+            reader._read_next_page()
+
+        reader._current_row_in_file_index = row - skip
+        reader._current_row_on_page_index = 0
+        _skip_rows(reader, skip)
+    elif hasattr(reader, '_lines_read'):
+        if offset != reader.record_start + row * reader.record_length or skip or row > reader.nobs:
+            raise ResumeError("resume_from {0} does not match the records of {1}. The file may have changed."\
+                .format(format_token(row, offset, skip), getattr(reader.filepath_or_buffer, 'name', 'the file')))
+
+        reader.filepath_or_buffer.seek(offset)
+        reader._lines_read = row
+    else:
+        _skip_rows(reader, row)
+
+def _skip_rows(reader, rows):
+    """
+    Read and discard rows, at most a chunk at a time.
+    """
+    while rows > 0:
+        try:
+            df = reader.read(min(rows, _SKIP_CHUNKSIZE))
+        except StopIteration:
+            break
+        if len(df) == 0:
+            break
+        rows -= len(df)
+
+def get_page_range(reader):
+    """
+    Get the pages that can hold rows in a SAS7BDAT file, from the header and metadata read when the reader was opened.
+    :param reader: a pandas SAS7BDAT reader that has not been read from
+    :return: a tuple of the index of the first page holding rows and the number of pages, or None if not supported
+    """
+    if not hasattr(reader, '_current_row_in_file_index'):
+        return None
+    return _get_loaded_page(reader), reader._page_count
+
+def select_pages(reader, first, last):
+    """
+    Limit a pandas SAS7BDAT reader to the rows on a range of pages, so that the next chunk starts at the first page and
+    the reader stops after the last page. Data pages are counted from their headers, so only pages holding metadata or
+    compressed rows are read in full before the rows are decoded.
+    :param reader: a pandas SAS7BDAT reader that has not been read from
+    :param first: the index of the first page to read
+    :param last: the index of the page after the last page to read
+    :raises ResumeError: if the pages are not in the file or the reader is not supported
+    """
+    if not hasattr(reader, '_current_row_in_file_index'):
+        raise ResumeError("pages can only be read from SAS7BDAT files read by pandas")
+    
+    if not 0 <= first <= last <= reader._page_count:
+        raise ResumeError("pages {0}:{1} are not in {2}, which has {3} pages. The file may have changed."\
+            .format(first, last, getattr(reader._path_or_buf, 'name', 'the file'), reader._page_count))
+    
+    handle = reader._path_or_buf
+    position = handle.tell()
+    loaded = _get_loaded_page(reader)
+    first = max(first, loaded)
+
+    # Count the rows on the pages, starting with the page loaded when the reader was opened
+    state = {name: getattr(reader, name) for name in _PAGE_STATE}
+    rows = _get_page_rows(reader) if first == loaded < last else 0
+
+    for index in range(max(first, loaded + 1), last):
+        offset = reader.header_length + index * reader._page_length
+        handle.seek(offset)
+        page_type, block_count = _read_page_header(reader, handle.read(reader._page_bit_offset + 4))
+
+        if page_type == const.page_data_type:
+            rows += block_count
+        elif page_type in const.page_meta_types + [const.page_mix_type]:
+            handle.seek(offset)
+            reader._read_next_page()
+            rows += _get_page_rows(reader)
+    
+    for name, value in state.items():
+        setattr(reader, name, value)
+
+    # The page after the metadata is already loaded when the reader is opened, and is not read again
+    if first == loaded:
+        handle.seek(position)
+    else:
+        handle.seek(reader.header_length + first * reader._page_length)
+        reader._read_next_page()
+    
+    reader._current_row_in_file_index = 0
+    reader._current_row_on_page_index = 0
+    reader.row_count = rows
+
+def _get_loaded_page(reader):
+    """
+    Get the index of the page loaded by a pandas SAS7BDAT reader.
+    """
+    return (reader._path_or_buf.tell() - reader._page_length - reader.header_length) // reader._page_length
+
+def _get_page_rows(reader):
+    """
+    Get the number of rows on the page loaded by a pandas SAS7BDAT reader, counted as the reader reads them.
+    """
+    if reader._current_page_type in const.page_meta_types:
+        return len(reader._current_page_data_subheader_pointers)
+    elif reader._current_page_type == const.page_mix_type:
+        return min(reader.row_count, reader._mix_page_row_count)
+    elif reader._current_page_type == const.page_data_type:
+        return reader._current_page_block_count
+    return 0
+
+def _read_page_header(reader, header):
+    """
+    Read the page type and block count from the start of a page, as pandas does.
+    """
+    offset = reader._page_bit_offset
+    page_type, block_count = struct.unpack(reader.byte_order + 'hh', header[offset : offset + 4])
+    return page_type & const.page_type_mask2, block_count
@@ -0,0 +1,291 @@
+import io
+import bz2
+import gzip
+import zipfile
+
+# Magic bytes at the start of compressed files
+_MAGIC = ((b'\x1f\x8b', 'gzip'), (b'BZh', 'bz2'), (b'PK\x03\x04', 'zip'))
+
+# File extensions removed from the path to get the name of the SAS file in a gzip or bz2 file
+_EXTENSIONS = {'gzip': '.gz', 'bz2': '.bz2'}
+
+# SAS files looked for in zip archives when a member is not specified
+_SAS_EXTENSIONS = ('.sas7bdat', '.xpt')
+
+# Decompressed bytes kept behind the current position, so that the readers can seek back e.g. to re-read the header
+_LOOKBACK = 1024 * 1024
+
+# Size of the reads from the decompressor
+_BLOCK_SIZE = 256 * 1024
+
+class CompressedSource:
+    """
+    A SAS file in a gzip or bz2 file, or a member of a zip archive, that is read without extracting it to disk.
+    Each call to open returns a new file object that decompresses the data as it is read.
+    The size of the data, and the bytes at the end, are found with one pass through the file the first time the
+    readers seek from the end, e.g. for XPORT files, and are then shared by the file objects opened from this source.
+    """
+
+    def __init__(self, path, compression, member=None, open_raw=None, lookback=_LOOKBACK):
+        """
+        Class initializer.
+        :param path: the compressed file
+        :param compression: gzip, bz2 or zip, as returned by detect_compression
+        :param member: the SAS file to read from a zip archive. Not required if the archive holds a single SAS file.
+        :param open_raw: a function that opens the compressed file as a binary file object. Defaults to open(path, 'rb').
+        :param lookback: the number of decompressed bytes kept behind the current position, and at the end of the data
+        :raises CompressedFileError: if the member is not valid for the file
+        """
+        self.path = path
+        self.compression = compression
+        self.open_raw = open_raw or (lambda: open(path, 'rb'))
+        self.lookback = lookback
+
+        # The size is known up front for zip members. Otherwise this is set along with the tail by scan.
+        self.size = None
+        self.tail = None
+
+        if compression == 'zip':
+            with self.open_raw() as raw, zipfile.ZipFile(raw) as archive:
+                self.member = _get_member(archive, member, path)
+                self.size = archive.getinfo(self.member).file_size
+            self.name = self.member
+        else:
+            if member:
+                raise CompressedFileError("The member argument can only be used with zip archives: {}".format(path))
+            self.member = None
+            extension = _EXTENSIONS[compression]
+            self.name = path[:-len(extension)] if path.lower().endswith(extension) else path
+
+    def open(self):
+        """
+        Open the decompressed data as a seekable, read-only file object.
+        """
+        return DecompressedFile(self)
+
+    def open_stream(self):
+        """
+        Open a forward-only stream of the decompressed data.
+        """
+        raw = self.open_raw()
+
+        try:
+            if self.compression == 'gzip':
+                return _Stream(gzip.GzipFile(fileobj=raw, mode='rb'), raw)
+            elif self.compression == 'bz2':
+                return _Stream(bz2.BZ2File(raw, mode='rb'), raw)
+
+            archive = zipfile.ZipFile(raw)
+            return _Stream(archive.open(self.member), archive, raw)
+        except Exception:
+            raw.close()
+            raise
+
+    def scan(self):
+        """
+        Read through the decompressed data to get its size and keep the bytes at the end.
+        """
+        if self.tail is not None:
+            return
+
+        tail = bytearray()
+        size = 0
+        stream = self.open_stream()
+
+        try:
+            while True:
+                data = stream.read(_BLOCK_SIZE)
+                if not data:
+                    break
+                size += len(data)
+                tail += data
+                del tail[:-self.lookback]
+        finally:
+            stream.close()
+
+        self.size, self.tail = size, bytes(tail)
+
+class DecompressedFile(io.RawIOBase):
+    """
+    A read-only file object over a forward-only decompression stream.
+    Reads ahead of the stream skip forward through it. Recently read bytes are kept in a bounded look-back buffer so
+    that short seeks backwards are served from memory. Seeking further back restarts the stream from the beginning.
+    """
+
+    def __init__(self, source):
+        """
+        Class initializer.
+        :param source: the CompressedSource for the data
+        """
+        self.source = source
+        self.name = source.name
+        self.position = 0
+
+        # The stream, the number of bytes read from it, and the last bytes read starting at window_start
+        self.stream = None
+        self.stream_position = 0
+        self.window = bytearray()
+        self.window_start = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            self.source.scan()
+            position = self.source.size + offset
+        else:
+            raise ValueError("Invalid whence: {}".format(whence))
+
+        if position < 0:
+            raise ValueError("Negative seek position {}".format(position))
+        self.position = position
+        return self.position
+
+    def read(self, size=-1):
+        """
+        Read up to size bytes from the current position.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+
+        start = self.position
+
+        # Reads near the end, after a seek from the end, are served from the tail rather than skipping to it
+        tail = self.source.tail
+        if tail is not None and start >= max(self.stream_position, self.source.size - len(tail)):
+            offset = start - (self.source.size - len(tail))
+            data = tail[offset:] if size is None or size < 0 else tail[offset : offset + size]
+            self.position += len(data)
+            return data
+
+        if start < self.window_start:
+            self._restart()
+
+        end = None if size is None or size < 0 else start + size
+        self._fill(start, end)
+
+        data = bytes(self.window[start - self.window_start : None if end is None else end - self.window_start])
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        self.window = bytearray()
+        super().close()
+
+    def _fill(self, start, end):
+        """
+        Read from the stream until it reaches the end position, or the end of the data if end is None.
+        Bytes before the start are dropped from the window, except for the look-back bytes.
+        """
+        if self.stream is None:
+            self.stream = self.source.open_stream()
+
+        while end is None or self.stream_position < end:
+            if end is None:
+                want = _BLOCK_SIZE
+            else:
+                want = max(_BLOCK_SIZE, end - self.stream_position)
+
+            data = self.stream.read(want)
+            if not data:
+                break
+
+            self.window += data
+            self.stream_position += len(data)
+
+            # Keep the bytes from the start of the read, and the look-back bytes before the end of the window
+            keep = min(start, self.stream_position - self.source.lookback)
+            if keep > self.window_start:
+                del self.window[:keep - self.window_start]
+                self.window_start = keep
+
+    def _restart(self):
+        """
+        Start the stream again from the beginning, for a seek back past the look-back buffer.
+        """
+        if self.stream is not None:
+            self.stream.close()
+        self.stream = None
+        self.stream_position = 0
+        self.window = bytearray()
+        self.window_start = 0
+
+class _Stream:
+    """
+    A decompression stream, closed along with the archive and file that it reads from.
+    """
+
+    def __init__(self, stream, *handles):
+        self.stream = stream
+        self.handles = handles
+
+    def read(self, size):
+        return self.stream.read(size)
+
+    def close(self):
+        self.stream.close()
+        for handle in self.handles:
+            handle.close()
+
+class CompressedFileError(Exception):
+    """
+    Raised when a SAS file cannot be selected from a compressed file.
+    """
+    pass
+
+def detect_compression(path):
+    """
+    Detect a compressed file from the magic bytes at the start of the file.
+    :return: gzip, bz2, zip, or None if the file is not compressed or cannot be read
+    """
+    try:
+        with open(path, 'rb') as f:
+            magic = f.read(4)
+    except OSError:
+        return None
+
+    for prefix, compression in _MAGIC:
+        if magic.startswith(prefix):
+            return compression
+    return None
+
+def _get_member(archive, member, path):
+    """
+    Get the SAS file to read from a zip archive.
+    """
+    names = [info.filename for info in archive.infolist() if not info.is_dir()]
+
+    if member:
+        if member not in names:
+            raise CompressedFileError("{0} was not found in {1}. The archive holds: {2}"\
+                .format(member, path, ', '.join(names)))
+        return member
+
+    sas_files = [name for name in names if name.lower().endswith(_SAS_EXTENSIONS)]
+
+    if len(sas_files) == 1:
+        return sas_files[0]
+    elif not sas_files and len(names) == 1:
+        return names[0]
+
+    raise CompressedFileError("{0} holds {1} SAS files. Use the member argument to choose one of: {2}"\
+        .format(path, len(sas_files) or len(names), ', '.join(sas_files or names)))
@@ -0,0 +1,410 @@
+import logging
+import os
+import struct
+import tempfile
+import threading
+from collections import deque
+
+import grpc
+import ServerSideExtension_pb2 as SSE
+
+# Minimum number of pages in a shard. Files with fewer pages than this for two shards are read without sharding.
+_DEFAULT_MIN_PAGES = 64
+
+# Size in bytes of the rows buffered in memory for each shard, beyond which they are spilled to a temporary file
+_DEFAULT_BUFFER_SIZE = 64 * 1024 * 1024
+
+# Status codes from a peer for which the shard is retried on another peer. Other errors are returned to Qlik.
+_RETRY_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.RESOURCE_EXHAUSTED, grpc.StatusCode.DEADLINE_EXCEEDED,\
+    grpc.StatusCode.UNKNOWN, grpc.StatusCode.INTERNAL, grpc.StatusCode.ABORTED)
+
+# Method called on the peers. Responses are not parsed, so that they are forwarded to Qlik as they were serialized.
+_EXECUTE_FUNCTION = '/qlik.sse.Connector/ExecuteFunction'
+
+# Length and number of rows for messages spilled to disk
+_HEADER = struct.Struct('<II')
+
+class Coordinator:
+    """
+    A class to split reads of large SAS7BDAT files into shards of pages that are read in parallel by peer SSE instances.
+    Each shard is requested from a peer with Read_SAS and the pages parameter, so the peers need access to the file at
+    the same path. The serialized BundledRows streamed back are buffered until they can be forwarded to Qlik in the
+    order of the file. A shard that fails on a peer is retried on the next peer, skipping the rows already received.
+    """
+
+    def __init__(self, peers, min_pages=_DEFAULT_MIN_PAGES, buffer_size=_DEFAULT_BUFFER_SIZE, pem_dir=None, metrics=None):
+        """
+        Class initializer.
+        :param peers: a list of peer SSE instances as host:port. This can include the coordinator itself.
+        :param min_pages: the minimum number of pages in a shard
+        :param buffer_size: the size in bytes of the rows buffered in memory for each shard before spilling to disk
+        :param pem_dir: a directory with root_cert.pem, sse_client_cert.pem and sse_client_key.pem for secure peers
+        :param metrics: the Metrics for the service
+        """
+        self.peers = peers
+        self.min_pages = min_pages
+        self.buffer_size = buffer_size
+        self.metrics = metrics
+
+        # Channels connect when first used, so peers can be started after the coordinator
+        options = [('grpc.max_receive_message_length', -1)]
+        credentials = self._get_credentials(pem_dir) if pem_dir else None
+        channels = [grpc.secure_channel(peer, credentials, options) if credentials\
+            else grpc.insecure_channel(peer, options) for peer in peers]
+        self.calls = [channel.stream_stream(_EXECUTE_FUNCTION, request_serializer=SSE.BundledRows.SerializeToString)\
+            for channel in channels]
+
+        # Reads start on the next peer in turn, so that concurrent reads share the peers evenly
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def plan(self, pages):
+        """
+        Split the pages of a file into a shard for each peer.
+        :param pages: a tuple of the first page holding rows and the number of pages, as from SASReader.get_pages
+        :return: a list of tuples of the first page and the page after the last page for each shard, or None if the
+        file is too small to split
+        """
+        if pages is None:
+            return None
+
+        first, count = pages
+        shards = min(len(self.peers), (count - first) // self.min_pages)
+        if shards < 2:
+            return None
+
+        bounds = [first + (count - first) * i // shards for i in range(shards + 1)]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def read(self, request, shards, context, function_id=0):
+        """
+        Generator that reads the shards on the peers and yields their BundledRows in the order of the file.
+        The table description from the first shard is sent to Qlik before the rows.
+        Each BundledRows is yielded as a tuple of the serialized message and the number of rows in it.
+        :param request: the request list, with the path and additional arguments in the first row
+        :param shards: a list of page ranges from plan
+        :param context: the context of the call from Qlik
+        :param function_id: the function called on the peers
+        :raises ShardError: if a shard fails on every peer, or the peers describe the table differently
+        """
+        duals = request[0].rows[0].duals
+        path = duals[0].strData
+        args = duals[1].strData if len(duals) > 1 else ''
+
+        with self._lock:
+            start = self._next
+            self._next = (self._next + len(shards)) % len(self.peers)
+
+        tasks = [_Shard(self, path, args, pages, (start + i) % len(self.peers), function_id, i, len(shards))\
+            for i, pages in enumerate(shards)]
+
+        # Stop the shards as soon as the call is cancelled, e.g. when a reload is aborted in Qlik
+        def stop():
+            for task in tasks:
+                task.stop()
+        context.add_callback(stop)
+
+        for task in tasks:
+            task.start()
+
+        try:
+            description = None
+            for task in tasks:
+                if description is None:
+                    description = task.get_description()
+                    context.send_initial_metadata((('qlik-tabledescription-bin', description),))
+                elif task.get_description() != description:
+                    raise ShardError("Shard {0} of {1} was described differently by {2}. Check that the peers run the "\
+                        "same version of the SSE.".format(task.index + 1, len(tasks), task.peer_name),\
+                        grpc.StatusCode.FAILED_PRECONDITION)
+
+                item = task.buffer.get()
+                while item is not None:
+                    yield item
+                    item = task.buffer.get()
+        finally:
+            for task in tasks:
+                task.stop()
+                task.buffer.discard()
+
+    @staticmethod
+    def _get_credentials(pem_dir):
+        """
+        Get the client credentials for peers running in secure mode.
+        """
+        with open(os.path.join(pem_dir, 'root_cert.pem'), 'rb') as f:
+            root_cert = f.read()
+        with open(os.path.join(pem_dir, 'sse_client_key.pem'), 'rb') as f:
+            private_key = f.read()
+        with open(os.path.join(pem_dir, 'sse_client_cert.pem'), 'rb') as f:
+            cert_chain = f.read()
+        return grpc.ssl_channel_credentials(root_cert, private_key, cert_chain)
+
+class _Shard:
+    """
+    A shard of pages read from a peer on a background thread into a buffer.
+    """
+
+    def __init__(self, coordinator, path, args, pages, peer, function_id, index, count):
+        """
+        :param coordinator: the Coordinator with the peers
+        :param path: the path of the SAS file
+        :param args: the additional arguments for Read_SAS, without the pages
+        :param pages: a tuple of the first page and the page after the last page
+        :param peer: the index of the peer to try first
+        :param function_id: the function called on the peers
+        :param index: the index of the shard in the read
+        :param count: the number of shards in the read
+        """
+        self.coordinator = coordinator
+        self.pages = pages
+        self.peer = peer
+        self.index = index
+        self.count = count
+        self.peer_name = coordinator.peers[peer]
+
+        pages = 'pages={0}:{1}'.format(*pages)
+        args = '{0}, {1}'.format(args, pages) if args.strip() else pages
+        self.request = [SSE.BundledRows(rows=[SSE.Row(duals=[SSE.Dual(strData=path), SSE.Dual(strData=args)])])]
+        self.metadata = [('qlik-functionrequestheader-bin', SSE.FunctionRequestHeader(functionId=function_id)\
+            .SerializeToString())]
+
+        self.buffer = _Buffer(coordinator.buffer_size)
+        self.rows = 0
+        self.description = None
+        self.error = None
+        self.described = threading.Event()
+        self.stopped = threading.Event()
+
+        # The call in progress, protected by the lock so that it can be cancelled
+        self.call = None
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='shard-{}'.format(index), daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop reading the shard and cancel the call to the peer.
+        """
+        self.stopped.set()
+        with self._lock:
+            if self.call is not None:
+                self.call.cancel()
+
+    def get_description(self):
+        """
+        Wait for the table description from the peer.
+        :return: the serialized TableDescription
+        :raises ShardError: if the shard failed before the table was described
+        """
+        self.described.wait()
+        if self.description is None:
+            raise self.error or ShardError('Shard {0} of {1} returned no table description from {2}'\
+                .format(self.index + 1, self.count, self.peer_name), grpc.StatusCode.INTERNAL)
+        return self.description
+
+    def _run(self):
+        """
+        Read the shard from each peer in turn until it succeeds.
+        """
+        peers = len(self.coordinator.peers)
+        error = None
+
+        try:
+            for attempt in range(peers):
+                if self.stopped.is_set():
+                    break
+
+                peer = (self.peer + attempt) % peers
+                self.peer_name = self.coordinator.peers[peer]
+                if attempt and self.coordinator.metrics is not None:
+                    self.coordinator.metrics.inc('sse_shard_retries_total')
+
+                try:
+                    self._read(self.coordinator.calls[peer])
+                    return
+                except grpc.RpcError as e:
+                    error = e
+                    if self.stopped.is_set() or e.code() not in _RETRY_CODES:
+                        break
+                    logging.warning('Shard {0} of {1} (pages {2}:{3}) failed on {4} after {5} rows: {6}'\
+                        .format(self.index + 1, self.count, self.pages[0], self.pages[1], self.peer_name, self.rows,\
+                        e.details()))
+
+            if self.stopped.is_set():
+                self.error = ShardError('Shard {0} of {1} was stopped'.format(self.index + 1, self.count),\
+                    grpc.StatusCode.CANCELLED)
+            else:
+                # Errors that were retried on every peer are returned as UNAVAILABLE, others as returned by the peer
+                self.error = ShardError('Shard {0} of {1} (pages {2}:{3}) failed on {4}: {5}'.format(self.index + 1,\
+                    self.count, self.pages[0], self.pages[1], self.peer_name, error.details()),\
+                    grpc.StatusCode.UNAVAILABLE if error.code() in _RETRY_CODES else error.code())
+        except Exception as e:
+            self.error = ShardError('Shard {0} of {1} failed: {2}'.format(self.index + 1, self.count, e),\
+                grpc.StatusCode.INTERNAL)
+        finally:
+            self.buffer.close(self.error)
+            self.described.set()
+
+    def _read(self, execute):
+        """
+        Call a peer and buffer the rows of the shard, skipping the rows received in an earlier attempt.
+        """
+        skip = self.rows
+        call = execute(iter(self.request), metadata=self.metadata)
+
+        with self._lock:
+            self.call = call
+        if self.stopped.is_set():
+            call.cancel()
+
+        if self.description is None:
+            self.description = dict(call.initial_metadata()).get('qlik-tabledescription-bin')
+            if self.description is not None:
+                self.described.set()
+
+        for data in call:
+            rows, offset = _count_rows(data, skip)
+            if skip >= rows:
+                skip -= rows
+                continue
+            elif skip:
+                data, rows, skip = data[offset:], rows - skip, 0
+
+            self.buffer.put(data, rows)
+            self.rows += rows
+
+def _count_rows(data, skip=0):
+    """
+    Count the rows in a serialized BundledRows from the length of each row, without parsing the rows.
+    :param data: a serialized BundledRows
+    :param skip: a number of rows to be skipped
+    :return: a tuple of the number of rows, and the offset of the row after the skipped rows
+    """
+    rows = position = 0
+    offset = len(data)
+
+    while position < len(data):
+        if rows == skip:
+            offset = position
+
+        # Each row is a length delimited field with a one byte tag, followed by the length as a varint
+        position += 1
+        length = shift = 0
+        while True:
+            byte = data[position]
+            position += 1
+            length |= (byte & 0x7F) << shift
+            shift += 7
+            if byte < 0x80:
+                break
+
+        position += length
+        rows += 1
+
+    return rows, offset
+
+class _Buffer:
+    """
+    A first in, first out buffer of serialized BundledRows. Messages are held in memory up to a size, and spilled to a
+    temporary file beyond it, so that peers are not held up when Qlik is still receiving the rows of an earlier shard.
+    """
+
+    def __init__(self, size):
+        """
+        :param size: the size in bytes of the messages held in memory
+        """
+        self.size = size
+        self.memory = deque()
+        self.used = 0
+
+        # Messages spilled to disk are read back in order, once the messages in memory have been read
+        self.file = None
+        self.spilled = 0
+        self.read_position = self.write_position = 0
+
+        self.closed = False
+        self.error = None
+        self._condition = threading.Condition()
+
+    def put(self, data, rows):
+        with self._condition:
+            if self.closed:
+                return
+
+            if not self.spilled and self.used + len(data) <= self.size:
+                self.memory.append((data, rows))
+                self.used += len(data)
+            else:
+                if self.file is None:
+                    self.file = tempfile.TemporaryFile()
+                self.file.seek(self.write_position)
+                self.file.write(_HEADER.pack(len(data), rows) + data)
+                self.write_position = self.file.tell()
+                self.spilled += 1
+
+            self._condition.notify()
+
+    def get(self):
+        """
+        Wait for the next message.
+        :return: a tuple of the serialized BundledRows and the number of rows, or None once the buffer has been closed
+        and read
+        :raises ShardError: if the buffer was closed with an error
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.memory or self.spilled or self.closed)
+
+            if self.memory:
+                item = self.memory.popleft()
+                self.used -= len(item[0])
+                return item
+            elif self.spilled:
+                self.file.seek(self.read_position)
+                length, rows = _HEADER.unpack(self.file.read(_HEADER.size))
+                item = (self.file.read(length), rows)
+                self.read_position = self.file.tell()
+                self.spilled -= 1
+
+                # Reuse the file from the start once everything spilled has been read
+                if not self.spilled:
+                    self.read_position = self.write_position = 0
+                    self.file.truncate(0)
+                return item
+            elif self.error is not None:
+                raise self.error
+            return None
+
+    def close(self, error=None):
+        """
+        Close the buffer. Messages already buffered can still be read, after which the error is raised if given.
+        """
+        with self._condition:
+            if not self.closed:
+                self.closed = True
+                self.error = error
+            self._condition.notify_all()
+
+    def discard(self):
+        """
+        Drop the buffered messages and remove the temporary file.
+        """
+        with self._condition:
+            self.closed = True
+            self.memory.clear()
+            self.spilled = 0
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self._condition.notify_all()
+
+class ShardError(Exception):
+    """
+    Exception raised when a shard of a read cannot be read from any of the peers
+    """
+
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.code = code
@@ -0,0 +1,139 @@
+import atexit
+import itertools
+import os
+import queue
+import sys
+import threading
+
+# Limits for data frames rendered in the logs, so that wide or long outputs do not produce huge dumps
+_MAX_LOG_ROWS = 100
+_MAX_LOG_COLUMNS = 50
+
+class LogWriter:
+    """
+    A class to write request logs on a background thread.
+    Request threads queue messages and return immediately. The writer renders the messages, prints them to stdout
+    and appends them to the log files, opening each file once for a batch of messages.
+    """
+
+    def __init__(self):
+        """
+        Class initializer.
+        """
+        self.queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+        # Write any queued messages before the process exits
+        atexit.register(self.flush)
+
+    def write(self, path, message, echo=True):
+        """
+        Queue a message for a log file.
+        :param path: the log file, or None to only print the message
+        :param message: a string, or a function that returns the string. Functions are called on the writer thread.
+        :param echo: print the message to stdout as well
+        """
+        self.queue.put((path, message, echo))
+
+    def flush(self):
+        """
+        Wait until all queued messages have been written.
+        """
+        self.queue.join()
+
+    def _run(self):
+        """
+        Write messages from the queue in batches.
+        """
+        while True:
+            batch = [self.queue.get()]
+
+            # Take all messages that are already waiting, so that each file is opened once for the batch
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._write_batch(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    @staticmethod
+    def _write_batch(batch):
+        """
+        Render a batch of messages and write them to stdout and the log files.
+        """
+        files = {}
+
+        for path, message, echo in batch:
+            try:
+                text = message() if callable(message) else message
+            except Exception as e:
+                text = "\nCould not render log message: {0}\n\n".format(e)
+
+            if echo:
+                sys.stdout.write(text)
+
+            if path is not None:
+                files.setdefault(path, []).append(text)
+
+        sys.stdout.flush()
+
+        for path, texts in files.items():
+            try:
+                with open(path, 'a') as f:
+                    f.write(''.join(texts))
+            except OSError as e:
+                sys.stdout.write("\nCould not write to log file {0}: {1}\n\n".format(path, e))
+
+class RequestLog:
+    """
+    The log for a single request, written to logs/SAS Reader Log <n>.txt with a number that is unique in the process.
+    """
+
+    # Log numbers are taken from a shared counter under a lock, as requests are handled by several threads
+    _numbers = itertools.count(1)
+    _lock = threading.Lock()
+    _writer = None
+
+    def __init__(self, enabled=True):
+        """
+        Class initializer.
+        :param enabled: write messages to the log file. If False, messages are only printed to stdout.
+        """
+        with RequestLog._lock:
+            if RequestLog._writer is None:
+                RequestLog._writer = LogWriter()
+
+            self.log_no = next(RequestLog._numbers) if enabled else None
+
+        self.writer = RequestLog._writer
+        self.path = os.path.join(os.getcwd(), 'logs', 'SAS Reader Log {}.txt'.format(self.log_no)) if enabled else None
+
+        # Start a new file for this request
+        if enabled:
+            self.writer.write(self.path, self._truncate, echo=False)
+
+    def write(self, message):
+        """
+        Queue a message for stdout and the log file.
+        :param message: a string, or a function that returns the string so that it is rendered on the writer thread
+        """
+        self.writer.write(self.path, message)
+
+    def _truncate(self):
+        """
+        Empty the log file left by an earlier process that used the same log number.
+        """
+        open(self.path, 'w').close()
+        return ''
+
+def render_frame(df):
+    """
+    Render a data frame for the logs, limiting the number of rows and columns.
+    """
+    return df.to_string(max_rows=_MAX_LOG_ROWS, max_cols=_MAX_LOG_COLUMNS)
@@ -0,0 +1,98 @@
+import tracemalloc
+
+from _metrics import get_rss
+
+_MB = 1024 * 1024
+
+class MemoryTracker:
+    """
+    A class to record the memory used while a request executes.
+    Memory is sampled as each chunk is read from the file, decoded and encoded, rather than on every allocation, so that
+    tracking is cheap. The process resident memory (RSS) is always sampled. Python allocations are traced if tracemalloc
+    has been started, with the peak taken from tracemalloc so that allocations freed between samples are counted.
+    Both figures are for the whole process, so they include the growth from other requests executing at the same time.
+    The limit is checked against this growth, so a request can be stopped by memory used by concurrent requests.
+    """
+
+    def __init__(self, limit=None):
+        """
+        Class initializer.
+        :param limit: the maximum growth in resident memory in bytes before the request is stopped, or None for no limit
+        """
+        self.limit = limit
+        self.start_rss = self.peak_rss = get_rss()
+
+        # The peak of traced allocations is reset so that it starts from the current size for this request
+        if tracemalloc.is_tracing() and hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        self.start_traced = self.peak_traced = _get_traced(peak=False)
+
+    @staticmethod
+    def start_tracing():
+        """
+        Start tracing Python allocations for all requests. Tracing adds an overhead to every allocation.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(1)
+
+    def sample(self):
+        """
+        Record the current memory usage.
+        :raises MemoryLimitError: if the growth in resident memory exceeds the limit
+        """
+        rss = get_rss()
+        if rss is not None and self.start_rss is not None:
+            self.peak_rss = max(self.peak_rss, rss)
+
+        traced = _get_traced()
+        if traced is not None and self.start_traced is not None:
+            self.peak_traced = max(self.peak_traced, traced)
+
+        if self.limit and self.rss_growth is not None and self.rss_growth > self.limit:
+            raise MemoryLimitError("Memory grew by {0:.0f} MB, over the limit of {1:.0f} MB per request."\
+                .format(self.rss_growth / _MB, self.limit / _MB))
+
+    @property
+    def rss_growth(self):
+        """
+        The growth in resident memory in bytes from the start of the request to the peak sample, or None if unknown.
+        """
+        if self.start_rss is None:
+            return None
+        return self.peak_rss - self.start_rss
+
+    @property
+    def traced_growth(self):
+        """
+        The growth in Python allocations in bytes from the start of the request to the peak sample, or None if not traced.
+        """
+        if self.start_traced is None:
+            return None
+        return self.peak_traced - self.start_traced
+
+    def summary(self):
+        """
+        Return a description of the memory used by the request.
+        """
+        python = 'not traced' if self.traced_growth is None else '+{0:.1f} MB'.format(self.traced_growth / _MB)
+        rss = 'unknown' if self.rss_growth is None else '+{0:.1f} MB (peak {1:.1f} MB)'.format(self.rss_growth / _MB,\
+            self.peak_rss / _MB)
+        return 'Python allocations {0}, RSS {1}'.format(python, rss)
+
+def _get_traced(peak=True):
+    """
+    Return the size of traced Python allocations in bytes, or None if tracemalloc is not tracing.
+    :param peak: return the peak size since the peak was last reset, rather than the current size. The peak is reset by
+    each request, so it covers the later of the start of this request and the start of the last concurrent request.
+    The current size is used before Python 3.9, where the peak cannot be reset.
+    """
+    if tracemalloc.is_tracing():
+        current, highest = tracemalloc.get_traced_memory()
+        return highest if peak and hasattr(tracemalloc, 'reset_peak') else current
+    return None
+
+class MemoryLimitError(Exception):
+    """
+    Raised when a request uses more memory than the limit.
+    """
+    pass
@@ -0,0 +1,183 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Upper bounds in seconds for the latency histogram buckets
+_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds in bytes for the memory histogram buckets, from 16 MB to 8 GB
+_MEMORY_BUCKETS = tuple(2 ** n * 1024 * 1024 for n in range(4, 14))
+
+# Buckets for histograms that do not measure latency
+_BUCKETS = {'sse_request_rss_growth_bytes': _MEMORY_BUCKETS, 'sse_request_python_growth_bytes': _MEMORY_BUCKETS}
+
+# Characters escaped in label values, as required by the Prometheus text format
+_LABEL_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n'})
+
+# Type and description for each metric
+_METRICS = {
+    'sse_requests_total': ('counter', 'Function calls received'),
+    'sse_requests_rejected_total': ('counter', 'Function calls rejected because the server was busy'),
+    'sse_requests_cancelled_total': ('counter', 'Reads cancelled by the client before completion'),
+    'sse_requests_memory_limit_total': ('counter', 'Reads stopped because memory grew beyond the limit per request'),
+    'sse_rows_total': ('counter', 'Rows streamed to Qlik'),
+    'sse_bytes_total': ('counter', 'Bytes of BundledRows streamed to Qlik, before compression'),
+    'sse_bundles_total': ('counter', 'BundledRows messages streamed to Qlik'),
+    'sse_rows_converted_total': ('counter', 'Rows written to QVD or CSV files by Convert_SAS'),
+    'sse_decode_memo_hits_total': ('counter', 'Distinct string values found in the decode memo'),
+    'sse_decode_memo_misses_total': ('counter', 'Distinct string values that had to be decoded'),
+    'sse_cache_hits_total': ('counter', 'Reads served from decoded copies of SAS files in the cache'),
+    'sse_cache_misses_total': ('counter', 'Reads of SAS files without a valid copy in the cache'),
+    'sse_cache_files_loaded_total': ('counter', 'SAS files loaded into the cache by the directory watcher'),
+    'sse_shards_total': ('counter', 'Shards of reads sent to peer SSE instances in coordinator mode'),
+    'sse_shard_retries_total': ('counter', 'Shards retried on another peer after a peer failed'),
+    'sse_chunk_decode_seconds': ('histogram', 'Time to read and decode a chunk of the SAS file'),
+    'sse_bundle_encode_seconds': ('histogram', 'Time to encode a bundle of rows as Duals'),
+    'sse_request_rss_growth_bytes': ('histogram', 'Growth in resident memory of the process during a read'),
+    'sse_request_python_growth_bytes': ('histogram', 'Growth in traced Python allocations during a read'),
+    'sse_active_requests': ('gauge', 'Function calls executing'),
+    'sse_queued_requests': ('gauge', 'Function calls waiting to execute'),
+    'sse_process_resident_memory_bytes': ('gauge', 'Resident memory size of the SSE process'),
+}
+
+class Metrics:
+    """
+    A class to collect performance metrics for the SSE and expose them in the Prometheus text format.
+    Counters and histograms are updated in place with a short lock. Gauges are only read when the metrics are scraped.
+    """
+
+    def __init__(self):
+        """
+        Class initializer.
+        """
+        # Values keyed by metric name and a tuple of label pairs, protected by the lock
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+        # Functions that return the current value of each gauge
+        self.gauges = {'sse_process_resident_memory_bytes': get_rss}
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increment a counter.
+        """
+        key = (name, tuple(sorted(labels.items())))
+
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Add an observation to a histogram.
+        """
+        key = (name, tuple(sorted(labels.items())))
+
+        with self._lock:
+            # Counts for each bucket, followed by the sum and the count of observations
+            buckets = _BUCKETS.get(name, _LATENCY_BUCKETS)
+            histogram = self.histograms.setdefault(key, [0] * (len(buckets) + 2))
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def gauge(self, name, function):
+        """
+        Set the function used to read a gauge when the metrics are scraped.
+        """
+        self.gauges[name] = function
+
+    def timed(self, name, iterable, **labels):
+        """
+        Generator that yields items from the iterable and observes the time taken to get each one.
+        """
+        iterator = iter(iterable)
+
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(name, time.perf_counter() - start, **labels)
+
+            yield item
+
+    def render(self):
+        """
+        Return the metrics in the Prometheus text format.
+        """
+        with self._lock:
+            samples = [(name, labels, value) for (name, labels), value in self.counters.items()]
+
+            for (name, labels), histogram in self.histograms.items():
+                for bound, count in zip(_BUCKETS.get(name, _LATENCY_BUCKETS), histogram):
+                    samples.append((name + '_bucket', labels + (('le', str(bound)),), count))
+                samples.append((name + '_bucket', labels + (('le', '+Inf'),), histogram[-1]))
+                samples.append((name + '_sum', labels, histogram[-2]))
+                samples.append((name + '_count', labels, histogram[-1]))
+
+        for name, function in self.gauges.items():
+            value = function()
+            if value is not None:
+                samples.append((name, (), value))
+
+        lines = []
+        for name in sorted(_METRICS):
+            metric_type, description = _METRICS[name]
+            lines.append('# HELP {0} {1}'.format(name, description))
+            lines.append('# TYPE {0} {1}'.format(name, metric_type))
+
+            for sample, labels, value in samples:
+                if sample == name or (metric_type == 'histogram' and sample.rsplit('_', 1)[0] == name):
+                    label_text = ','.join('{0}="{1}"'.format(k, str(v).translate(_LABEL_ESCAPES)) for k, v in labels)
+                    lines.append('{0}{1} {2}'.format(sample, '{' + label_text + '}' if label_text else '', value))
+
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """
+        Serve the metrics over HTTP on a background thread.
+        :param port: the local port for the metrics endpoint
+        :param host: the address to bind to. By default only local clients can scrape the metrics.
+        :return: the HTTP server
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes are not written to stderr
+                pass
+
+        server = HTTPServer((host, int(port)), Handler)
+        threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+        return server
+
+def get_rss():
+    """
+    Return the resident memory size of the current process in bytes, or None if it cannot be determined.
+    """
+    try:
+        # Linux
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    try:
+        # Windows and macOS, if psutil is installed
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
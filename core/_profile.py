@@ -0,0 +1,246 @@
+import numpy as np
+import pandas as pd
+
+from _aggregate import AggregationError
+from _writers import get_date_values
+
+# Output columns for Profile_SAS, with one row for each variable
+COLUMNS = ['variable', 'type', 'rows', 'nulls', 'distinct', 'min', 'max', 'mean', 'std', 'top_values']
+_NUMERIC_COLUMNS = ('rows', 'nulls', 'distinct', 'mean', 'std')
+
+# Number of HyperLogLog registers as a power of 2. 2^14 registers give a standard error of about 0.8%.
+_HLL_PRECISION = 14
+
+# Minimum number of values counted for each column to find the most frequent values
+_MIN_TOP_CAPACITY = 100
+
+class ColumnStatistics:
+    """
+    A class to profile the variables in a SAS dataset one chunk at a time, so that only the statistics are sent to Qlik.
+    Running statistics are kept for each column and updated with vectorized operations on each chunk: counts, min and
+    max, mean and variance merged across chunks, a HyperLogLog sketch for the number of distinct values, and bounded
+    counts of the most frequent values. The counts are exact while the distinct values fit within the capacity, and
+    upper bounds beyond that.
+    This has the same interface as the Aggregator, so the chunks are read, scheduled and cancelled in the same way.
+    """
+
+    def __init__(self, columns=None, top=5):
+        """
+        Class initializer.
+        :param columns: a list of the columns to profile, or None for all columns
+        :param top: the number of most frequent values to return for each column
+        """
+        self.selected = columns
+        self.top = top
+        self.capacity = max(_MIN_TOP_CAPACITY, 10 * top)
+
+        # Names of the output columns, and the columns profiled. These are set from the sample data if not selected.
+        self.columns = COLUMNS
+        self.source_columns = list(columns or [])
+        self.stats = {}
+
+    def describe(self, sample_data, column_types):
+        """
+        Check the columns against the dataset and get the column types for the output.
+        :param sample_data: a data frame with sample rows from the dataset
+        :param column_types: the date, datetime and numeric columns in the dataset, keyed by column name
+        :return: the numeric columns in the output, keyed by column name
+        :raises AggregationError: if a column is not in the dataset
+        """
+        unknown = [col for col in self.source_columns if col not in sample_data.columns]
+        if unknown:
+            raise AggregationError("Columns not found in the SAS file: {0}. Valid columns are: {1}"\
+                .format(', '.join(unknown), ', '.join(sample_data.columns)))
+
+        self.source_columns = list(self.selected or sample_data.columns)
+        self.stats = {col: _ColumnState(self._get_kind(sample_data[col], column_types.get(col)), self.capacity)\
+            for col in self.source_columns}
+
+        return {name: 'numeric' for name in _NUMERIC_COLUMNS}
+
+    def add(self, df):
+        """
+        Update the statistics with a chunk of the dataset.
+        """
+        for col in self.source_columns:
+            self.stats[col].add(df[col])
+
+    def result(self, chunksize):
+        """
+        Generator that yields the statistics in chunks, with one row for each variable.
+        """
+        df = pd.DataFrame([[col] + self.stats[col].result(self.top) for col in self.source_columns], columns=COLUMNS)
+
+        for i in range(0, len(df), chunksize):
+            yield df.iloc[i : i + chunksize]
+
+    def empty(self):
+        """
+        Return an empty data frame with the output columns.
+        """
+        return pd.DataFrame(columns=self.columns)
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _get_kind(series, column_type):
+        if column_type in ('date', 'datetime'):
+            return column_type
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            return 'datetime'
+        elif pd.api.types.is_numeric_dtype(series):
+            return 'numeric'
+        return 'string'
+
+class _ColumnState:
+    """
+    Running statistics for a column.
+    """
+
+    def __init__(self, kind, capacity):
+        """
+        :param kind: numeric, date, datetime or string
+        :param capacity: the number of values counted to find the most frequent values
+        """
+        self.kind = kind
+        self.capacity = capacity
+        self.rows = 0
+        self.nulls = 0
+        self.min = self.max = None
+
+        # Count, mean and sum of squared differences from the mean, merged across chunks for numeric columns
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+        self.sketch = HyperLogLog()
+
+        # Counts for the most frequent values, and the largest count dropped to stay within the capacity
+        self.counts = pd.Series(dtype='int64')
+        self.dropped = 0
+
+    def add(self, series):
+        self.rows += len(series)
+
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Categorical columns are reduced to the categories present in the chunk
+            codes = series.cat.codes.values
+            present = series.cat.categories[np.unique(codes[codes >= 0])]
+            values = series.dropna().astype(object)
+            self.nulls += len(series) - len(values)
+            self._update_range(present.min() if len(present) else None, present.max() if len(present) else None)
+        else:
+            values = series.dropna()
+            self.nulls += len(series) - len(values)
+            if len(values):
+                self._update_range(values.min(), values.max())
+
+        if len(values) == 0:
+            return
+
+        if self.kind == 'numeric':
+            x = values.values.astype(np.float64)
+            n, mean = len(x), x.mean()
+            m2 = ((x - mean) ** 2).sum()
+
+            total = self.count + n
+            delta = mean - self.mean
+            self.mean += delta * n / total
+            self.m2 += m2 + delta * delta * self.count * n / total
+            self.count = total
+
+        self.sketch.add(pd.util.hash_pandas_object(values, index=False).values)
+
+        # Keep the counts for the most frequent values with the SpaceSaving algorithm, merged a chunk at a time.
+        # Values that are not being counted may have been dropped earlier, so they start from the largest count
+        # dropped rather than from zero. Every count is then at least the true count for the value, and at most
+        # self.dropped above it, so the most frequent values are not lost when the values exceed the capacity.
+        counts = values.value_counts(sort=False)
+        if self.dropped:
+            counts[self.counts.index.get_indexer(counts.index) < 0] += self.dropped
+        self.counts = self.counts.add(counts, fill_value=0).astype('int64') if len(self.counts) else counts
+        if len(self.counts) > self.capacity:
+            ranked = self.counts.sort_values(ascending=False, kind='mergesort')
+            self.dropped = max(self.dropped, int(ranked.iloc[self.capacity]))
+            self.counts = ranked.iloc[:self.capacity]
+
+    def result(self, top):
+        """
+        Return the statistics for the output row, excluding the variable name.
+        """
+        mean = std = np.nan
+        if self.kind == 'numeric' and self.count:
+            mean = self.mean
+            std = np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan
+
+        # Once values have been dropped, the counts are upper bounds. Only values counted more often than the largest
+        # count dropped are certain to be among the most frequent, and their counts are given as a range.
+        top_counts = self.counts[self.counts > self.dropped]
+        top_counts = top_counts.nlargest(top) if len(top_counts) else top_counts
+        labels = self._format(list(top_counts.index))
+        top_values = '; '.join('{0} ({1})'.format(label, self._format_count(int(count)))\
+            for label, count in zip(labels, top_counts.values))
+
+        minimum, maximum = self._format([self.min, self.max]) if self.kind != 'numeric' else (self.min, self.max)
+
+        return [self.kind, self.rows, self.nulls, self.sketch.estimate(), minimum, maximum, mean, std, top_values]
+
+    def _format_count(self, count):
+        """
+        Format a count, as the range of possible true counts if values have been dropped.
+        """
+        return str(count) if not self.dropped else '{0}..{1}'.format(count - self.dropped, count)
+
+    def _update_range(self, minimum, maximum):
+        if minimum is not None and (self.min is None or minimum < self.min):
+            self.min = minimum
+        if maximum is not None and (self.max is None or maximum > self.max):
+            self.max = maximum
+
+    def _format(self, values):
+        """
+        Format values as text for the output, with dates formatted as for Read_SAS.
+        """
+        if self.kind in ('date', 'datetime'):
+            texts = get_date_values(pd.Series(values), self.kind)[1]
+            return [text if isinstance(text, str) else None for text in texts]
+        elif self.kind == 'numeric':
+            return [str(int(value)) if float(value).is_integer() else str(value) for value in values]
+        return [None if value is None else str(value) for value in values]
+
+class HyperLogLog:
+    """
+    A HyperLogLog sketch to estimate the number of distinct values from 64-bit hashes.
+    """
+
+    def __init__(self, precision=_HLL_PRECISION):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    def add(self, hashes):
+        """
+        Add an array of uint64 hashes to the sketch.
+        """
+        bits = 64 - self.precision
+        index = (hashes >> np.uint64(bits)).astype(np.intp)
+        rest = hashes & np.uint64((1 << bits) - 1)
+
+        # The rank is the position of the leftmost 1 bit in the rest of the hash. frexp gives the bit length exactly.
+        rank = (bits + 1 - np.frexp(rest.astype(np.float64))[1]).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def estimate(self):
+        """
+        Return the estimated number of distinct values.
+        """
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / np.ldexp(1.0, -self.registers.astype(np.int32)).sum()
+
+        # Use linear counting for small cardinalities
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * np.log(self.m / zeros)
+
+        return int(round(estimate))
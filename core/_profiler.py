@@ -0,0 +1,136 @@
+import io
+import time
+import cProfile
+import pstats
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# CPU time for the current thread, so that work for other requests is excluded. Python 3.6 only has process time.
+_cpu_time = getattr(time, 'thread_time', time.process_time)
+
+class StageTimer:
+    """
+    A class to record the wall time, CPU time, rows and bytes for each stage of a request.
+    When the timer is disabled the methods do no work, so they can be left in place in the pipeline.
+    """
+
+    def __init__(self, enabled=True, top_functions=0):
+        """
+        Class initializer.
+        :param enabled: record timings if True
+        :param top_functions: the number of functions to report from cProfile. Set to 0 to disable cProfile.
+        """
+        self.enabled = enabled
+        self.top_functions = top_functions
+        self.start = time.perf_counter()
+
+        # Wall time, CPU time, calls, rows and bytes for each stage, in the order the stages were first seen
+        self.stages = OrderedDict()
+
+        # The profiler is only active within stages
+        self.profiler = cProfile.Profile() if enabled and top_functions else None
+        self._depth = 0
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Context manager that records the time spent in the block against a stage.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        self._enable_profiler()
+        wall, cpu = time.perf_counter(), _cpu_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, _cpu_time() - cpu)
+            self._disable_profiler()
+
+    def add(self, name, wall=0.0, cpu=0.0, calls=1, rows=0, size=0):
+        """
+        Add measurements to a stage.
+        """
+        if not self.enabled:
+            return
+
+        stage = self.stages.setdefault(name, [0.0, 0.0, 0, 0, 0])
+        stage[0] += wall
+        stage[1] += cpu
+        stage[2] += calls
+        stage[3] += rows
+        stage[4] += size
+
+    def timed(self, name, iterable, rows=None, size=None):
+        """
+        Time how long it takes to get each item from an iterable.
+        The iterable is returned unchanged if the timer is disabled.
+        :param name: the stage name
+        :param iterable: an iterable that does the work for the stage
+        :param rows: an optional function that returns the number of rows in an item
+        :param size: an optional function that returns the number of bytes in an item
+        """
+        if not self.enabled:
+            return iterable
+
+        return self._timed(name, iter(iterable), rows, size)
+
+    def _timed(self, name, iterator, rows, size):
+        while True:
+            self._enable_profiler()
+            wall, cpu = time.perf_counter(), _cpu_time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._disable_profiler()
+
+            self.add(name, time.perf_counter() - wall, _cpu_time() - cpu, 1, rows(item) if rows else 0,\
+                size(item) if size else 0)
+
+            yield item
+
+    def summary(self):
+        """
+        Return a table of the stages, with the total wall time for the request.
+        """
+        total = time.perf_counter() - self.start
+        lines = ["{0:<24}{1:>8}{2:>12}{3:>12}{4:>8}{5:>12}{6:>14}".format(\
+            "Stage", "Calls", "Wall (s)", "CPU (s)", "Wall %", "Rows", "Bytes")]
+
+        for name, (wall, cpu, calls, rows, size) in self.stages.items():
+            lines.append("{0:<24}{1:>8}{2:>12.3f}{3:>12.3f}{4:>8.1f}{5:>12}{6:>14}".format(\
+                name, calls, wall, cpu, 100 * wall / total if total else 0, rows, size))
+
+        lines.append("{0:<24}{1:>8}{2:>12.3f}".format("Total", "", total))
+
+        if self.profiler is not None:
+            stream = io.StringIO()
+            pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(self.top_functions)
+            lines.append("\nHOTTEST FUNCTIONS (cProfile, within the stages above):\n{0}".format(stream.getvalue()))
+
+        return "\n".join(lines)
+
+    def _enable_profiler(self):
+        """
+        Enable cProfile for the outermost stage.
+        """
+        if self.profiler is not None:
+            if self._depth == 0:
+                try:
+                    self.profiler.enable()
+                except ValueError:
+                    # Another request is being profiled, and only one profiler can be active at a time
+                    pass
+            self._depth += 1
+
+    def _disable_profiler(self):
+        """
+        Disable cProfile at the end of the outermost stage.
+        """
+        if self.profiler is not None:
+            self._depth -= 1
+            if self._depth == 0:
+                self.profiler.disable()
@@ -0,0 +1,178 @@
+import io
+import threading
+
+# Default size in bytes of the reads made from the underlying file
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+class ReadAheadFile(io.RawIOBase):
+    """
+    A read-only file object that reads large sequential blocks from the underlying file on a background thread.
+    SAS readers make many small reads, e.g. one per page. On a network share each of these is a round trip, so this
+    serves the small reads from blocks that have already been read, while the next blocks are read in the background.
+    Seeking outside the blocks held restarts the reads from the new position.
+    """
+
+    def __init__(self, raw, block_size=DEFAULT_BLOCK_SIZE, depth=4, name=None):
+        """
+        Class initializer.
+        :param raw: a binary file object supporting seek and read. Only the background thread reads from it.
+        :param block_size: the size in bytes of each read from the underlying file
+        :param depth: the number of blocks read ahead of the current position
+        :param name: the file name, used by the SAS readers in messages
+        """
+        self.name = name or getattr(raw, 'name', None)
+        self.block_size = block_size
+        self.size = raw.seek(0, io.SEEK_END)
+        self.position = 0
+
+        # The background thread only refers to the blocks, so the file is closed if it is garbage collected while open
+        self._blocks = _BlockReader(raw, self.size, block_size, depth)
+
+    @classmethod
+    def open(cls, path, block_size=DEFAULT_BLOCK_SIZE, depth=4):
+        """
+        Open a file for reading through the read-ahead layer.
+        """
+        return cls(open(path, 'rb', buffering=0), block_size, depth, name=path)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError("Invalid whence: {}".format(whence))
+
+        if position < 0:
+            raise ValueError("Negative seek position {}".format(position))
+        self.position = position
+        return self.position
+
+    def read(self, size=-1):
+        """
+        Read up to size bytes from the current position, waiting for the blocks to be read if required.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+
+        end = self.size if size is None or size < 0 else min(self.size, self.position + size)
+        parts = []
+
+        while self.position < end:
+            number, offset = divmod(self.position, self.block_size)
+            part = self._blocks.get(number)[offset : offset + end - self.position]
+            if not part:
+                break
+            parts.append(part)
+            self.position += len(part)
+
+        return parts[0] if len(parts) == 1 else b''.join(parts)
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._blocks.stop()
+        super().close()
+
+class _BlockReader:
+    """
+    The blocks read ahead for a ReadAheadFile, and the background thread that reads them.
+    Blocks are read in a window starting at the block holding the reader's position.
+    """
+
+    def __init__(self, raw, size, block_size, depth):
+        self.raw = raw
+        self.block_size = block_size
+        self.depth = depth
+        self.last = (size - 1) // block_size
+
+        # Blocks held, keyed by block number, and the block at the reader's position. Protected by the condition's lock.
+        self.blocks = {}
+        self.current = 0
+        self.error = None
+        self.stopped = False
+        self._condition = threading.Condition()
+
+        self._thread = threading.Thread(target=self._run, name='read-ahead', daemon=True)
+        self._thread.start()
+
+    def get(self, number):
+        """
+        Return a block, moving the window to start at this block and waiting for it to be read if required.
+        """
+        with self._condition:
+            if number != self.current:
+                self.current = number
+
+                # Drop blocks outside the window, keeping the previous block for small seeks backwards
+                for key in [key for key in self.blocks if key < number - 1 or key > number + self.depth]:
+                    del self.blocks[key]
+                self._condition.notify_all()
+
+            self._condition.wait_for(lambda: number in self.blocks or self.error is not None or number > self.last)
+
+            if number in self.blocks:
+                return self.blocks[number]
+            elif number > self.last:
+                return b''
+            raise self.error
+
+    def stop(self):
+        """
+        Stop the background thread and close the underlying file.
+        """
+        with self._condition:
+            self.stopped = True
+            self.blocks.clear()
+            self._condition.notify_all()
+
+        self._thread.join()
+        self.raw.close()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self.stopped or self._next_block() is not None)
+                if self.stopped:
+                    return
+                number = self._next_block()
+
+            try:
+                self.raw.seek(number * self.block_size)
+                data = self.raw.read(self.block_size)
+            except Exception as e:
+                with self._condition:
+                    self.error = e
+                    self._condition.notify_all()
+                return
+
+            with self._condition:
+                # The block is discarded if the reader has moved away from it while it was being read
+                if not self.stopped and self.current - 1 <= number <= self.current + self.depth:
+                    self.blocks[number] = data
+                    self._condition.notify_all()
+
+    def _next_block(self):
+        """
+        Return the first block in the window that has not been read, or None if the window is full.
+        Must be called with the condition's lock held.
+        """
+        for number in range(self.current, min(self.current + self.depth, self.last) + 1):
+            if number not in self.blocks:
+                return number
+        return None
@@ -1,67 +1,194 @@
 import os
+import re
 import sys
 import time
 import string
+import logging
 import numpy as np
 import pandas as pd
 import ServerSideExtension_pb2 as SSE
 
 from sas7bdat import SAS7BDAT
+from _scheduler import PRIORITIES, parse_priority
+from _aggregate import Aggregator, AggregationError, parse_groupby, parse_agg
+from _profile import ColumnStatistics
+from _profiler import StageTimer
+from _read_ahead import ReadAheadFile
+from _compressed import CompressedSource, detect_compression
+from _checkpoint import ResumeError, get_checkpoint, get_page_range, parse_token, resume, select_pages
+from _log_writer import RequestLog, render_frame
 
 # Add Generated folder to module path
 PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(os.path.join(PARENT_DIR, 'generated'))
 
+# Maximum number of distinct values memoized per column when decoding raw bytes
+_MAX_MEMO_SIZE = 10000
+
+# Maximum number of distinct values, and ratio of distinct values to rows, for a column to be dictionary encoded
+_MAX_CATEGORIES = 1000
+_MAX_CATEGORY_RATIO = 0.5
+
+# Number of files converted at the same time by Convert_SAS
+_DEFAULT_THREADS = 2
+
+# Number of groups held in memory when aggregating, before spilling to disk
+_DEFAULT_MAX_GROUPS = 1000000
+
+# Size in KB of the reads made from SAS files, and the number of these read ahead of the reader on a background thread
+_DEFAULT_BLOCK_SIZE = 1024
+_DEFAULT_READ_AHEAD = 4
+
+# Seed for sampling rows, so that a sample gives the same rows on every reload
+_SAMPLE_SEED = 0
+
+# Time in seconds between checkpoints written to the service log for resuming a read
+_DEFAULT_CHECKPOINT_INTERVAL = 60
+
+# SAS formats for variables stored as dates (days since 1960-01-01) or datetimes (seconds since 1960-01-01)
+# Time formats such as TOD and TIME are left as numbers, as they can hold a time of day without a date
+_SAS_DATE_FORMATS = ("DATE", "DAY", "DDMMYY", "DOWNAME", "JULDAY", "JULIAN", "MMDDYY", "MMYY", "MMYYC", "MMYYD", "MMYYP",\
+    "MMYYS", "MMYYN", "MONNAME", "MONTH", "MONYY", "QTR", "QTRR", "NENGO", "WEEKDATE", "WEEKDATX", "WEEKDAY", "WEEKV",\
+    "WORDDATE", "WORDDATX", "YEAR", "YYMM", "YYMMC", "YYMMD", "YYMMP", "YYMMS", "YYMMN", "YYMON", "YYMMDD", "YYQ", "YYQC",\
+    "YYQD", "YYQP", "YYQS", "YYQN", "YYQR", "YYQRC", "YYQRD", "YYQRP", "YYQRS", "YYQRN", "YYMMDDP", "YYMMDDC", "E8601DA",\
+    "YYMMDDN", "MMDDYYC", "MMDDYYS", "MMDDYYD", "YYMMDDS", "B8601DA", "DDMMYYN", "YYMMDDD", "DDMMYYB", "DDMMYYP", "MMDDYYP",\
+    "YYMMDDB", "MMDDYYN", "DDMMYYC", "DDMMYYD", "DDMMYYS", "MINGUO")
+_SAS_DATETIME_FORMATS = ("DATETIME", "DTWKDATX", "B8601DN", "B8601DT", "B8601DX", "B8601DZ", "B8601LX", "E8601DN",\
+    "E8601DT", "E8601DX", "E8601DZ", "E8601LX", "DATEAMPM", "DTDATE", "DTMONYY", "DTYEAR", "MDYAMPM")
+
 class SASReader:
     """
     A class to read SAS datasets for Qlik.
     """
     
-    # Counter used to name log files for instances of the class
-    log_no = 0
-    
-    def __init__(self, request, context):
+    def __init__(self, request, context, filepath=None, cache=None, distinct=False, statistics=False, memory=None):
         """
         Class initializer.
         :param request: an iterable sequence of RowData
         :param context:
-        :param variant: a string to indicate the request format
+        :param filepath: the SAS file to read, if it is not the path in the request e.g. when the path is a pattern
+        :param cache: a SASCache holding decoded copies of SAS files, or None if the cache is not enabled
+        :param distinct: read the distinct values of the columns in the second argument, as for Get_Distinct
+        :param statistics: read statistics for each variable instead of the data, as for Profile_SAS
+        :param memory: a MemoryTracker sampled as each chunk is read from the file, so that a read that grows beyond the
+        memory limit is stopped before the chunk is decoded
         :Sets up the input data frame and parameters based on the request
         """
                
         # Set the request and context variables for this object instance
         self.request = request
         self.context = context
+
+        # Decoded values for byte columns, keyed by column name. Set to None for high cardinality columns.
+        self.decode_memo = {}
+
+        # Codec for each byte column, keyed by column name. This is chosen from the first values decoded in the column.
+        self.decode_codecs = {}
+
+        # Columns to be carried as pandas Categoricals. This is determined from the first chunk of data.
+        self.categorical = None
+
+        # Distinct values seen in each categorical column, so that columns with too many across chunks can be dropped
+        self.categories = {}
+
+        # Date, datetime and numeric columns, keyed by column name. This is determined from the SAS formats and sample data.
+        self.column_types = {}
+
+        # The pandas reader or data frame, set when the file is read
+        self.reader = None
+
+        # Read-ahead files opened for pandas readers, keyed by the id of the reader. pandas does not close these.
+        self.files = {}
+
+        # The cache of decoded SAS files, and whether this file was read from it
+        self.cache = cache
+        self.memory = memory
+        self.cache_hit = False
+
+        # Sample data used to describe the table, and the variable labels if these were loaded from the cache
+        self.sample_data = None
+        self.cached_labels = None
+
+        # Cells in the last chunk aggregated, used to charge the aggregation to this request in the scheduler
+        self.aggregated_cells = 0
+
+        # Number of distinct values found in, and missing from, the decode memo. These are reported in the SSE metrics.
+        self.memo_hits = 0
+        self.memo_misses = 0
         
         # Extract the file path from the request list
-        self.filepath = self.request[0].rows[0].duals[0].strData
+        self.filepath = filepath or self.request[0].rows[0].duals[0].strData
         
-        # Extract additional arguments from the request list
+        # Extract additional arguments from the request list. For Get_Distinct these follow the list of columns.
         try:
-            kwargs = self.request[0].rows[0].duals[1].strData
+            kwargs = self.request[0].rows[0].duals[2 if distinct else 1].strData
         except IndexError:
-            kwargs = None
+            kwargs = ''
         
         # Set parameters from the additional arguments
         self._set_params(kwargs)
+
+        # Compressed files are detected from their magic bytes and decompressed as they are read
+        compression = detect_compression(self.filepath)
+        self.source = None
+        if compression is not None:
+            self.source = CompressedSource(self.filepath, compression, self.member, open_raw=self._open_raw)
+
+        # Get the distinct values of the columns by grouping on them, with the number of rows for each if counts = true
+        if distinct:
+            columns = [col.strip() for col in self.request[0].rows[0].duals[1].strData.split(',') if col.strip()]
+            if not columns:
+                raise AggregationError("Get_Distinct requires one or more columns")
+            self.aggregator = Aggregator([(col, None) for col in columns], [(None, 'count')] if self.counts else [],\
+                self.max_groups)
+
+        # Profile the variables with running statistics for each column
+        if statistics:
+            self.aggregator = ColumnStatistics(self.selected_columns, self.top)
+        self.statistics = statistics
+
+        # A resumed read, or a shard of pages, must give exactly the rows after the checkpoint or on the pages
+        if (self.resume_from is not None or self.pages is not None) and (self.aggregator or self.sample is not None):
+            raise ResumeError("resume_from and pages cannot be used with sample, groupby, agg, Get_Distinct or Profile_SAS")
+
+        # Random numbers for sampling rows if sample is set
+        self.rng = np.random.default_rng(_SAMPLE_SEED)
+
+        # Time each stage of the request if profile = true
+        self.timer = StageTimer(self.profile, self.profile_functions)
         
-        # Parameters are output to the log if debug = true
-        if self.debug:
+        # Parameters are output to the log if debug = true or profile = true. Otherwise messages only go to stdout.
+        self.log = RequestLog(self.debug or self.profile)
+        if self.debug or self.profile:
             self._print_log(1)
     
-    def read(self):
+    def read(self, describe=True):
         """
-        Read the SAS dataset and return as a Pandas Data Frame or an iterator to read the file in chunks.
+        Read the SAS dataset and return an iterator to read the file in chunks of prepared data frames.
+        :param describe: send the table description to Qlik. This is false when the data is not sent to Qlik.
         """
         self.reader = None
         retry = False
 
+        # Use the decoded copy of the file if it has been loaded into the cache
+        entry = self._get_cache_entry()
+        if entry is not None:
+            with self.timer.stage("describe"):
+                self._send_table_description(send=describe)
+            chunks = entry.chunks(self.chunksize)
+            if self.resume_from is not None:
+                chunks = self._resumed_chunks(chunks, self.resume_from[0])
+            if self.selected_columns or self.sample is not None:
+                chunks = self._filtered_chunks(chunks)
+            return self._aggregated_chunks(chunks) if self.aggregator else chunks
+
         # If encoding is not specified, we try some common codecs 
         if self.encoding is None:
             # Try encoding with each of the default codecs
             for cp in self.default_encoding:
                 try:
-                    self.reader = pd.read_sas(self.filepath, encoding=cp, **self.read_sas_kwargs)
+                    with self.timer.stage("open"):
+                        self.reader = self._open_sas(encoding=cp, **self.read_sas_kwargs)
                     self.encoding = cp
                     break
                 except UnicodeDecodeError:
@@ -78,8 +205,10 @@ class SASReader:
             if retry:
                 for cp in self.default_encoding:
                     try:
-                        handle = SAS7BDAT(self.filepath, skip_header=False, encoding=cp, encoding_errors="strict")
-                        self.reader = handle.to_data_frame()
+                        with self.timer.stage("open (SAS7BDAT)"):
+                            handle = SAS7BDAT(self.filepath, skip_header=False, encoding=cp, encoding_errors="strict",\
+                                fh=self._open_file())
+                            self.reader = self._read_sas7bdat(handle)
                         handle.close()
                         self.encoding = cp
                         break
@@ -90,7 +219,8 @@ class SASReader:
         # Instantiate the reader if we haven't already done so
         if self.reader is None:
             try:
-                self.reader = pd.read_sas(self.filepath, **self.read_sas_kwargs)
+                with self.timer.stage("open"):
+                    self.reader = self._open_sas(**self.read_sas_kwargs)
             except (OverflowError, ValueError) as e:
                 self._print_exception("Exception when reading the file with pandas. A second attempt will be made using the SAS7BDAT module", e)
                 
@@ -100,52 +230,530 @@ class SASReader:
                     cp = 'utf_8'                    
 
                 # If pandas failed to read the file we retry with the SAS7BDAT module
-                handle = SAS7BDAT(self.filepath, skip_header=False, encoding=cp, encoding_errors="ignore")
-                self.reader = handle.to_data_frame()
-                handle.close()
+                with self.timer.stage("open (SAS7BDAT)"):
+                    handle = SAS7BDAT(self.filepath, skip_header=False, encoding=cp, encoding_errors="ignore",\
+                        fh=self._open_file())
+                    self.reader = self._read_sas7bdat(handle)
+                    handle.close()
+
+        # Move to the checkpoint given in resume_from, so that the read starts at the row after the checkpoint
+        if self.resume_from is not None:
+            with self.timer.stage("resume"):
+                if isinstance(self.reader, pd.DataFrame):
+                    self.reader = self.reader.iloc[self.resume_from[0]:]
+                else:
+                    resume(self.reader, self.resume_from)
+        
+        # Limit the read to a range of pages, when this is a shard of a read split across SSE instances
+        if self.pages is not None:
+            with self.timer.stage("pages"):
+                select_pages(self.reader, *self.pages)
+
+        # Map SAS date and datetime formats to column types
+        if self.dates:
+            with self.timer.stage("formats"):
+                self.formats = self._get_formats()
+            
+            # Dates are converted from the SAS numbers when they are sent, so pandas does not convert them for each chunk
+            if hasattr(self.reader, 'convert_dates'):
+                self.reader.convert_dates = False
 
         # Send metadata on the result to Qlik
-        self._send_table_description()
+        with self.timer.stage("describe"):
+            self._send_table_description(send=describe)
 
-        # Read the SAS dataset
-        return self.reader
+        # Read the SAS dataset, decoding raw bytes and dictionary encoding low cardinality columns
+        # Data frames loaded with the SAS7BDAT module are also prepared a chunk at a time, so that nothing more is
+        # decoded once the call is cancelled
+        chunks = self._frame_chunks() if isinstance(self.reader, pd.DataFrame) else self._prepared_chunks()
+        return self._aggregated_chunks(chunks) if self.aggregator else chunks
     
     def get_labels(self):
         """
         Return labels for the variable names in a sas7bdat file
         """
 
+        entry = self._get_cache_entry()
+        if entry is not None:
+            entry.close()
+
+        if self.cached_labels is not None:
+            columns = self.cached_labels
+        else:
+            columns = self.read_labels()
+
+        self.columns = pd.DataFrame(columns)
+
+        if self.debug:
+            self._print_log(3)
+
+        # Send metadata on the result to Qlik
+        self._send_table_description(func="get_labels")
+        
+        return self.columns
+    
+    def read_labels(self):
+        """
+        Read the variable names and labels from a sas7bdat file.
+        :return: a list of tuples of the variable name and label
+        """
+
         # Use the sas7bdat library to read the file
-        handle = SAS7BDAT(self.filepath, skip_header=False)
+        with self.timer.stage("open (SAS7BDAT)"):
+            handle = SAS7BDAT(self.filepath, skip_header=False, fh=self._open_file())
         
         columns = None
 
         # If encoding is not specified, we try some common codecs 
-        if self.encoding is None:
-            # Try encoding with each of the default codecs
-            for cp in self.default_encoding:
-                try:
-                    # Get labels for the variables
-                    columns = [(col.name.decode(cp), col.label.decode(cp)) for col in handle.columns]
-                    self.encoding = cp
-                    break
-                except UnicodeDecodeError:
-                    continue
+        # The encoding is known if it was specified or the data has already been read
+        for cp in [self.encoding] if self.encoding is not None else self.default_encoding:
+            try:
+                # Get labels for the variables
+                columns = [(col.name.decode(cp), col.label.decode(cp)) for col in handle.columns]
+                self.encoding = cp
+                break
+            except UnicodeDecodeError:
+                continue
 
         if columns is None:
             # Get labels for the variables
            columns = [(col.name, col.label) for col in handle.columns]
 
-        self.columns = pd.DataFrame(columns)
         handle.close()
+        return columns
+    
+    def log_profile(self):
+        """
+        Write the time spent in each stage of the request to the log if profile = true.
+        """
+        if self.profile:
+            self._print_log(5)
+    
+    def _get_cache_entry(self):
+        """
+        Get the cache entry for the file and set up the metadata from the cache.
+        :return: a CacheEntry, or None if the cache is not enabled or does not hold a valid copy of the file
+        """
+        # The cache holds whole files, so a range of pages is read from the file
+        if self.cache is None or self.pages is not None:
+            return None
 
-        if self.debug:
-            self._print_log(3)
+        with self.timer.stage("open (cache)"):
+            entry = self.cache.get(self.filepath, self.encoding)
 
-        # Send metadata on the result to Qlik
-        self._send_table_description(func="get_labels")
+        if entry is None:
+            return None
+
+        self.cache_hit = True
+        self.reader = entry
+        self.encoding = entry.meta['encoding']
+        self.formats = entry.meta['formats']
+        self.sample_data = entry.meta['sample_data']
+        self.cached_labels = entry.meta['labels']
+        return entry
+
+    def get_cost(self, chunk):
+        """
+        Return the work done to produce a chunk in cells, for the scheduler.
+        The empty chunks yielded while aggregating are charged for the cells that were aggregated.
+        """
+        if self.aggregator and len(chunk) == 0:
+            return self.aggregated_cells
+        return chunk.size
+
+    def get_row_count(self):
+        """
+        Return the number of rows in the dataset, or None if this is not known.
+        """
+        if isinstance(self.reader, pd.DataFrame):
+            return len(self.reader)
         
-        return self.columns
+        # pandas readers give the row count as row_count for SAS7BDAT files and nobs for XPORT files
+        return getattr(self.reader, 'row_count', getattr(self.reader, 'nobs', None))
+
+    def get_params(self):
+        """
+        Return the parameters set for this request, for the service log.
+        """
+        params = ['format', 'encoding', 'chunksize', 'debug', 'labels', 'dates', 'numeric_only', 'priority', 'profile',\
+            'groupby', 'agg', 'block_size', 'read_ahead', 'member', 'selected_columns', 'sample', 'resume_from', 'pages']
+        return {p: getattr(self, p) for p in params}
+
+    def get_pages(self):
+        """
+        Get the pages that can hold rows in a SAS7BDAT file, so that the read can be split into shards of pages.
+        :return: a tuple of the index of the first page holding rows and the number of pages, or None if the read cannot
+        be split, e.g. for XPORT and compressed files, and for reads that are aggregated, sampled or resumed
+        """
+        if self.source is not None or self.aggregator or self.sample is not None or self.resume_from is not None\
+            or self.pages is not None:
+            return None
+        
+        if (self.format or ('xport' if '.xpt' in self.filepath.lower() else 'sas7bdat')) != 'sas7bdat':
+            return None
+        
+        # Only the header and metadata are read. Files that pandas cannot read are left to the SAS7BDAT module.
+        try:
+            with self.timer.stage("pages"):
+                reader = self._open_sas(format='sas7bdat', encoding=self.encoding, chunksize=self.chunksize)
+        except (OverflowError, ValueError, UnicodeDecodeError):
+            return None
+        
+        try:
+            return get_page_range(reader)
+        finally:
+            self._close_sas(reader)
+
+    def get_dataset_name(self):
+        """
+        Return the name of the SAS file, which is the member of a zip archive or the path without the .gz or .bz2 extension
+        for compressed files.
+        """
+        return self.filepath if self.source is None else self.source.name
+
+    def _read_sas7bdat(self, handle):
+        """
+        Read the file into a data frame using the SAS7BDAT module.
+        Unlike SAS7BDAT.to_data_frame, this stops reading if the call is cancelled by the client.
+        """
+        rows = handle.readlines()
+        columns = next(rows)
+        data = []
+
+        for row in rows:
+            data.append(row)
+
+            # The module reads one row at a time, so check for cancellation and memory after every chunk
+            if len(data) % self.chunksize == 0:
+                if not self.context.is_active():
+                    self.log.write("\nRead cancelled by the client after loading {0} of {1} rows with the SAS7BDAT module\n\n"\
+                        .format(len(data), handle.properties.row_count))
+                    break
+                self._sample_memory()
+
+        return pd.DataFrame(data, columns=columns)
+    
+    def _open_sas(self, **kwargs):
+        """
+        Open the file with pandas.read_sas, through the read-ahead layer unless read_ahead = 0.
+        Compressed files are opened through the decompression layer.
+        The file object is closed once a data frame is read, or when the reader is closed with _close_sas.
+        """
+        if not self.read_ahead and self.source is None:
+            return pd.read_sas(self.filepath, **kwargs)
+        
+        # pandas only infers the format from a file path, so this is done here in the same way
+        if kwargs.get('format') is None:
+            kwargs['format'] = 'xport' if '.xpt' in self.get_dataset_name().lower() else 'sas7bdat'
+        
+        handle = self._open_file()
+        try:
+            reader = pd.read_sas(handle, **kwargs)
+        except Exception:
+            handle.close()
+            raise
+        
+        if isinstance(reader, pd.DataFrame):
+            handle.close()
+        else:
+            self.files[id(reader)] = handle
+        
+        return reader
+    
+    def _close_sas(self, reader):
+        """
+        Close a pandas reader opened with _open_sas, along with its file object.
+        """
+        reader.close()
+        handle = self.files.pop(id(reader), None)
+        if handle is not None:
+            handle.close()
+    
+    def _open_file(self):
+        """
+        Open the file through the decompression or read-ahead layer for the SAS7BDAT module.
+        :return: a file object, or None for the module to open the file itself if read_ahead = 0
+        """
+        if self.source is not None:
+            return self.source.open()
+        elif not self.read_ahead:
+            return None
+        return self._open_raw()
+    
+    def _open_raw(self):
+        """
+        Open the file as a binary file object, through the read-ahead layer unless read_ahead = 0.
+        """
+        if not self.read_ahead:
+            return open(self.filepath, 'rb')
+        return ReadAheadFile.open(self.filepath, self.block_size * 1024, self.read_ahead)
+    
+    def _prepared_chunks(self):
+        """
+        Generator that yields prepared chunks from the pandas iterator.
+        A checkpoint for resuming the read is written to the service log periodically, and if the read stops early.
+        The underlying file reader is closed when the generator is exhausted or closed.
+        """
+        # Rows in a shard of pages are counted from the start of the shard, so checkpoints would not match the file
+        checkpoint = None if self.aggregator or self.pages is not None else get_checkpoint(self.reader)
+        logged = time.time()
+
+        try:
+            for chunk in self.reader:
+                self._sample_memory()
+                yield self._prepare(chunk)
+
+                # The checkpoint is taken once the chunk has been consumed, so that it only covers rows already sent
+                if checkpoint is not None:
+                    checkpoint = get_checkpoint(self.reader)
+
+                    if time.time() - logged >= self.checkpoint_interval:
+                        logging.info('Checkpoint for {0} after {1} rows: resume_from={2}'\
+                            .format(self.filepath, checkpoint.split(':')[0], checkpoint))
+                        logged = time.time()
+            
+            checkpoint = None
+        finally:
+            if checkpoint is not None:
+                logging.info('Read of {0} stopped after {1} rows. To continue use resume_from={2}'\
+                    .format(self.filepath, checkpoint.split(':')[0], checkpoint))
+            self._close_sas(self.reader)
+    
+    def _frame_chunks(self):
+        """
+        Generator that yields prepared chunks from a data frame loaded with the SAS7BDAT module.
+        """
+        for i in range(0, len(self.reader), self.chunksize):
+            self._sample_memory()
+            yield self._prepare(self.reader.iloc[i : i + self.chunksize].copy())
+    
+    def _sample_memory(self):
+        """
+        Sample the memory used by the request, if it is being tracked.
+        :raises MemoryLimitError: if the growth in resident memory exceeds the limit
+        """
+        if self.memory is not None:
+            self.memory.sample()
+    
+    def _resumed_chunks(self, chunks, rows):
+        """
+        Generator that skips the rows before a checkpoint in chunks loaded from the cache.
+        The chunks are closed when the generator is exhausted or closed.
+        """
+        try:
+            for chunk in chunks:
+                if rows >= len(chunk):
+                    rows -= len(chunk)
+                    continue
+                yield chunk.iloc[rows:].copy()
+                rows = 0
+        finally:
+            chunks.close()
+    
+    def _filtered_chunks(self, chunks):
+        """
+        Generator that selects the columns and samples the rows of chunks loaded from the cache.
+        The chunks are closed when the generator is exhausted or closed.
+        """
+        try:
+            for chunk in chunks:
+                yield self._filter(chunk)
+        finally:
+            chunks.close()
+
+    def _aggregated_chunks(self, chunks):
+        """
+        Generator that aggregates the prepared chunks and then yields the aggregated table in chunks.
+        An empty data frame is yielded after each chunk is aggregated, so that the work can be interleaved with other
+        requests and cancelled between chunks.
+        """
+        try:
+            for chunk in chunks:
+                self.aggregator.add(chunk)
+                self.aggregated_cells = chunk.size
+                yield self.aggregator.empty()
+
+            for chunk in self.aggregator.result(self.chunksize):
+                yield chunk
+        finally:
+            chunks.close()
+            self.aggregator.close()
+
+    def _prepare(self, df):
+        """
+        Prepare a data frame for Qlik by decoding raw bytes and converting low cardinality columns to Categoricals.
+        The Categorical codes and categories let the serializer build one Dual per distinct value.
+        """
+        # Only the columns and rows selected are decoded
+        df = self._decode(self._filter(df))
+
+        # Detect low cardinality string columns from the first chunk
+        if self.categorical is None:
+            self.categorical = []
+            limit = min(_MAX_CATEGORIES, int(len(df) * _MAX_CATEGORY_RATIO))
+
+            for col in df.columns:
+                if df[col].dtype == object and col not in self.column_types and df[col].nunique() <= limit:
+                    self.categorical.append(col)
+                    self.categories[col] = set()
+        
+        for col in list(self.categorical):
+            series = df[col].astype('category')
+            self.categories[col].update(series.cat.categories)
+
+            # Columns with more distinct values in later chunks than the limit are sent as plain strings from here on
+            if len(self.categories[col]) > _MAX_CATEGORIES:
+                self.categorical.remove(col)
+                del self.categories[col]
+                continue
+
+            df[col] = series
+        
+        return df
+    
+    def _filter(self, df):
+        """
+        Select the columns needed for the aggregation, or the columns argument, and sample the rows if required.
+        """
+        if self.aggregator:
+            df = df[self.aggregator.source_columns]
+        elif self.selected_columns:
+            df = df[self.selected_columns]
+
+        if self.sample is not None:
+            df = df[self.rng.random(len(df)) < self.sample]
+
+        return df
+    
+    def _decode(self, df):
+        """
+        Decode columns of raw bytes to strings and strip the trailing spaces used by SAS to pad character values.
+        Columns that are already decoded are left unchanged.
+        """
+        for col in df.columns:
+            if df[col].dtype != object:
+                continue
+            
+            # Check the first non-null value to determine if the column holds raw bytes
+            values = df[col].values
+            sample = values[pd.notnull(values)][:1]
+
+            if len(sample) > 0 and isinstance(sample[0], bytes):
+                df[col] = self._decode_column(col, values)
+        
+        return df
+    
+    def _decode_column(self, name, values):
+        """
+        Decode an array of raw bytes, decoding each distinct value only once.
+        For low cardinality columns the decoded values are memoized across chunks.
+        :name: The column name used as the key for the memo
+        :values: A numpy array of bytes and nulls
+        """
+        # Columns found to have too many distinct values for the memo are decoded a cell at a time, as few values repeat
+        if name in self.decode_memo and self.decode_memo[name] is None:
+            present = pd.notnull(values)
+            result = np.full(len(values), np.nan, dtype=object)
+            result[present] = self._decode_values(name, values[present])
+            self.memo_misses += int(present.sum())
+            return result
+
+        # Factorize the column so that repeated values are decoded once. Nulls get the code -1.
+        codes, uniques = pd.factorize(values)
+        decoded = np.empty(len(uniques), dtype=object)
+        pending = np.ones(len(uniques), dtype=bool)
+
+        # Look up values already decoded in previous chunks
+        memo = self.decode_memo.get(name)
+        if memo is not None:
+            positions = memo[0].get_indexer(uniques)
+            pending = positions == -1
+            decoded[~pending] = memo[1].take(positions[~pending])
+
+        misses = int(pending.sum())
+        self.memo_hits += len(uniques) - misses
+        self.memo_misses += misses
+
+        if misses > 0:
+            decoded[pending] = self._decode_values(name, uniques[pending])
+
+            # Extend the memo unless the column has been found to have too many distinct values
+            if name not in self.decode_memo or memo is not None:
+                keys, strings = uniques[pending], decoded[pending]
+                if memo is not None:
+                    keys = np.concatenate([memo[0].values, keys])
+                    strings = np.concatenate([memo[1], strings])
+                
+                self.decode_memo[name] = (pd.Index(keys), strings) if len(keys) <= _MAX_MEMO_SIZE else None
+        
+        # Map the codes back to the decoded values, restoring nulls
+        result = decoded.take(codes)
+        result[codes == -1] = np.nan
+        return result
+    
+    def _decode_values(self, name, values):
+        """
+        Decode an array of distinct byte strings from a column using the specified encoding or the default codecs.
+        Without an encoding, the first default codec that decodes the first values in the column is kept for the rest of
+        the file, so that values in a column are never decoded with different codecs. Undecodable bytes are replaced.
+        """
+        codec = self.encoding or self.decode_codecs.get(name)
+
+        # A list comprehension is faster than the pandas string methods, which also loop over the values in Python
+        if codec is None:
+            for cp in self.default_encoding:
+                try:
+                    decoded = [value.decode(cp).rstrip(' ') for value in values]
+                except UnicodeDecodeError:
+                    continue
+                
+                self.decode_codecs[name] = cp
+                return np.array(decoded, dtype=object)
+            
+            codec = self.decode_codecs[name] = self.default_encoding[0]
+        
+        return np.array([value.decode(codec, 'replace').rstrip(' ') for value in values], dtype=object)
+    
+    def _get_formats(self):
+        """
+        Get the SAS format for each variable from the file header, in the order of the variables in the file.
+        Only the header is read here. If pandas cannot read the header, the SAS7BDAT module is used instead.
+        """
+        try:
+            handle = self._open_sas(format=self.format, encoding=self.encoding, iterator=True)
+            
+            # SAS7BDAT files keep a list of formats while XPORT files keep formats in the field descriptions
+            if hasattr(handle, 'column_formats'):
+                formats = list(handle.column_formats)
+            else:
+                formats = [field['nform'] for field in handle.fields]
+            
+            self._close_sas(handle)
+        except (OverflowError, ValueError, UnicodeDecodeError) as e:
+            self._print_exception("Exception when reading SAS formats with pandas. A second attempt will be made using the SAS7BDAT module", e)
+            
+            handle = SAS7BDAT(self.filepath, skip_header=False, fh=self._open_file())
+            formats = [col.format for col in handle.columns]
+            handle.close()
+        
+        return [fmt.decode('ascii', errors='ignore') if isinstance(fmt, bytes) else fmt for fmt in formats]
+    
+    @staticmethod
+    def _get_column_type(fmt):
+        """
+        Map a SAS format such as DATE9. or DATETIME20. to a column type.
+        :fmt: The SAS format
+        :return: 'date', 'datetime' or None
+        """
+        # Strip the width and decimals from the format name
+        name = re.sub(r'\d*\.?\d*$', '', fmt.strip().upper())
+
+        if name in _SAS_DATE_FORMATS:
+            return 'date'
+        elif name in _SAS_DATETIME_FORMATS:
+            return 'datetime'
+        
+        return None
     
     def _set_params(self, kwargs):
         """
@@ -156,7 +764,13 @@ class SASReader:
         :https://pandas.pydata.org/pandas-docs/stable/generated/pandas.read_sas.html
         :https://pandas.pydata.org/pandas-docs/stable/io.html?highlight=sas7bdatreader#sas-formats
         :
-        :Additional parameters used are: debug
+        :Additional parameters used are: debug, labels, dates, numeric_only, priority, profile, profile_functions
+        :Parameters for Convert_SAS are: output, threads
+        :Parameters for aggregation are: groupby, agg, max_groups, counts
+        :Parameters for reading the file are: block_size, read_ahead, member, columns, sample
+        :Parameters for Profile_SAS are: top
+        :Parameters for resuming reads are: resume_from, checkpoint_interval
+        :Parameters for reading a shard of a file are: pages
         """
         
         # Set default values which will be used if arguments are not passed
@@ -164,12 +778,33 @@ class SASReader:
         # SSE parameters:
         self.debug = False
         self.labels = False
+        self.dates = True
+        self.numeric_only = False
+        self.priority = PRIORITIES['normal']
+        self.profile = False
+        self.profile_functions = 0
         self.default_encoding = ["utf_8", "ascii", "latin_1"]
+        self.output = 'qvd'
+        self.threads = _DEFAULT_THREADS
+        self.groupby = None
+        self.agg = None
+        self.max_groups = _DEFAULT_MAX_GROUPS
+        self.counts = False
+        self.block_size = _DEFAULT_BLOCK_SIZE
+        self.read_ahead = _DEFAULT_READ_AHEAD
+        self.member = None
+        self.selected_columns = None
+        self.sample = None
+        self.top = 5
+        self.resume_from = None
+        self.checkpoint_interval = _DEFAULT_CHECKPOINT_INTERVAL
+        self.pages = None
         # pandas.read_sas parameters:
         self.format = None
         self.encoding = None
+        # The file is always read in chunks, so that a read stops between chunks when the call is cancelled
         self.chunksize = 1000
-        self.iterator = None
+        self.iterator = True
                 
         # Set optional parameters
         
@@ -192,6 +827,107 @@ class SASReader:
             # Valid values are: true, false
             if 'labels' in self.kwargs:
                 self.labels = 'true' == self.kwargs['labels'].lower()
+            
+            # Choose whether variables with SAS date and datetime formats are sent as Qlik dates
+            # Valid values are: true, false
+            if 'dates' in self.kwargs:
+                self.dates = 'true' == self.kwargs['dates'].lower()
+            
+            # Choose whether numeric variables are sent as numbers only, without a text representation
+            # Valid values are: true, false
+            if 'numeric_only' in self.kwargs:
+                self.numeric_only = 'true' == self.kwargs['numeric_only'].lower()
+            
+            # Set the share of processing for this request relative to other concurrent requests
+            # Valid values are: low, normal, high or a positive number
+            if 'priority' in self.kwargs:
+                self.priority = parse_priority(self.kwargs['priority'])
+            
+            # Record the time spent in each stage of the request and write a summary to the log
+            # Valid values are: true, false
+            if 'profile' in self.kwargs:
+                self.profile = 'true' == self.kwargs['profile'].lower()
+            
+            # Add the hottest functions from cProfile to the profile summary
+            # Valid values are: 0 to disable cProfile, or the number of functions to list
+            if 'profile_functions' in self.kwargs:
+                self.profile_functions = int(self.kwargs['profile_functions'])
+                self.profile = self.profile or self.profile_functions > 0
+
+            # Set the file format for Convert_SAS
+            # Valid values are: qvd, csv
+            if 'output' in self.kwargs:
+                self.output = self.kwargs['output'].lower()
+            
+            # Set the number of files converted at the same time by Convert_SAS
+            if 'threads' in self.kwargs:
+                self.threads = int(self.kwargs['threads'])
+
+            # Aggregate the dataset by these columns, separated by |. Dates can be truncated to a period, e.g. DT:month.
+            # Valid periods are: year, quarter, month, day
+            if 'groupby' in self.kwargs:
+                self.groupby = parse_groupby(self.kwargs['groupby'])
+            
+            # Aggregates to calculate as column:function, separated by |. Rows are counted with count.
+            # Valid functions are: sum, count, min, max, mean, count_distinct
+            if 'agg' in self.kwargs:
+                self.agg = parse_agg(self.kwargs['agg'])
+            
+            # Set the number of groups held in memory when aggregating, before spilling to disk
+            if 'max_groups' in self.kwargs:
+                self.max_groups = int(self.kwargs['max_groups'])
+            
+            # Choose whether Get_Distinct returns the number of rows for each distinct combination
+            # Valid values are: true, false
+            if 'counts' in self.kwargs:
+                self.counts = 'true' == self.kwargs['counts'].lower()
+
+            # Set the size in KB of the reads made from the SAS file
+            if 'block_size' in self.kwargs:
+                self.block_size = int(self.kwargs['block_size'])
+            
+            # Set the number of blocks read ahead of the reader on a background thread
+            # Valid values are: 0 to read the file directly, or the number of blocks
+            if 'read_ahead' in self.kwargs:
+                self.read_ahead = int(self.kwargs['read_ahead'])
+
+            # Set the SAS file to read from a zip archive. This is only needed if the archive holds several SAS files.
+            if 'member' in self.kwargs:
+                self.member = self.kwargs['member']
+
+            # Select the variables to read, separated by |. Other variables are not decoded or sent to Qlik.
+            if 'columns' in self.kwargs:
+                self.selected_columns = [col for col in self.kwargs['columns'].split('|') if col]
+            
+            # Read a random sample of the rows, e.g. 0.1 for 10% of the rows
+            # Valid values are: a number greater than 0 and up to 1
+            if 'sample' in self.kwargs:
+                self.sample = float(self.kwargs['sample'])
+                if not 0 < self.sample <= 1:
+                    raise AggregationError("sample must be greater than 0 and up to 1: {}".format(self.kwargs['sample']))
+            
+            # Set the number of most frequent values returned for each variable by Profile_SAS
+            if 'top' in self.kwargs:
+                self.top = int(self.kwargs['top'])
+
+            # Continue a read from a checkpoint in the service log, e.g. after a reload failed part way through
+            # Valid values are: a checkpoint of the form row:offset:skip, or the number of rows to skip
+            if 'resume_from' in self.kwargs:
+                self.resume_from = parse_token(self.kwargs['resume_from'])
+            
+            # Set the time in seconds between checkpoints written to the service log
+            if 'checkpoint_interval' in self.kwargs:
+                self.checkpoint_interval = float(self.kwargs['checkpoint_interval'])
+            
+            # Read the rows on a range of pages in a SAS7BDAT file. This is set by a coordinator for each shard of a read.
+            # Valid values are: the index of the first page and the page after the last page, e.g. 10:20
+            if 'pages' in self.kwargs:
+                try:
+                    first, last = [int(page) for page in self.kwargs['pages'].split(':')]
+                except ValueError:
+                    raise ResumeError("Invalid value for pages: {}. Use the first and last page, e.g. 10:20"\
+                        .format(self.kwargs['pages']))
+                self.pages = (first, last)
 
             # Set the format of the file, if none is specified it is inferred.
             # Options are: xport, sas7bdat
@@ -205,8 +941,12 @@ class SASReader:
             # Read file chunksize lines at a time.
             if 'chunksize' in self.kwargs:
                 self.chunksize = int(self.kwargs['chunksize'])
-                self.iterator = True
         
+        # Aggregate the dataset if group keys or aggregates are specified
+        self.aggregator = None
+        if self.groupby or self.agg:
+            self.aggregator = Aggregator(self.groupby or [], self.agg or [(None, 'count')], self.max_groups)
+
         # Set up a list of possible key word arguments for the pandas.read_sas() function
         read_sas_params = ['format', 'encoding', 'chunksize', 'iterator']
         
@@ -227,35 +967,38 @@ class SASReader:
         
         return output_dict
     
-    def _send_table_description(self, func=None):
+    def _send_table_description(self, func=None, send=True):
         """
         Send the table description to Qlik as meta data.
         Only used when the SSE is called from the Qlik load script.
+        If send is false the table description and column types are set up without sending them.
         """
         
         # Set up the table description to send as metadata to Qlik
         self.table = SSE.TableDescription()
         
         if func is None:
-            self.table.name = "SAS_Dataset"
+            self.table.name = "SAS_Profile" if self.statistics else "SAS_Dataset"
 
             if isinstance(self.reader, pd.DataFrame):
                 self.sample_data = self.reader.head(5)
-            else:
-                # Read the SAS file to get sample data
-                sample_response = pd.read_sas(self.filepath, format=self.format, encoding=self.encoding, chunksize=5)
+            elif self.sample_data is None:
+                # Read the SAS file to get sample data, unless this was loaded from the cache
+                sample_response = self._open_sas(format=self.format, encoding=self.encoding, chunksize=5)
             
                 # Get the first chunk of data as a Pandas DataFrame
                 self.sample_data = sample_response.__next__()
 
                 # Close the file reader
-                sample_response.close()
+                self._close_sas(sample_response)
             
             # Fetch field labels from SAS variable attributes if required
             # This may fail for wide tables due to meta data limits. For such cases use the get_labels function.
-            if self.labels:
+            if self.labels and self.cached_labels is not None:
+                labels = [label for name, label in self.cached_labels]
+            elif self.labels:
                 # Use the sas7bdat library to read the file
-                handle = SAS7BDAT(self.filepath, skip_header=False)
+                handle = SAS7BDAT(self.filepath, skip_header=False, fh=self._open_file())
 
                 # Get labels for the variables
                 labels = [col.label.decode(self.encoding) for col in handle.columns]
@@ -266,10 +1009,37 @@ class SASReader:
                 # Get the variable names from the sample data
                 labels = self.sample_data.columns
             
+            # Set the column types based on the SAS formats and the sample data
+            self._set_column_types()
+            columns = self.sample_data.columns
+
+            # The table is the result of the aggregation, with fields for the group keys and aggregates
+            if self.aggregator:
+                self.column_types = self.aggregator.describe(self.sample_data, self.column_types)
+                columns = labels = self.aggregator.columns
+            elif self.selected_columns:
+                unknown = [col for col in self.selected_columns if col not in columns]
+                if unknown:
+                    raise AggregationError("Columns not found in the SAS file: {0}. Valid columns are: {1}"\
+                        .format(', '.join(unknown), ', '.join(columns)))
+                
+                labels = dict(zip(columns, labels))
+                columns = self.selected_columns
+                labels = [labels[col] for col in columns]
+            
             # Set field names 
-            for col in labels:
-                # Set up fields for the table
-                self.table.fields.add(name=col)
+            for col, label in zip(columns, labels):
+                column_type = self.column_types.get(col)
+                
+                # Set up fields for the table, declaring the data type for dates, timestamps and numbers
+                if column_type == 'date':
+                    self.table.fields.add(name=label, dataType=SSE.DUAL, tags=['$date'])
+                elif column_type == 'datetime':
+                    self.table.fields.add(name=label, dataType=SSE.DUAL, tags=['$timestamp'])
+                elif column_type == 'numeric':
+                    self.table.fields.add(name=label, dataType=SSE.NUMERIC, tags=['$numeric'])
+                else:
+                    self.table.fields.add(name=label)
             
             if self.debug:
                 self._print_log(2)
@@ -283,67 +1053,56 @@ class SASReader:
                 self._print_log(4)
 
         # Send table description
-        table_header = (('qlik-tabledescription-bin', self.table.SerializeToString()),)
-        self.context.send_initial_metadata(table_header)
+        if send:
+            table_header = (('qlik-tabledescription-bin', self.table.SerializeToString()),)
+            self.context.send_initial_metadata(table_header)
+    
+    def _set_column_types(self):
+        """
+        Set the column type for variables with SAS date and datetime formats.
+        If numeric_only is true, other numeric variables are set to the numeric type.
+        """
+        for i, col in enumerate(self.sample_data.columns):
+            column_type = self._get_column_type(self.formats[i]) if self.dates else None
+
+            if column_type is None and self.numeric_only and pd.api.types.is_numeric_dtype(self.sample_data[col]):
+                column_type = 'numeric'
+
+            if column_type is not None:
+                self.column_types[col] = column_type
     
     def _print_log(self, step):
         """
         Output useful information to stdout and the log file if debugging is required.
+        Messages are written by a background thread, and large outputs are rendered there with limits on their size.
         :step: Print the corresponding step in the log
         """
         
         if step == 1:
-            # Increment log counter for the class. Each instance of the class generates a new log.
-            self.__class__.log_no += 1
-             
-            # Create a log file for the instance
-            # Logs will be stored in ..\logs\SAS Reader Log <n>.txt
-            self.logfile = os.path.join(os.getcwd(), 'logs', 'SAS Reader Log {}.txt'.format(self.log_no))
-            
-            # Output log header
-            sys.stdout.write("SAS Reader Log: {0} \n\n".format(time.ctime(time.time())))
-            
-            # Output the request parameters to the terminal
-            sys.stdout.write("Key word arguments: {0}\n\n".format(self.kwargs))
-            sys.stdout.write("pandas.read_sas parameters: {0}\n\n".format(self.read_sas_kwargs))
-            
-            # Output the same information to the log file
-            with open(self.logfile,'w') as f:
-                f.write("SAS Reader Log: {0} \n\n".format(time.ctime(time.time())))
-                f.write("Key word arguments: {0}\n\n".format(self.kwargs))
-                f.write("pandas.read_sas parameters: {0}\n\n".format(self.read_sas_kwargs))                
+            # Logs will be stored in ..\logs\SAS Reader Log <n>.txt, numbered by the RequestLog for this instance
+            # Output log header and the request parameters
+            self.log.write("SAS Reader Log: {0} \n\nKey word arguments: {1}\n\npandas.read_sas parameters: {2}\n\n"\
+                .format(time.ctime(time.time()), self.kwargs, self.read_sas_kwargs))
                         
         elif step == 2:         
-            # Print the sample data to the terminal
-            sys.stdout.write("\nSAMPLE DATA: {0} rows x cols\n\n".format(self.sample_data.shape))
-            sys.stdout.write("{0} \n\n".format(self.sample_data.to_string()))
-            
-            # Print the table description 
-            sys.stdout.write("\nTABLE DESCRIPTION SENT TO QLIK:\n\n{0} \n\n".format(self.table))
-                        
-            with open(self.logfile,'a') as f:
-                # Write the sample data to the log file
-                f.write("\nSAMPLE DATA: {0} rows x cols\n\n".format(self.sample_data.shape))
-                f.write("{0} \n\n".format(self.sample_data.to_string()))           
-                
-                # Write the table description to the log file
-                f.write("\nTABLE DESCRIPTION SENT TO QLIK:\n\n{0} \n\n".format(self.table))
+            # Output the sample data and the table description, rendered on the log writer thread
+            sample, table = self.sample_data.copy(), self.table
+            self.log.write(lambda: "\nSAMPLE DATA: {0} rows x cols\n\n{1} \n\n\nTABLE DESCRIPTION SENT TO QLIK:\n\n{2} \n\n"\
+                .format(sample.shape, render_frame(sample), table))
         
         elif step == 3:         
-            # Print labels to the terminal
-            sys.stdout.write("\nRESPONSE FROM GET_LABELS:\n\n{0}\n\n".format(self.columns.to_string()))
-                        
-            with open(self.logfile,'a') as f:
-                # Write the sample data to the log file
-                f.write("\nRESPONSE FROM GET_LABELS:\n\n{0}\n\n".format(self.columns.to_string()))
+            # Output the labels
+            columns = self.columns
+            self.log.write(lambda: "\nRESPONSE FROM GET_LABELS:\n\n{0}\n\n".format(render_frame(columns)))
         
         elif step == 4:         
-            # Print the table description 
-            sys.stdout.write("\nTABLE DESCRIPTION SENT TO QLIK:\n\n{0} \n\n".format(self.table))
-                        
-            with open(self.logfile,'a') as f:      
-                # Write the table description to the log file
-                f.write("\nTABLE DESCRIPTION SENT TO QLIK:\n\n{0} \n\n".format(self.table))
+            # Output the table description 
+            table = self.table
+            self.log.write(lambda: "\nTABLE DESCRIPTION SENT TO QLIK:\n\n{0} \n\n".format(table))
+
+        elif step == 5:
+            # Output the time spent in each stage of the request
+            self.log.write("\nPROFILE:\n\n{0}\n\n".format(self.timer.summary()))
 
     def _print_exception(self, s, e):
         """
@@ -353,10 +1112,4 @@ class SASReader:
         """
         
         # Output exception message
-        sys.stdout.write("\n{0}: {1} \n\n".format(s, e))
-        
-        if self.debug:
-            with open(self.logfile,'a') as f:
-                f.write("\n{0}: {1} \n\n".format(s, e))
-            
-    
+        self.log.write("\n{0}: {1} \n\n".format(s, e))
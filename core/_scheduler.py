@@ -0,0 +1,142 @@
+import math
+import threading
+from contextlib import contextmanager
+
+# Weights for the named priority levels that can be passed in the priority argument
+PRIORITIES = {'low': 0.5, 'normal': 1.0, 'high': 2.0}
+
+# Marker for the end of an iterator
+_END = object()
+
+class ChunkScheduler:
+    """
+    A class to share chunk decoding and encoding fairly across concurrent requests.
+    A limited number of chunks are processed at a time. When a slot frees up, it is given to the waiting request
+    that has received the least work relative to its weight, so small requests are not held up by large ones.
+    """
+
+    def __init__(self, slots):
+        """
+        Class initializer.
+        :param slots: the number of chunks that can be processed at the same time
+        """
+        self.slots = slots
+        self.busy = 0
+
+        # Virtual time for the scheduler, advanced to the virtual time of each request given a slot
+        self.clock = 0.0
+
+        # Requests waiting for a slot, protected by the condition's lock
+        self.waiting = []
+        self._condition = threading.Condition()
+
+    def register(self, weight=1.0):
+        """
+        Register a request with the scheduler.
+        :param weight: the relative share of processing for this request. This must be a finite number above zero.
+        :return: a ticket used to request turns
+        """
+        # Virtual time advances by the cost over the weight, so it must not stall, run backwards or become nan
+        if not math.isfinite(weight) or weight <= 0:
+            raise PriorityError("Invalid weight for the scheduler: {}".format(weight))
+
+        with self._condition:
+            # New requests start at the current virtual time so they neither starve nor jump ahead of others
+            return Ticket(weight, self.clock)
+
+    @contextmanager
+    def turn(self, ticket):
+        """
+        Context manager that waits for a slot, and releases it at the end of the block.
+        The block can set ticket.cost to the amount of work done, e.g. the number of cells in the chunk.
+        """
+        with self._condition:
+            # A request that has been idle, e.g. while streaming to a slow client, does not build up credit
+            ticket.vtime = max(ticket.vtime, self.clock)
+            self.waiting.append(ticket)
+            self._condition.wait_for(lambda: self.busy < self.slots and ticket is self._next())
+            self.waiting.remove(ticket)
+            self.busy += 1
+            self.clock = ticket.vtime
+
+            # Requests woken with this one may have gone back to waiting while it was ahead of them in the queue
+            if self.busy < self.slots and self.waiting:
+                self._condition.notify_all()
+
+        ticket.cost = 1
+        try:
+            yield ticket
+        finally:
+            with self._condition:
+                self.busy -= 1
+                ticket.vtime += ticket.cost / ticket.weight
+                self._condition.notify_all()
+
+    def interleave(self, ticket, iterable, cost=None):
+        """
+        Generator that gets each item from the iterable in a separate turn.
+        Items are yielded after the turn has ended so that a slow consumer does not hold up other requests.
+        :param ticket: the ticket for the request
+        :param iterable: an iterable that does the work, e.g. a chunk reader or an encoder
+        :param cost: an optional function to calculate the work done for an item. Each item costs 1 by default.
+        """
+        iterator = iter(iterable)
+
+        while True:
+            with self.turn(ticket):
+                item = next(iterator, _END)
+                if item is _END:
+                    return
+                if cost is not None:
+                    ticket.cost = cost(item)
+            
+            yield item
+
+    def _next(self):
+        """
+        Return the waiting ticket with the lowest virtual time.
+        Must be called with the condition's lock held.
+        """
+        return min(self.waiting, key=lambda t: t.vtime)
+
+def parse_priority(value):
+    """
+    Get the weight for a request from the priority argument.
+    :param value: low, normal, high or a positive number
+    :return: the weight
+    :raises PriorityError: if the value is not a named priority or a finite number above zero
+    """
+    value = value.strip().lower()
+    if value in PRIORITIES:
+        return PRIORITIES[value]
+
+    try:
+        weight = float(value)
+    except ValueError:
+        weight = None
+
+    if weight is None or not math.isfinite(weight) or weight <= 0:
+        raise PriorityError("Invalid value for priority: {0}. Use {1} or a positive number."\
+            .format(value, ', '.join(PRIORITIES)))
+    return weight
+
+class Ticket:
+    """
+    A request's position in the chunk scheduler.
+    """
+
+    def __init__(self, weight, vtime):
+        """
+        Class initializer.
+        :param weight: the relative share of processing for the request
+        :param vtime: the virtual time at which the request starts
+        """
+        self.weight = weight
+        self.vtime = vtime
+        self.cost = 1
+
+class PriorityError(ValueError):
+    """
+    Raised when the priority for a request is not valid.
+    """
+    pass
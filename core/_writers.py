@@ -0,0 +1,405 @@
+import os
+import struct
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# Qlik serial numbers count days from 1899-12-30, while SAS counts from 1960-01-01
+_QLIK_EPOCH = datetime(1899, 12, 30)
+_SAS_EPOCH = datetime(1960, 1, 1)
+_SAS_EPOCH_SERIAL = 21916
+
+# Text formats for dates and timestamps sent to Qlik, with the matching QVD number formats
+_DATE_FORMATS = {'date': '%Y-%m-%d', 'datetime': '%Y-%m-%d %H:%M:%S'}
+_QVD_FORMATS = {'date': ('DATE', 'YYYY-MM-DD'), 'datetime': ('TIMESTAMP', 'YYYY-MM-DD hh:mm:ss')}
+
+# QVD symbol types
+_INT, _DOUBLE, _STRING, _DUAL_INT, _DUAL_DOUBLE = 1, 2, 4, 5, 6
+
+# Range of numbers stored as 32-bit integers in QVD symbols
+_INT_RANGE = (-2 ** 31, 2 ** 31 - 1)
+
+# Number of rows packed into the QVD index table at a time when the file is closed
+_PACK_ROWS = 65536
+
+# Buffer size for output files
+_BUFFER_SIZE = 1024 * 1024
+
+def get_timestamps(series, column_type):
+    """
+    Convert a column of numbers in the SAS date or datetime representation to pandas timestamps.
+    Missing values are masked before the conversion, as numpy warns when casting NaN to an integer.
+    :param series: a pandas series of days or seconds since 1960-01-01
+    :param column_type: 'date' or 'datetime'
+    :return: a pandas series of timestamps, with NaT for missing values and values outside the range of timestamps
+    """
+    # SAS dates are stored as days and datetimes as seconds since 1960-01-01
+    unit = 'D' if column_type == 'date' else 's'
+    present = series.notnull()
+    timestamps = pd.to_datetime(series[present], unit=unit, origin='1960-01-01', errors='coerce')
+    return timestamps.reindex(series.index)
+
+def get_date_values(series, column_type):
+    """
+    Convert a column of dates or datetimes to Qlik serial numbers and formatted text.
+    :param series: a pandas series of timestamps, or numbers in the SAS date or datetime representation
+    :param column_type: 'date' or 'datetime'
+    :return: a numpy array of serial numbers, with NaN for missing values, and a numpy array of texts
+    """
+    if pd.api.types.is_numeric_dtype(series):
+        # SAS dates are stored as days and datetimes as seconds since 1960-01-01
+        serials = series.values / (1 if column_type == 'date' else 86400) + _SAS_EPOCH_SERIAL
+        timestamps = get_timestamps(series, column_type)
+    else:
+        timestamps = pd.to_datetime(series, errors='coerce')
+        serials = ((timestamps - _QLIK_EPOCH) / pd.Timedelta(days=1)).values
+
+        # Python dates outside the range of pandas timestamps, such as 9999-12-31, are converted one at a time
+        for i in np.flatnonzero(timestamps.isnull().values & series.notnull().values):
+            value = series.iloc[i]
+            serials[i] = value.toordinal() - _QLIK_EPOCH.toordinal()
+            if hasattr(value, 'hour'):
+                serials[i] += (value.hour * 3600 + value.minute * 60 + value.second) / 86400
+
+    # Format the text for the whole column
+    texts = timestamps.dt.strftime(_DATE_FORMATS[column_type]).values
+
+    # Values outside the range of pandas timestamps, such as 9999-12-31, are formatted one at a time
+    for i in np.flatnonzero(pd.isnull(texts) & ~np.isnan(serials)):
+        value = series.iloc[i]
+        try:
+            if pd.api.types.is_number(value):
+                value = _SAS_EPOCH + (timedelta(days=value) if column_type == 'date' else timedelta(seconds=value))
+            texts[i] = value.strftime(_DATE_FORMATS[column_type])
+        except (OverflowError, ValueError):
+            pass
+
+    return serials, texts
+
+def get_writer(path, output, table_name):
+    """
+    Return a writer for the output format.
+    :param path: the output file
+    :param output: 'qvd' or 'csv'
+    :param table_name: the table name stored in QVD files
+    """
+    if output == 'qvd':
+        return QVDWriter(path, table_name)
+    elif output == 'csv':
+        return CSVWriter(path)
+
+    raise ValueError("Unsupported output format: {0}. Valid formats are: qvd, csv".format(output))
+
+class CSVWriter:
+    """
+    A class to write chunks of a data frame to a CSV file with a header row.
+    Dates and datetimes are written as text in the same formats sent to Qlik.
+    The file is written under a temporary name and renamed when it is complete.
+    """
+
+    def __init__(self, path):
+        """
+        Class initializer.
+        :param path: the output file
+        """
+        self.path = path
+        self.temp_path = path + '.tmp'
+        self.file = open(self.temp_path, 'w', encoding='utf-8', newline='', buffering=_BUFFER_SIZE)
+        self.header = True
+
+    def write(self, df, types):
+        """
+        Append a chunk to the file.
+        :param df: a pandas data frame
+        :param types: a dictionary of date, datetime and numeric columns, keyed by column name
+        """
+        dates = [name for name in df.columns if types.get(name) in _DATE_FORMATS]
+        if dates:
+            df = df.copy()
+            for name in dates:
+                serials, texts = get_date_values(df[name], types[name])
+                df[name] = [None if pd.isnull(num) else text if isinstance(text, str) else str(num)\
+                    for num, text in zip(serials.tolist(), texts.tolist())]
+
+        df.to_csv(self.file, header=self.header, index=False, float_format='%.15g')
+        self.header = False
+
+    def close(self):
+        """
+        Complete the file and move it to the output path.
+        """
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+    def discard(self):
+        """
+        Remove the incomplete file.
+        """
+        self.file.close()
+        _remove(self.temp_path)
+
+class QVDWriter:
+    """
+    A class to write chunks of a data frame to a QVD file.
+    A QVD file has an XML header, a table of distinct values (symbols) for each field and an index table with the
+    symbol numbers for each row, bit-packed into fixed size records. As the bit widths are only known once all the
+    symbols have been seen, symbol numbers are spooled to a temporary file and packed when the writer is closed.
+    """
+
+    def __init__(self, path, table_name):
+        """
+        Class initializer.
+        :param path: the output file
+        :param table_name: the table name stored in the file header
+        """
+        self.path = path
+        self.table_name = table_name
+        self.fields = None
+        self.rows = 0
+
+        # Symbol numbers for each row as 32-bit integers, with -1 for missing values
+        self.spool = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path)))
+
+    def write(self, df, types):
+        """
+        Add the symbols in a chunk and spool the symbol numbers for each row.
+        :param df: a pandas data frame
+        :param types: a dictionary of date, datetime and numeric columns, keyed by column name
+        """
+        if self.fields is None:
+            self.fields = [_Field(str(name), types.get(name)) for name in df.columns]
+
+        indexes = np.empty((len(df), len(self.fields)), dtype='<i4')
+
+        for j, (field, name) in enumerate(zip(self.fields, df.columns)):
+            indexes[:, j] = field.add(df[name])
+
+        self.spool.write(indexes.tobytes())
+        self.rows += len(df)
+
+    def close(self):
+        """
+        Write the header, symbols and index table to the output file.
+        """
+        fields = self.fields or []
+        offset = bit_offset = 0
+
+        for field in fields:
+            field.offset = offset
+            offset += len(field.symbols)
+
+            # Missing values are stored as 0, with symbol numbers shifted by 2 and a bias of -2 to reverse the shift
+            field.bias = -2 if field.has_null else 0
+            largest = len(field.index) - 1 - field.bias
+            field.bit_width = 0 if largest <= 0 else int(largest).bit_length()
+            field.bit_offset = bit_offset
+            bit_offset += field.bit_width
+
+        record_size = (bit_offset + 7) // 8
+        temp_path = self.path + '.tmp'
+
+        try:
+            with open(temp_path, 'wb', buffering=_BUFFER_SIZE) as f:
+                f.write(self._get_header(fields, record_size, offset))
+                for field in fields:
+                    f.write(field.symbols)
+
+                # Pack the index table in blocks of rows from the spool
+                self.spool.seek(0)
+                while True:
+                    data = self.spool.read(_PACK_ROWS * len(fields) * 4)
+                    if not data:
+                        break
+                    f.write(self._pack(np.frombuffer(data, dtype='<i4').reshape(-1, len(fields)), fields))
+
+            os.replace(temp_path, self.path)
+        except Exception:
+            _remove(temp_path)
+            raise
+        finally:
+            self.spool.close()
+
+    def discard(self):
+        """
+        Release the spool without writing the file.
+        """
+        self.spool.close()
+
+    @staticmethod
+    def _pack(indexes, fields):
+        """
+        Pack the symbol numbers for a block of rows into records, with the first field in the least significant bits.
+        """
+        bits = []
+
+        for j, field in enumerate(fields):
+            if field.bit_width == 0:
+                continue
+
+            values = indexes[:, j].astype(np.int64)
+            if field.has_null:
+                values = np.where(values < 0, 0, values + 2)
+
+            bits.append(((values[:, None] >> np.arange(field.bit_width)) & 1).astype(np.uint8))
+
+        if not bits:
+            return b''
+
+        return np.packbits(np.hstack(bits), axis=1, bitorder='little').tobytes()
+
+    def _get_header(self, fields, record_size, symbols_length):
+        """
+        Return the XML header, followed by the line break and null byte that separate it from the data.
+        """
+        now = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+        root = ET.Element('QvdTableHeader')
+
+        for tag, text in [('QvBuildNo', '50699'), ('CreatorDoc', 'Qlik SAS Reader'), ('CreateUtcTime', now),\
+            ('SourceCreateUtcTime', ''), ('SourceFileUtcTime', ''), ('SourceFileSize', '-1'), ('StaleUtcTime', ''),\
+            ('TableName', self.table_name)]:
+            ET.SubElement(root, tag).text = text
+
+        header_fields = ET.SubElement(root, 'Fields')
+        for field in fields:
+            element = ET.SubElement(header_fields, 'QvdFieldHeader')
+            for tag, text in [('FieldName', field.name), ('BitOffset', field.bit_offset), ('BitWidth', field.bit_width),\
+                ('Bias', field.bias)]:
+                ET.SubElement(element, tag).text = str(text)
+
+            number_format = ET.SubElement(element, 'NumberFormat')
+            number_type, fmt = _QVD_FORMATS.get(field.column_type, ('UNKNOWN', ''))
+            for tag, text in [('Type', number_type), ('nDec', '0'), ('UseThou', '0'), ('Fmt', fmt), ('Dec', ''),\
+                ('Thou', '')]:
+                ET.SubElement(number_format, tag).text = text
+
+            for tag, text in [('NoOfSymbols', len(field.index)), ('Offset', field.offset),\
+                ('Length', len(field.symbols)), ('Comment', '')]:
+                ET.SubElement(element, tag).text = str(text)
+
+            tags = ET.SubElement(element, 'Tags')
+            for tag in field.get_tags():
+                ET.SubElement(tags, 'String').text = tag
+
+        for tag, text in [('Compression', ''), ('RecordByteSize', record_size), ('NoOfRecords', self.rows),\
+            ('Offset', symbols_length), ('Length', record_size * self.rows), ('Comment', '')]:
+            ET.SubElement(root, tag).text = str(text)
+
+        lineage = ET.SubElement(ET.SubElement(root, 'Lineage'), 'LineageInfo')
+        ET.SubElement(lineage, 'Discriminator').text = self.table_name
+        ET.SubElement(lineage, 'Statement').text = 'Convert_SAS'
+
+        xml = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\r\n' + ET.tostring(root, encoding='unicode')
+        return (xml + '\r\n').encode('utf-8') + b'\0'
+
+class _Field:
+    """
+    The symbols for a field in a QVD file.
+    """
+
+    def __init__(self, name, column_type):
+        self.name = name
+        self.column_type = column_type
+
+        # Symbol numbers keyed by value, and the symbols encoded for the file
+        self.index = {}
+        self.symbols = bytearray()
+        self.has_null = False
+        self.numbers = 0
+        self.texts = 0
+        self.offset = self.bit_offset = self.bit_width = self.bias = 0
+
+    def add(self, series):
+        """
+        Add the distinct values in a series to the symbols.
+        :return: a numpy array with the symbol number for each value, and -1 for missing values
+        """
+        if self.column_type in _DATE_FORMATS:
+            serials, texts = get_date_values(series, self.column_type)
+            codes, uniques = pd.factorize(serials)
+            numbers = self._dates(codes, uniques, texts)
+        elif isinstance(series.dtype, pd.CategoricalDtype):
+            # Only the categories need to be looked up, as the codes already number the values
+            codes = series.cat.codes.values
+            numbers = [self._symbol(value) for value in series.cat.categories]
+        else:
+            codes, uniques = pd.factorize(series.values)
+            numbers = [self._symbol(value) for value in uniques]
+
+        self.has_null = self.has_null or bool((codes < 0).any())
+
+        # The code -1 for missing values takes the last entry of the lookup
+        return np.array(numbers + [-1], dtype='<i4').take(codes)
+
+    def _dates(self, codes, uniques, texts):
+        """
+        Add dual symbols for dates, using the text at the first row with each serial number.
+        """
+        present, first = np.unique(codes, return_index=True)
+        first_rows = dict(zip(present.tolist(), first.tolist()))
+        numbers = []
+
+        for i, serial in enumerate(uniques.tolist()):
+            number = self.index.get(serial)
+            if number is None:
+                text = texts[first_rows[i]]
+                text = text if isinstance(text, str) else str(serial)
+                if float(serial).is_integer() and _INT_RANGE[0] <= serial <= _INT_RANGE[1]:
+                    symbol = struct.pack('<Bi', _DUAL_INT, int(serial))
+                else:
+                    symbol = struct.pack('<Bd', _DUAL_DOUBLE, serial)
+                number = self._new(serial, symbol + text.encode('utf-8') + b'\0')
+                self.numbers += 1
+            numbers.append(number)
+
+        return numbers
+
+    def _symbol(self, value):
+        """
+        Return the symbol number for a value, adding a symbol if the value has not been seen.
+        """
+        number = self.index.get(value)
+        if number is not None:
+            return number
+
+        if isinstance(value, (float, int, np.number)) and not isinstance(value, bool):
+            value = float(value)
+            if value.is_integer() and _INT_RANGE[0] <= value <= _INT_RANGE[1]:
+                symbol = struct.pack('<Bi', _INT, int(value))
+            else:
+                symbol = struct.pack('<Bd', _DOUBLE, value)
+            self.numbers += 1
+        else:
+            symbol = bytes([_STRING]) + str(value).encode('utf-8') + b'\0'
+            self.texts += 1
+
+        return self._new(value, symbol)
+
+    def _new(self, key, symbol):
+        number = len(self.index)
+        self.index[key] = number
+        self.symbols.extend(symbol)
+        return number
+
+    def get_tags(self):
+        """
+        Return the field tags that Qlik derives from the values.
+        """
+        if self.column_type == 'date':
+            return ['$numeric', '$integer', '$date']
+        elif self.column_type == 'datetime':
+            return ['$numeric', '$timestamp']
+        elif self.numbers and not self.texts:
+            return ['$numeric']
+        elif self.texts and not self.numbers:
+            return ['$text']
+        return []
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
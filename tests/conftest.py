@@ -0,0 +1,113 @@
+import os
+import sys
+import threading
+import warnings
+
+import pandas as pd
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ('core', 'generated', 'benchmarks'):
+    sys.path.insert(0, os.path.join(ROOT_DIR, folder))
+
+import fixtures
+import ServerSideExtension_pb2 as SSE
+
+@pytest.fixture(scope='session')
+def fixture_dir(tmp_path_factory):
+    """
+    A directory for the synthetic SAS files generated with the benchmark fixtures.
+    """
+    return str(tmp_path_factory.mktemp('fixtures'))
+
+def make_request(path, args=''):
+    """
+    Build the request for Read_SAS with the path and additional arguments in the first row.
+    """
+    return [SSE.BundledRows(rows=[SSE.Row(duals=[SSE.Dual(strData=path), SSE.Dual(strData=args)])])]
+
+def make_reader(path, args='', context=None, **kwargs):
+    """
+    Create a SASReader for a file, with a stand-in context if none is given.
+    """
+    from _cache import _BackgroundContext
+    from _sas_reader import SASReader
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return SASReader(make_request(path, args), context or _BackgroundContext(threading.Event()), **kwargs)
+
+def read_frame(reader, on_chunk=None):
+    """
+    Read a file with a SASReader into a single data frame, with Categorical columns converted back to objects.
+    :param on_chunk: a function called after each chunk
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        response = reader.read(describe=False)
+
+        if isinstance(response, pd.DataFrame):
+            df = response
+        else:
+            chunks = []
+            for chunk in response:
+                chunks.append(chunk)
+                if on_chunk is not None:
+                    on_chunk(reader)
+            df = pd.concat(chunks) if chunks else pd.DataFrame()
+
+    df = df.reset_index(drop=True)
+    for name in df.columns:
+        if isinstance(df[name].dtype, pd.CategoricalDtype):
+            df[name] = df[name].astype(object)
+    return df
+
+def load_service_module():
+    """
+    Load the SSE module from core/__main__.py, which cannot be imported by name.
+    """
+    import importlib.util
+
+    if 'sse_service' not in sys.modules:
+        spec = importlib.util.spec_from_file_location('sse_service', os.path.join(ROOT_DIR, 'core', '__main__.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules['sse_service'] = module
+    return sys.modules['sse_service']
+
+@pytest.fixture
+def start_service(tmp_path, monkeypatch):
+    """
+    Start the SSE in this process on a free local port.
+    :return: a function that takes the arguments for ExtensionService and returns the service and a client stub
+    """
+    import grpc
+    from concurrent import futures
+
+    # The service writes its log to a logs folder in the working directory
+    monkeypatch.chdir(tmp_path)
+    module = load_service_module()
+    servers = []
+
+    def start(**kwargs):
+        service = module.ExtensionService(os.path.join(ROOT_DIR, 'core', 'functions.json'), **kwargs)
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+        service._add_servicer(service, server)
+        port = server.add_insecure_port('127.0.0.1:0')
+        server.start()
+        servers.append(server)
+        module._import_libraries()
+        return service, SSE.ConnectorStub(grpc.insecure_channel('127.0.0.1:{}'.format(port)))
+
+    yield start
+
+    for server in servers:
+        server.stop(None)
+
+def execute(stub, path, args='', function_id=0):
+    """
+    Call a function on the SSE with a path and additional arguments.
+    :return: the streaming call
+    """
+    header = SSE.FunctionRequestHeader(functionId=function_id, version='1').SerializeToString()
+    return stub.ExecuteFunction(iter(make_request(path, args)), metadata=[('qlik-functionrequestheader-bin', header)])
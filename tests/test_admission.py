@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+
+import fixtures
+from conftest import execute
+from test_cancellation import _wait_for
+from _admission import AdmissionControl, AdmissionError
+
+def _acquire_in_thread(admission, cancelled=None):
+    """
+    Call acquire on a background thread and collect the result or error.
+    """
+    result = {}
+
+    def run():
+        try:
+            result['wait'] = admission.acquire(cancelled)
+        except AdmissionError as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, result
+
+def test_cancel_while_queued():
+    admission = AdmissionControl(1, 2, 60)
+    assert admission.acquire() == 0.0
+
+    cancelled = threading.Event()
+    thread, result = _acquire_in_thread(admission, cancelled)
+    assert _wait_for(lambda: admission.queued == 1)
+
+    start = time.time()
+    cancelled.set()
+    admission.wake()
+    thread.join(5)
+
+    assert time.time() - start < 5
+    assert result == {'wait': None}
+    assert admission.active == 1 and admission.queued == 0
+
+def test_cancelled_request_leaves_slot_for_next():
+    admission = AdmissionControl(1, 2, 60)
+    admission.acquire()
+
+    cancelled = threading.Event()
+    first, first_result = _acquire_in_thread(admission, cancelled)
+    assert _wait_for(lambda: admission.queued == 1)
+    second, second_result = _acquire_in_thread(admission)
+    assert _wait_for(lambda: admission.queued == 2)
+
+    # The slot is freed and the first request is cancelled before either of them wakes up
+    with admission._condition:
+        cancelled.set()
+        admission.active -= 1
+        admission._condition.notify()
+
+    first.join(5)
+    second.join(5)
+    assert first_result == {'wait': None}
+    assert second_result['wait'] is not None
+    assert admission.active == 1 and admission.queued == 0
+
+def test_timeout_while_queued():
+    admission = AdmissionControl(1, 1, 0.1)
+    admission.acquire()
+
+    with pytest.raises(AdmissionError):
+        admission.acquire(threading.Event())
+    assert admission.queued == 0
+
+def test_queued_call_cancelled_by_client(fixture_dir, start_service):
+    path = fixtures.get_fixture(fixture_dir, rows=200000, columns=10, string_length=16)
+    service, stub = start_service(max_reads=1, max_queue=1, queue_timeout=60)
+
+    # The first call holds the only slot while the client stops consuming rows
+    first = execute(stub, path)
+    next(first)
+    queued = execute(stub, path)
+    assert _wait_for(lambda: service.admission.queued == 1)
+
+    start = time.time()
+    queued.cancel()
+
+    assert _wait_for(lambda: service.admission.queued == 0, timeout=5)
+    assert time.time() - start < 5
+    assert service.admission.active == 1
+
+    first.cancel()
+    assert _wait_for(lambda: service.admission.active == 0)
@@ -0,0 +1,117 @@
+import pandas as pd
+import pytest
+
+import _aggregate
+import fixtures
+from conftest import make_reader, read_frame
+from _aggregate import AggregationError
+from _writers import get_timestamps
+
+def _sorted(df, keys):
+    return df.sort_values(keys, na_position='first').reset_index(drop=True)
+
+@pytest.mark.parametrize('file_format', ['sas7bdat', 'xport'])
+def test_string_min_max_skips_nulls(fixture_dir, file_format):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1,\
+        file_format=file_format)
+    full = read_frame(make_reader(path, 'chunksize=500'))
+
+    result = read_frame(make_reader(path, 'chunksize=500, groupby=C3, agg=C5:min|C5:max|count'))
+
+    present = full.dropna(subset=['C5'])
+    expected = pd.DataFrame({'count': full.groupby('C3', dropna=False).size()})
+    expected['C5_min'] = present.groupby('C3', dropna=False)['C5'].min()
+    expected['C5_max'] = present.groupby('C3', dropna=False)['C5'].max()
+    expected = expected.reset_index()[['C3', 'C5_min', 'C5_max', 'count']]
+
+    pd.testing.assert_frame_equal(_sorted(result, ['C3']), _sorted(expected, ['C3']), check_dtype=False)
+
+def _count_spills(monkeypatch):
+    """
+    Count the times every Aggregator spills its groups to disk.
+    """
+    spills = []
+    spill = _aggregate.Aggregator._spill
+
+    def counted(self):
+        spills.append(self._held_rows())
+        return spill(self)
+
+    monkeypatch.setattr(_aggregate.Aggregator, '_spill', counted)
+    return spills
+
+def _expected(full, keys, numeric, distinct):
+    """
+    Calculate the aggregates with pandas on the whole dataset.
+    """
+    grouped = full.groupby(keys, dropna=False)
+    expected = pd.DataFrame({'count': grouped.size()})
+    for col in numeric:
+        expected[col + '_sum'] = grouped[col].sum()
+        expected[col + '_count'] = grouped[col].count()
+        expected[col + '_mean'] = grouped[col].mean()
+        expected[col + '_min'] = grouped[col].min()
+        expected[col + '_max'] = grouped[col].max()
+    for col in distinct:
+        expected[col + '_count_distinct'] = grouped[col].nunique()
+    return expected.reset_index()
+
+@pytest.mark.parametrize('groupby, max_groups', [
+    ('C3', None),
+    ('C3', 20),
+    ('C3|C5', None),
+    ('C3|C5', 200),
+])
+def test_aggregates_match_pandas(fixture_dir, monkeypatch, groupby, max_groups):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1)
+    full = read_frame(make_reader(path, 'chunksize=500'))
+    spills = _count_spills(monkeypatch)
+
+    functions = ['N2:sum', 'N2:count', 'N2:mean', 'N2:min', 'N2:max', 'N4:sum', 'N4:count', 'N4:mean', 'N4:min',\
+        'N4:max', 'C5:count_distinct', 'count']
+    args = 'chunksize=500, groupby={0}, agg={1}'.format(groupby, '|'.join(functions))
+    if max_groups:
+        args += ', max_groups={}'.format(max_groups)
+    result = read_frame(make_reader(path, args))
+
+    # A small limit on the groups held in memory spills them to disk, with the same result
+    assert bool(spills) == bool(max_groups)
+
+    keys = groupby.split('|')
+    expected = _expected(full, keys, ['N2', 'N4'], ['C5'])[result.columns]
+    pd.testing.assert_frame_equal(_sorted(result, keys), _sorted(expected, keys), check_dtype=False)
+
+def test_totals_without_groupby(fixture_dir):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1)
+    full = read_frame(make_reader(path, 'chunksize=500'))
+
+    result = read_frame(make_reader(path, 'chunksize=500, agg=N2:sum|N2:mean|C3:count_distinct|count'))
+
+    assert len(result) == 1
+    assert result['N2_sum'][0] == pytest.approx(full['N2'].sum())
+    assert result['N2_mean'][0] == pytest.approx(full['N2'].mean())
+    assert result['C3_count_distinct'][0] == full['C3'].nunique()
+    assert result['count'][0] == len(full)
+
+def test_groupby_date_period(fixture_dir):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1)
+    full = read_frame(make_reader(path, 'chunksize=500'))
+
+    result = read_frame(make_reader(path, 'chunksize=500, groupby=DT:year, agg=N2:sum|count'))
+
+    years = get_timestamps(full['DT'], 'date').dt.to_period('Y').dt.to_timestamp()
+    expected = full.assign(DT_year=years).groupby('DT_year', dropna=False).agg(N2_sum=('N2', 'sum'), count=('N2', 'size'))
+    expected = expected.reset_index()
+
+    # Dates are truncated to the start of each period, and missing dates are a group of their own
+    assert sorted(zip(result['DT_year'].astype(str), result['count'], result['N2_sum'].round(6))) ==\
+        sorted(zip(expected['DT_year'].astype(str), expected['count'], expected['N2_sum'].round(6)))
+    assert result['DT_year'].isnull().sum() == 1
+
+@pytest.mark.parametrize('args', ['groupby=C3, agg=C5:sum', 'groupby=C3:month', 'groupby=XX, agg=count',\
+    'groupby=C3, agg=N2:median'])
+def test_invalid_aggregation(fixture_dir, args):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12)
+
+    with pytest.raises(AggregationError):
+        read_frame(make_reader(path, 'chunksize=500, ' + args))
@@ -0,0 +1,60 @@
+import asyncio
+import os
+import threading
+from concurrent import futures
+
+import grpc
+import pytest
+
+import fixtures
+import ServerSideExtension_pb2 as SSE
+from conftest import ROOT_DIR, execute, load_service_module
+
+aio = pytest.importorskip('grpc.aio')
+
+@pytest.fixture
+def aio_stub(tmp_path, monkeypatch):
+    """
+    Start the SSE with the asyncio server on a loop in a background thread.
+    :return: the service and a client stub
+    """
+    from _aio_server import AsyncConnector
+
+    monkeypatch.chdir(tmp_path)
+    module = load_service_module()
+    service = module.ExtensionService(os.path.join(ROOT_DIR, 'core', 'functions.json'))
+    module._import_libraries()
+
+    started = threading.Event()
+    state = {}
+
+    async def run():
+        executor = futures.ThreadPoolExecutor(max_workers=4)
+        server = aio.server()
+        service._add_servicer(AsyncConnector(service, executor), server)
+        state['port'] = server.add_insecure_port('127.0.0.1:0')
+        state['loop'], state['stop'] = asyncio.get_running_loop(), asyncio.Event()
+        await server.start()
+        started.set()
+        try:
+            await state['stop'].wait()
+        finally:
+            await server.stop(0)
+            executor.shutdown(wait=False)
+
+    thread = threading.Thread(target=asyncio.run, args=(run(),), daemon=True)
+    thread.start()
+    assert started.wait(10)
+
+    yield service, SSE.ConnectorStub(grpc.insecure_channel('127.0.0.1:{}'.format(state['port'])))
+
+    state['loop'].call_soon_threadsafe(state['stop'].set)
+    thread.join(10)
+    assert not thread.is_alive()
+
+def test_read_with_asyncio_server(fixture_dir, aio_stub):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1)
+    service, stub = aio_stub
+
+    assert sum(len(bundle.rows) for bundle in execute(stub, path, 'chunksize=500')) == 3000
+    assert service.admission.active == 0
@@ -0,0 +1,128 @@
+import os
+import shutil
+import time
+
+import pytest
+
+import _cache
+import fixtures
+from conftest import make_reader, read_frame
+from test_cancellation import _wait_for
+from _cache import DirectoryWatcher, SASCache
+from _scheduler import ChunkScheduler
+
+@pytest.fixture
+def watched(fixture_dir, tmp_path):
+    """
+    A watched directory with a copy of a fixture, and a watcher with a short settle time.
+    :return: the watcher, the cache and the path of the file in the watched directory
+    """
+    directory = tmp_path / 'watched'
+    directory.mkdir()
+    path = str(directory / 'data.sas7bdat')
+    shutil.copy(fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1), path)
+
+    cache = SASCache(str(tmp_path / 'cache'))
+    watcher = DirectoryWatcher([str(directory)], cache, ChunkScheduler(1), settle=0.2)
+    yield watcher, cache, path
+    watcher.stop()
+
+def _poll_until_cached(watcher, cache, path):
+    """
+    Poll until the file has settled and been loaded into the cache.
+    """
+    watcher.poll()
+    time.sleep(0.3)
+    watcher.poll()
+    return _wait_for(lambda: cache.is_fresh(path) and not watcher.pending)
+
+class _Entry:
+    """
+    A stand-in for os.DirEntry that fails to stat.
+    """
+
+    def __init__(self, entry):
+        self.name = entry.name
+        self.path = entry.path
+
+    def is_file(self):
+        return True
+
+    def stat(self):
+        raise FileNotFoundError(self.path)
+
+def test_unlisted_directory_keeps_entries(watched, monkeypatch):
+    watcher, cache, path = watched
+    assert _poll_until_cached(watcher, cache, path)
+
+    # A directory that cannot be listed, e.g. during a network glitch, is not treated as empty
+    def fail(directory):
+        raise OSError('network share unavailable')
+    monkeypatch.setattr(_cache.os, 'scandir', fail)
+    watcher.poll()
+
+    assert path in watcher.files
+    assert cache.is_fresh(path)
+
+def test_stat_error_does_not_abort_poll(watched, monkeypatch, fixture_dir):
+    watcher, cache, path = watched
+    other = os.path.join(os.path.dirname(path), 'other.xpt')
+    shutil.copy(fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, file_format='xport'), other)
+    assert _poll_until_cached(watcher, cache, path)
+
+    # One file that cannot be checked is skipped, and the other files in the directory are still polled
+    scandir = os.scandir
+    monkeypatch.setattr(_cache.os, 'scandir',\
+        lambda directory: [_Entry(e) if e.path == path else e for e in scandir(directory)])
+    watcher.poll()
+    time.sleep(0.3)
+    watcher.poll()
+
+    assert _wait_for(lambda: cache.is_fresh(other) and not watcher.pending)
+    assert cache.is_fresh(path)
+
+def test_file_cached_once_settled(watched):
+    watcher, cache, path = watched
+    full = read_frame(make_reader(path, 'chunksize=700'))
+
+    # The file is not cached until it has been unchanged for the settle time
+    watcher.poll()
+    watcher.poll()
+    assert not watcher.pending and not cache.is_fresh(path)
+
+    assert _poll_until_cached(watcher, cache, path)
+    reader = make_reader(path, 'chunksize=700', cache=cache)
+    cached = read_frame(reader)
+    assert reader.cache_hit
+    assert len(cached) == 3000
+    for name in full.columns:
+        assert cached[name].astype(object).where(cached[name].notna(), None).tolist() ==\
+            full[name].astype(object).where(full[name].notna(), None).tolist()
+
+def test_changed_file_invalidates_entry(watched, fixture_dir):
+    watcher, cache, path = watched
+    assert _poll_until_cached(watcher, cache, path)
+
+    # A changed file is read from disk until it settles again and is cached
+    shutil.copy(fixtures.get_fixture(fixture_dir, rows=2000, columns=7, string_length=12), path)
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+    assert not cache.is_fresh(path)
+
+    reader = make_reader(path, 'chunksize=700', cache=cache)
+    assert len(read_frame(reader)) == 2000 and not reader.cache_hit
+
+    watcher.poll()
+    assert not watcher.pending and not cache.is_fresh(path)
+    assert _poll_until_cached(watcher, cache, path)
+
+def test_deleted_file_removes_entry(watched):
+    watcher, cache, path = watched
+    assert _poll_until_cached(watcher, cache, path)
+    entry = cache._get_path(path)
+    assert os.path.exists(entry)
+
+    os.remove(path)
+    watcher.poll()
+
+    assert path not in watcher.files
+    assert not os.path.exists(entry)
@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+import fixtures
+from conftest import execute
+from _sas_reader import SASReader
+
+def _count_prepared(monkeypatch):
+    """
+    Count the chunks prepared by every SASReader.
+    """
+    counts = []
+    prepare = SASReader._prepare
+
+    def counted(self, df):
+        counts.append(len(df))
+        return prepare(self, df)
+
+    monkeypatch.setattr(SASReader, '_prepare', counted)
+    return counts
+
+def _wait_for(condition, timeout=10):
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.01)
+    return condition()
+
+def _cancel_after(call, bundles):
+    """
+    Consume a number of bundles from a call and then cancel it.
+    """
+    rows = 0
+    for i, bundle in enumerate(call):
+        rows += len(bundle.rows)
+        if i + 1 == bundles:
+            break
+    call.cancel()
+    return rows
+
+@pytest.mark.parametrize('args', ['', 'chunksize=500'])
+def test_cancel_stops_read(fixture_dir, start_service, monkeypatch, args):
+    path = fixtures.get_fixture(fixture_dir, rows=200000, columns=10, string_length=16)
+    counts = _count_prepared(monkeypatch)
+    service, stub = start_service(max_reads=1, max_queue=0)
+
+    rows = _cancel_after(execute(stub, path, args), 3)
+
+    # The slot is given back, and only the chunks in flight when the call was cancelled are decoded
+    assert _wait_for(lambda: service.admission.active == 0)
+    assert 0 < rows <= sum(counts) < rows + 4 * max(counts)
+    assert sum(counts) < 200000 // 10
+    assert service.metrics.counters.get(('sse_requests_cancelled_total', (('function', 'Read_SAS'),))) == 1
+
+def test_cancel_stops_read_with_sas7bdat_module(fixture_dir, start_service, monkeypatch):
+    path = fixtures.get_fixture(fixture_dir, rows=20000, columns=10, string_length=16)
+    counts = _count_prepared(monkeypatch)
+
+    # Files that pandas cannot read are loaded with the SAS7BDAT module and then sent a chunk at a time
+    def fail(self, **kwargs):
+        raise ValueError('not supported by pandas')
+    monkeypatch.setattr(SASReader, '_open_sas', fail)
+
+    service, stub = start_service(max_reads=1, max_queue=0)
+    rows = _cancel_after(execute(stub, path, 'read_ahead=0'), 2)
+
+    assert _wait_for(lambda: service.admission.active == 0)
+    assert 0 < rows <= sum(counts) < rows + 4 * max(counts)
+    assert sum(counts) < 20000 // 4
+
+def test_read_not_cancelled(fixture_dir, start_service):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1)
+    service, stub = start_service()
+
+    assert sum(len(bundle.rows) for bundle in execute(stub, path)) == 3000
+    assert ('sse_requests_cancelled_total', (('function', 'Read_SAS'),)) not in service.metrics.counters
@@ -0,0 +1,40 @@
+import pandas as pd
+
+import fixtures
+from conftest import load_service_module, make_reader
+import _sas_reader
+
+def _chunk(values):
+    return pd.DataFrame({'C': pd.Series(values, dtype=object), 'N': range(len(values))})
+
+def test_categorical_from_first_chunk(fixture_dir):
+    reader = make_reader(fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1))
+
+    df = reader._prepare(_chunk(['A', 'B', 'A', 'B']))
+    assert reader.categorical == ['C']
+    assert isinstance(df['C'].dtype, pd.CategoricalDtype)
+
+def test_categorical_dropped_over_limit(fixture_dir, monkeypatch):
+    monkeypatch.setattr(_sas_reader, '_MAX_CATEGORIES', 5)
+    reader = make_reader(fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1))
+
+    chunks = [reader._prepare(_chunk(values)) for values in (['A', 'B'] * 4, ['A', 'C', 'D', 'E'] * 2, ['F', 'A'] * 4,\
+        ['A', 'B'] * 4)]
+
+    # The column is dropped once more distinct values have been seen across chunks than the limit
+    assert [isinstance(df['C'].dtype, pd.CategoricalDtype) for df in chunks] == [True, True, False, False]
+    assert reader.categorical == [] and reader.categories == {}
+    assert list(chunks[2]['C']) == ['F', 'A'] * 4
+
+def test_dual_cache_limit(monkeypatch):
+    module = load_service_module()
+    monkeypatch.setattr(module, '_MAX_CACHED_DUALS', 4)
+    module._import_libraries()
+    cache = {}
+
+    for values in (['A', 'B', 'C'], ['A', 'B'], ['D', 'E', 'A']):
+        df = pd.DataFrame({'C': pd.Categorical(values)})
+        duals = module.ExtensionService._get_columns(df, cache, {})[0]
+
+        assert [dual.strData for dual in duals] == values
+        assert len(cache['C']) <= 4
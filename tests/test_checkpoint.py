@@ -0,0 +1,119 @@
+import bz2
+import gzip
+import os
+import shutil
+import threading
+
+import pandas as pd
+import pytest
+
+import fixtures
+from conftest import make_reader, read_frame
+from _cache import DirectoryWatcher, SASCache
+from _checkpoint import ResumeError, get_checkpoint, parse_token
+from _scheduler import ChunkScheduler
+
+def _read_with_tokens(path, args):
+    """
+    Read a file in chunks, collecting the continuation token after each chunk.
+    """
+    tokens = []
+    df = read_frame(make_reader(path, args), lambda reader: tokens.append(get_checkpoint(reader.reader)))
+    return df, tokens
+
+def _assert_resumes(path, args, full, tokens, cache=None):
+    """
+    Check that the rows before each token, followed by the rows read from the token, are the full dataset.
+    """
+    for token in tokens:
+        row = parse_token(token)[0]
+        resumed = read_frame(make_reader(path, ', '.join(filter(None, [args, 'resume_from=' + token])), cache=cache))
+        pd.testing.assert_frame_equal(pd.concat([full.iloc[:row], resumed], ignore_index=True), full)
+
+def _compress(path, module, extension):
+    target = path + extension
+    if not os.path.exists(target):
+        with open(path, 'rb') as source, module.open(target, 'wb') as f:
+            shutil.copyfileobj(source, f)
+    return target
+
+@pytest.mark.parametrize('compression, file_format, args', [
+    ('none', 'sas7bdat', 'chunksize=700'),
+    ('rle', 'sas7bdat', 'chunksize=700'),
+    ('rle', 'sas7bdat', 'chunksize=333, read_ahead=0'),
+    ('none', 'xport', 'chunksize=450'),
+])
+def test_resume_from_checkpoints(fixture_dir, compression, file_format, args):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1,\
+        compression=compression, file_format=file_format)
+    full, tokens = _read_with_tokens(path, args)
+
+    assert len(full) == len(pd.read_sas(path))
+    assert len(tokens) > 2 and all(len(token.split(':')) == 3 for token in tokens)
+    _assert_resumes(path, args, full, tokens[:-1])
+
+def test_resume_from_row(fixture_dir):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1)
+    full, _ = _read_with_tokens(path, 'chunksize=700')
+
+    # A plain row is resumed by reading through the earlier rows, so it need not be at the end of a chunk
+    _assert_resumes(path, 'chunksize=700', full, ['0', '1', '1234', '2999', '3000'])
+
+def test_resume_without_chunks(fixture_dir):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1)
+    full, _ = _read_with_tokens(path, 'chunksize=700')
+
+    # The whole file is read into a data frame when there is no chunksize
+    _assert_resumes(path, '', full, ['1500'])
+
+@pytest.mark.parametrize('file_format, module, extension', [
+    ('sas7bdat', gzip, '.gz'),
+    ('xport', bz2, '.bz2'),
+])
+def test_resume_compressed_file(fixture_dir, file_format, module, extension):
+    path = _compress(fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1,\
+        file_format=file_format), module, extension)
+    full, tokens = _read_with_tokens(path, 'chunksize=800')
+
+    assert len(tokens) > 2
+    _assert_resumes(path, 'chunksize=800', full, tokens[:-1])
+
+def test_resume_from_cache(fixture_dir, tmp_path):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1)
+    full, tokens = _read_with_tokens(path, 'chunksize=700')
+
+    cache = SASCache(str(tmp_path))
+    DirectoryWatcher([fixture_dir], cache, ChunkScheduler(1))._load(path)
+    assert cache.is_fresh(path)
+
+    # Chunks from the cache are skipped up to the row in the token
+    reader = make_reader(path, 'chunksize=700, resume_from={}'.format(tokens[1]), cache=cache)
+    resumed = read_frame(reader)
+    assert reader.cache_hit
+    pd.testing.assert_frame_equal(pd.concat([full.iloc[:parse_token(tokens[1])[0]], resumed], ignore_index=True), full)
+
+    _assert_resumes(path, 'chunksize=700', full, tokens[:-1] + ['0', '1', '2000'], cache=cache)
+
+@pytest.mark.parametrize('token', ['', 'abc', '1:2', '1:2:3:4', '-1', '10:-5:0', '1.5', '10:x:0'])
+def test_parse_invalid_token(token):
+    with pytest.raises(ResumeError):
+        parse_token(token)
+
+@pytest.mark.parametrize('token', ['100:12345:0', '700:1024:800', '5000:1024:0'])
+def test_resume_token_not_matching_pages(fixture_dir, token):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1)
+
+    with pytest.raises(ResumeError):
+        read_frame(make_reader(path, 'chunksize=700, resume_from={}'.format(token)))
+
+def test_resume_token_not_matching_records(fixture_dir):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1, file_format='xport')
+
+    with pytest.raises(ResumeError):
+        read_frame(make_reader(path, 'chunksize=450, resume_from=450:1:0'))
+
+def test_resume_with_aggregation(fixture_dir):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1)
+
+    with pytest.raises(ResumeError):
+        make_reader(path, 'chunksize=700, resume_from=700, groupby=C3, agg=N2:sum')
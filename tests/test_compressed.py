@@ -0,0 +1,116 @@
+import bz2
+import gzip
+import io
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import fixtures
+from conftest import make_reader, read_frame
+from test_checkpoint import _compress
+from _compressed import CompressedFileError, CompressedSource, detect_compression
+
+def _zip(path, *names):
+    """
+    Write a zip archive that holds a copy of each fixture under the given names.
+    :param names: pairs of the fixture path and the name of the member
+    """
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for source, name in names:
+            archive.write(source, name)
+    return path
+
+@pytest.mark.parametrize('file_format', ['sas7bdat', 'xport'])
+@pytest.mark.parametrize('compression', ['gzip', 'bz2', 'zip'])
+def test_compressed_read_matches_plain_read(fixture_dir, tmp_path, file_format, compression):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1,\
+        file_format=file_format)
+    expected = read_frame(make_reader(path, 'chunksize=700'))
+
+    if compression == 'gzip':
+        compressed = _compress(path, gzip, '.gz')
+    elif compression == 'bz2':
+        compressed = _compress(path, bz2, '.bz2')
+    else:
+        compressed = _zip(str(tmp_path / 'data.zip'), (path, 'folder/' + os.path.basename(path)))
+    assert detect_compression(compressed) == compression
+
+    reader = make_reader(compressed, 'chunksize=700')
+    pd.testing.assert_frame_equal(read_frame(reader), expected)
+
+def test_detect_compression(fixture_dir, tmp_path):
+    assert detect_compression(fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12)) is None
+    assert detect_compression(str(tmp_path / 'missing.gz')) is None
+
+@pytest.mark.parametrize('lookback', [100, 5000, 10 ** 6])
+def test_decompressed_seeks_match_file(tmp_path, lookback):
+    data = np.random.RandomState(0).bytes(200000)
+    path = str(tmp_path / 'data.bin.gz')
+    with gzip.open(path, 'wb') as f:
+        f.write(data)
+
+    source = CompressedSource(path, 'gzip', lookback=lookback)
+    assert source.name == str(tmp_path / 'data.bin')
+    f = source.open()
+    rng = np.random.RandomState(1)
+
+    try:
+        # Seeks back past the look-back bytes restart the stream from the beginning
+        for _ in range(100):
+            f.seek(int(rng.randint(0, len(data) + 10)))
+            position, size = f.tell(), int(rng.randint(0, 20000))
+            assert f.read(size) == data[position : position + size]
+
+        f.seek(-1000, io.SEEK_END)
+        assert f.read() == data[-1000:]
+        assert source.size == len(data)
+        with pytest.raises(ValueError):
+            f.seek(-1)
+    finally:
+        f.close()
+
+@pytest.fixture
+def archive(fixture_dir, tmp_path):
+    """
+    A zip archive that holds a SAS7BDAT file, an XPORT file with different data and a text file.
+    """
+    sas7bdat = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1)
+    xport = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, file_format='xport')
+    path = str(tmp_path / 'data.zip')
+    with zipfile.ZipFile(path, 'w') as f:
+        f.write(sas7bdat, 'a.sas7bdat')
+        f.write(xport, 'b.xpt')
+        f.writestr('readme.txt', 'SAS files')
+    return path, sas7bdat, xport
+
+def test_zip_member_selection(archive):
+    path, sas7bdat, xport = archive
+
+    for member, source in (('a.sas7bdat', sas7bdat), ('b.xpt', xport)):
+        reader = make_reader(path, 'chunksize=700, member=' + member)
+        pd.testing.assert_frame_equal(read_frame(reader), read_frame(make_reader(source, 'chunksize=700')))
+
+def test_zip_member_errors(archive, tmp_path):
+    path, sas7bdat, xport = archive
+
+    # An archive with several SAS files needs the member argument
+    with pytest.raises(CompressedFileError) as e:
+        CompressedSource(path, 'zip')
+    assert 'holds 2 SAS files' in str(e.value) and 'a.sas7bdat, b.xpt' in str(e.value)
+
+    with pytest.raises(CompressedFileError) as e:
+        CompressedSource(path, 'zip', member='c.sas7bdat')
+    assert 'readme.txt' in str(e.value)
+
+    with pytest.raises(CompressedFileError):
+        make_reader(path, 'member=c.sas7bdat')
+
+    # A single SAS file is chosen without the member argument, even alongside other files
+    single = _zip(str(tmp_path / 'single.zip'), (sas7bdat, 'a.sas7bdat'), (path, 'other.zip'))
+    assert CompressedSource(single, 'zip').member == 'a.sas7bdat'
+
+    with pytest.raises(CompressedFileError):
+        CompressedSource(_compress(sas7bdat, gzip, '.gz'), 'gzip', member='a.sas7bdat')
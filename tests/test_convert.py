@@ -0,0 +1,203 @@
+import os
+import shutil
+import struct
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import fixtures
+import ServerSideExtension_pb2 as SSE
+from conftest import load_service_module, make_reader, read_frame
+from _writers import QVDWriter, get_date_values
+
+def _read_qvd(path):
+    """
+    Read a QVD file written by QVDWriter.
+    :return: the header as an XML element, the symbols for each field, and a data frame with the symbol for each row.
+    Symbols are numbers, strings, or tuples of the number and text for duals.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    end = data.index(b'\r\n\0')
+    header = ET.fromstring(data[:end].decode('utf-8').split('\r\n', 1)[1])
+    position = end + 3
+
+    symbols = {}
+    for field in header.find('Fields'):
+        name = field.find('FieldName').text
+        block = data[position + int(field.find('Offset').text):][:int(field.find('Length').text)]
+        symbols[name] = _parse_symbols(block)
+        assert len(symbols[name]) == int(field.find('NoOfSymbols').text)
+
+    record_size = int(header.find('RecordByteSize').text)
+    records = data[position + int(header.find('Offset').text):]
+    assert len(records) == int(header.find('Length').text) == record_size * int(header.find('NoOfRecords').text)
+
+    columns = {}
+    for field in header.find('Fields'):
+        name = field.find('FieldName').text
+        offset, width, bias = (int(field.find(tag).text) for tag in ('BitOffset', 'BitWidth', 'Bias'))
+        values = []
+        for i in range(0, len(records), record_size):
+            record = int.from_bytes(records[i : i + record_size], 'little')
+            index = ((record >> offset) & ((1 << width) - 1)) + bias
+            values.append(symbols[name][index] if index >= 0 else None)
+        columns[name] = pd.Series(values, dtype=object)
+
+    return header, symbols, pd.DataFrame(columns)
+
+def _parse_symbols(block):
+    symbols, i = [], 0
+
+    def text(start):
+        end = block.index(b'\0', start)
+        return block[start:end].decode('utf-8'), end + 1
+
+    while i < len(block):
+        kind = block[i]
+        if kind == 1:
+            symbols.append(struct.unpack_from('<i', block, i + 1)[0])
+            i += 5
+        elif kind == 2:
+            symbols.append(struct.unpack_from('<d', block, i + 1)[0])
+            i += 9
+        elif kind == 4:
+            value, i = text(i + 1)
+            symbols.append(value)
+        elif kind in (5, 6):
+            number = struct.unpack_from('<i' if kind == 5 else '<d', block, i + 1)[0]
+            value, i = text(i + (5 if kind == 5 else 9))
+            symbols.append((number, value))
+        else:
+            raise ValueError('Unknown symbol type {}'.format(kind))
+
+    return symbols
+
+def _convert(stub, pattern, args='', target=''):
+    header = SSE.FunctionRequestHeader(functionId=2, version='1').SerializeToString()
+    request = [SSE.BundledRows(rows=[SSE.Row(duals=[SSE.Dual(strData=pattern), SSE.Dual(strData=args),\
+        SSE.Dual(strData=target)])])]
+    rows = [row for bundle in stub.ExecuteFunction(iter(request), metadata=[('qlik-functionrequestheader-bin', header)])\
+        for row in bundle.rows]
+    return [(row.duals[0].strData, row.duals[1].strData, row.duals[2].numData, row.duals[4].strData) for row in rows]
+
+def _expected_texts(df, types):
+    """
+    Convert date columns to the text sent to Qlik, for comparison with the QVD and CSV output.
+    """
+    df = df.copy()
+    for name, column_type in types.items():
+        if column_type in ('date', 'datetime'):
+            df[name] = [None if pd.isnull(text) else text for text in get_date_values(df[name], column_type)[1]]
+    return df
+
+def test_qvd_symbols_and_indexes(tmp_path):
+    path = str(tmp_path / 'table.qvd')
+    chunks = [
+        pd.DataFrame({'I': [1.0, 2.0, 1.0], 'F': [0.5, np.nan, 0.5], 'S': ['a', None, 'b'], 'D': [0.0, 1.0, np.nan],\
+            'K': pd.Categorical(['x', 'y', 'x']), 'C': [7.0, 7.0, 7.0]}),
+        pd.DataFrame({'I': [3.0, 2.0 ** 40], 'F': [1.25, 0.5], 'S': ['b', 'é'], 'D': [1.0, 2936549.0],\
+            'K': pd.Categorical(['z', None]), 'C': [7.0, 7.0]}),
+    ]
+    types = {'I': 'numeric', 'F': 'numeric', 'D': 'date'}
+
+    writer = QVDWriter(path, 'table')
+    for chunk in chunks:
+        writer.write(chunk, types)
+    writer.close()
+
+    header, symbols, df = _read_qvd(path)
+    assert header.find('TableName').text == 'table'
+    assert header.find('NoOfRecords').text == '5'
+
+    assert symbols['I'] == [1, 2, 3, 2.0 ** 40]
+    assert symbols['F'] == [0.5, 1.25]
+    assert symbols['S'] == ['a', 'b', 'é']
+    assert symbols['D'] == [(21916, '1960-01-01'), (21917, '1960-01-02'), (2958465, '9999-12-31')]
+    assert symbols['K'] == ['x', 'y', 'z']
+    assert symbols['C'] == [7]
+
+    assert df['I'].tolist() == [1, 2, 1, 3, 2.0 ** 40]
+    assert df['F'].tolist() == [0.5, None, 0.5, 1.25, 0.5]
+    assert df['S'].tolist() == ['a', None, 'b', 'b', 'é']
+    assert [d if d is None else d[1] for d in df['D']] == ['1960-01-01', '1960-01-02', None, '1960-01-02', '9999-12-31']
+    assert df['K'].tolist() == ['x', 'y', 'x', 'z', None]
+    assert df['C'].tolist() == [7] * 5
+
+    # A field with a single value and no nulls takes no bits in the records
+    widths = {f.find('FieldName').text: int(f.find('BitWidth').text) for f in header.find('Fields')}
+    assert widths['C'] == 0
+    assert widths['I'] == 2 and widths['S'] == 3
+
+def test_qvd_without_rows(tmp_path):
+    path = str(tmp_path / 'empty.qvd')
+    writer = QVDWriter(path, 'empty')
+    writer.close()
+
+    header, symbols, df = _read_qvd(path)
+    assert header.find('NoOfRecords').text == '0' and len(df) == 0
+
+@pytest.mark.parametrize('output', ['qvd', 'csv'])
+def test_convert_matches_read(fixture_dir, start_service, tmp_path, output):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1)
+    service, stub = start_service()
+    target = str(tmp_path / 'out')
+
+    status = _convert(stub, path, 'output={}, chunksize=700'.format(output), target)
+    output_path = os.path.join(target, os.path.splitext(os.path.basename(path))[0] + '.' + output)
+    assert status == [(path, output_path, 3000, 'OK')]
+
+    reader = make_reader(path, 'chunksize=700')
+    expected = _expected_texts(read_frame(reader), reader.column_types)
+
+    if output == 'qvd':
+        df = _read_qvd(output_path)[2]
+        df['DT'] = [d if d is None else d[1] for d in df['DT']]
+    else:
+        df = pd.read_csv(output_path, keep_default_na=False, na_values=[''])
+
+    for name in expected.columns:
+        assert [None if pd.isnull(v) else v for v in df[name]] == [None if pd.isnull(v) else v for v in expected[name]]
+
+def test_convert_pattern_and_output_names(fixture_dir, start_service, tmp_path):
+    source = tmp_path / 'source'
+    source.mkdir()
+    shutil.copy(fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12), str(source / 'data.sas7bdat'))
+    shutil.copy(fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, file_format='xport'),\
+        str(source / 'data.xpt'))
+    shutil.copy(fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1),\
+        str(source / 'other.sas7bdat'))
+    service, stub = start_service()
+
+    # Without a target, files are written next to the SAS files. Two files with the same name do not overwrite.
+    status = sorted(_convert(stub, str(source / '*.*'), 'output=csv'))
+    assert [(os.path.basename(s[0]), os.path.basename(s[1]), s[3][:5]) for s in status] ==\
+        [('data.sas7bdat', 'data.csv', 'OK'), ('data.xpt', 'data.csv', 'Error'), ('other.sas7bdat', 'other.csv', 'OK')]
+    assert 'also the output for' in status[1][3]
+
+def test_output_path_rules(tmp_path):
+    module = load_service_module()
+    get_path = module.ExtensionService._get_output_path
+    target = str(tmp_path / 'out')
+
+    assert get_path('/data/a.sas7bdat', 'a.sas7bdat', str(tmp_path / 'b.qvd'), 'qvd', 1) == str(tmp_path / 'b.qvd')
+    assert get_path('/data/a.sas7bdat', 'a.sas7bdat', target, 'qvd', 1) == os.path.join(target, 'a.qvd')
+    assert os.path.isdir(target)
+
+    # A file name is only used as the target for a single file, and compressed files are named after the dataset
+    assert get_path('/data/a.sas7bdat', 'a.sas7bdat', str(tmp_path / 'b.qvd'), 'qvd', 2) ==\
+        os.path.join(str(tmp_path / 'b.qvd'), 'a.qvd')
+    assert get_path(str(tmp_path / 'a.sas7bdat.gz'), 'a.sas7bdat', '', 'csv', 1) == str(tmp_path / 'a.csv')
+
+def test_unsupported_output(fixture_dir, start_service):
+    import grpc
+
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12)
+    service, stub = start_service()
+
+    with pytest.raises(grpc.RpcError) as e:
+        _convert(stub, path, 'output=parquet')
+    assert e.value.code() == grpc.StatusCode.INVALID_ARGUMENT
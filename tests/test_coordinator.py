@@ -0,0 +1,113 @@
+import pandas as pd
+import pytest
+
+import fixtures
+import ServerSideExtension_pb2 as SSE
+from conftest import make_reader, read_frame
+from _checkpoint import ResumeError
+from _coordinator import Coordinator, _Buffer, _count_rows
+
+def _bundle(sizes):
+    """
+    Build a BundledRows with a row for each size, each with a string of that length.
+    """
+    return SSE.BundledRows(rows=[SSE.Row(duals=[SSE.Dual(strData='x' * size, numData=i)])\
+        for i, size in enumerate(sizes)])
+
+def test_plan_splits_pages_evenly():
+    coordinator = Coordinator(['localhost:1', 'localhost:2', 'localhost:3'], min_pages=10)
+
+    assert coordinator.plan((1, 101)) == [(1, 34), (34, 67), (67, 101)]
+    assert coordinator.plan((2, 31)) == [(2, 16), (16, 31)]
+
+def test_plan_without_sharding():
+    coordinator = Coordinator(['localhost:1', 'localhost:2'], min_pages=10)
+
+    # Files that cannot be split, or that have too few pages for two shards, are read without sharding
+    assert coordinator.plan(None) is None
+    assert coordinator.plan((1, 20)) is None
+    assert Coordinator(['localhost:1'], min_pages=1).plan((1, 1000)) is None
+
+@pytest.mark.parametrize('count', [2, 3, 7])
+def test_plan_covers_all_pages(count):
+    coordinator = Coordinator(['localhost:{}'.format(i) for i in range(count)], min_pages=1)
+    shards = coordinator.plan((3, 50))
+
+    assert len(shards) == count
+    assert shards[0][0] == 3 and shards[-1][1] == 50
+    assert all(a[1] == b[0] and a[0] < a[1] for a, b in zip(shards, shards[1:]))
+
+@pytest.mark.parametrize('sizes', [[], [0], [5, 10, 0], [200, 3, 20000, 1], [127, 128, 16383, 16384]])
+def test_count_rows(sizes):
+    bundle = _bundle(sizes)
+    data = bundle.SerializeToString()
+
+    assert _count_rows(data) == (len(sizes), 0 if sizes else len(data))
+
+    for skip in range(len(sizes) + 2):
+        rows, offset = _count_rows(data, skip)
+        assert rows == len(sizes)
+
+        # The rows after the offset are the rows after the skipped rows
+        rest = SSE.BundledRows()
+        rest.ParseFromString(data[offset:])
+        assert list(rest.rows) == list(bundle.rows[skip:])
+
+def test_buffer_spills_in_order():
+    buffer = _Buffer(100)
+    items = [(_bundle([size]).SerializeToString(), 1) for size in (10, 60, 40, 5, 300, 2)]
+
+    for item in items[:4]:
+        buffer.put(*item)
+    assert buffer.spilled
+
+    assert [buffer.get() for _ in range(3)] == items[:3]
+    for item in items[4:]:
+        buffer.put(*item)
+    buffer.close()
+
+    assert [buffer.get() for _ in range(3)] == items[3:]
+    assert buffer.get() is None
+
+def test_buffer_raises_error_after_rows():
+    buffer = _Buffer(100)
+    buffer.put(b'\x0a\x00', 1)
+    buffer.close(ValueError('failed'))
+
+    assert buffer.get() == (b'\x0a\x00', 1)
+    with pytest.raises(ValueError):
+        buffer.get()
+
+@pytest.mark.parametrize('compression, args', [
+    ('none', 'chunksize=5000'),
+    ('rle', 'chunksize=5000'),
+    ('none', 'chunksize=777, read_ahead=0'),
+])
+@pytest.mark.parametrize('count', [2, 5])
+def test_shards_reassemble_file(fixture_dir, compression, args, count):
+    path = fixtures.get_fixture(fixture_dir, rows=20000, columns=10, string_length=16, compression=compression)
+    full = read_frame(make_reader(path, args))
+
+    pages = make_reader(path, args).get_pages()
+    shards = Coordinator(['localhost:{}'.format(i) for i in range(count)], min_pages=1).plan(pages)
+    assert shards is not None and len(shards) == count
+
+    parts = [read_frame(make_reader(path, '{0}, pages={1}:{2}'.format(args, *shard))) for shard in shards]
+    assert all(len(part) for part in parts)
+    pd.testing.assert_frame_equal(pd.concat(parts, ignore_index=True), full)
+
+def test_pages_outside_file(fixture_dir):
+    path = fixtures.get_fixture(fixture_dir, rows=20000, columns=10, string_length=16)
+    first, count = make_reader(path, 'chunksize=5000').get_pages()
+
+    # Pages before the first page holding rows add no rows
+    assert len(read_frame(make_reader(path, 'chunksize=5000, pages=0:{}'.format(first)))) == 0
+
+    for pages in ['{0}:{1}'.format(first, count + 1), '5:2', 'a:b', '3']:
+        with pytest.raises(ResumeError):
+            read_frame(make_reader(path, 'chunksize=5000, pages={}'.format(pages)))
+
+def test_pages_not_available(fixture_dir):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, file_format='xport')
+
+    assert make_reader(path, 'chunksize=500').get_pages() is None
@@ -0,0 +1,65 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import fixtures
+from conftest import make_reader
+from _sas_reader import SASReader
+from _writers import get_date_values, get_timestamps
+
+@pytest.mark.parametrize('fmt, column_type', [('DATE9.', 'date'), ('yymmdd10', 'date'), ('DATETIME20.', 'datetime'),\
+    ('E8601DT19.', 'datetime'), ('TOD8.', None), ('TIME8.', None), ('BEST12.', None), ('$CHAR16.', None)])
+def test_column_type(fmt, column_type):
+    assert SASReader._get_column_type(fmt) == column_type
+
+def test_missing_dates_masked():
+    series = pd.Series([0.0, np.nan, 21000.0, 3e6])
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        timestamps = get_timestamps(series, 'date')
+        serials, texts = get_date_values(series * 86400, 'datetime')
+
+    assert list(timestamps.index) == list(series.index)
+    assert timestamps[0] == pd.Timestamp('1960-01-01') and timestamps[2] == pd.Timestamp('2017-06-30')
+    assert timestamps[[1, 3]].isnull().all()
+    assert list(serials[[0, 2, 3]]) == [21916, 42916, 3021916] and np.isnan(serials[1])
+    assert texts[0] == '1960-01-01 00:00:00' and pd.isnull(texts[1])
+
+@pytest.mark.parametrize('file_format', ['sas7bdat', 'xport'])
+def test_dates_sent_from_numbers(fixture_dir, file_format):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1, file_format=file_format)
+    reader = make_reader(path, 'chunksize=1000')
+
+    # Dates are left as SAS numbers by pandas, with missing values, and converted when they are sent
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)
+        chunks = list(reader.read(describe=False))
+
+    assert reader.column_types.get('DT') == 'date'
+    assert all(pd.api.types.is_float_dtype(chunk['DT']) for chunk in chunks)
+    assert any(chunk['DT'].isnull().any() for chunk in chunks)
+
+def test_dates_false(fixture_dir):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1)
+    reader = make_reader(path, 'chunksize=1000, dates=false')
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        chunk = next(reader.read(describe=False))
+
+    # pandas converts the dates to timestamps, which are sent as text as in earlier versions
+    assert 'DT' not in reader.column_types
+    assert pd.api.types.is_datetime64_any_dtype(chunk['DT'])
+
+def test_dates_outside_timestamp_range():
+    days = float((np.datetime64('9999-12-31') - np.datetime64('1960-01-01')).astype(int))
+
+    serials, texts = get_date_values(pd.Series([days, np.nan, 0.0]), 'date')
+    assert list(texts[[0, 2]]) == ['9999-12-31', '1960-01-01'] and pd.isnull(texts[1])
+    assert serials[0] == 2958465
+
+    serials, texts = get_date_values(pd.Series([days * 86400 + 3661]), 'datetime')
+    assert list(texts) == ['9999-12-31 01:01:01']
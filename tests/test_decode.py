@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import fixtures
+from conftest import make_reader
+import _sas_reader
+
+@pytest.fixture
+def reader(fixture_dir):
+    return make_reader(fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1))
+
+def _values(*values):
+    return np.array(list(values), dtype=object)
+
+def test_decode_strips_padding_and_keeps_nulls(reader):
+    result = reader._decode_column('C', _values(b'ABC   ', None, b'ABC   ', b'  X '))
+
+    assert list(result[[0, 2, 3]]) == ['ABC', 'ABC', '  X']
+    assert pd.isnull(result[1])
+    assert result[0] is result[2]
+
+def test_codec_kept_for_column(reader):
+    assert list(reader._decode_column('C', _values(b'caf\xc3\xa9', b'abc'))) == ['café', 'abc']
+
+    # Later values that are not valid UTF-8 are not decoded with another codec
+    assert list(reader._decode_column('C', _values(b'\xe9t\xe9', b'caf\xc3\xa9'))) == ['�t�', 'café']
+    assert reader.decode_codecs == {'C': 'utf_8'}
+
+def test_codec_chosen_per_column(reader):
+    assert list(reader._decode_column('A', _values(b'\xe9t\xe9'))) == ['été']
+    assert list(reader._decode_column('B', _values(b'caf\xc3\xa9'))) == ['café']
+    assert list(reader._decode_column('A', _values(b'caf\xc3\xa9'))) == ['cafÃ©']
+    assert reader.decode_codecs == {'A': 'latin_1', 'B': 'utf_8'}
+
+def test_encoding_used_for_every_value(reader):
+    reader.encoding = 'latin_1'
+
+    assert list(reader._decode_column('C', _values(b'caf\xc3\xa9', b'\xe9t\xe9'))) == ['cafÃ©', 'été']
+    assert reader.decode_codecs == {}
+
+def test_memo_across_chunks(reader):
+    reader._decode_column('C', _values(b'A', b'B', b'A'))
+    reader._decode_column('C', _values(b'B', b'C', None))
+
+    assert (reader.memo_hits, reader.memo_misses) == (1, 3)
+    assert list(reader.decode_memo['C'][1]) == ['A', 'B', 'C']
+
+def test_high_cardinality_column(reader, monkeypatch):
+    monkeypatch.setattr(_sas_reader, '_MAX_MEMO_SIZE', 3)
+    chunks = [_values(b'A', b'B', b'C'), _values(b'D', None, b'A'), _values(b'E ', b'\xe9', None)]
+
+    result = [reader._decode_column('C', chunk) for chunk in chunks]
+
+    # The memo is dropped once it grows beyond the limit, and later chunks are decoded a value at a time
+    assert reader.decode_memo['C'] is None
+    assert [list(pd.Series(r).fillna('-')) for r in result] == [['A', 'B', 'C'], ['D', '-', 'A'], ['E', '�', '-']]
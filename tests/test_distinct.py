@@ -0,0 +1,81 @@
+import threading
+import warnings
+
+import grpc
+import pandas as pd
+import pytest
+
+import fixtures
+import ServerSideExtension_pb2 as SSE
+from conftest import make_reader, read_frame
+from _aggregate import AggregationError
+from _cache import _BackgroundContext
+from _sas_reader import SASReader
+
+def _distinct_request(path, columns, args=''):
+    return [SSE.BundledRows(rows=[SSE.Row(duals=[SSE.Dual(strData=path), SSE.Dual(strData=columns),\
+        SSE.Dual(strData=args)])])]
+
+def _get_distinct(path, columns, args=''):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        reader = SASReader(_distinct_request(path, columns, args), _BackgroundContext(threading.Event()), distinct=True)
+    return read_frame(reader)
+
+def _sorted(df):
+    return df.sort_values(list(df.columns), na_position='first').reset_index(drop=True)
+
+@pytest.mark.parametrize('columns', ['C3', 'C3, C5'])
+@pytest.mark.parametrize('counts', [False, True])
+def test_distinct_matches_pandas(fixture_dir, columns, counts):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1)
+    full = read_frame(make_reader(path, 'chunksize=500'))
+    keys = [col.strip() for col in columns.split(',')]
+
+    result = _get_distinct(path, columns, 'chunksize=500, counts={}'.format(str(counts).lower()))
+
+    # Missing values are a distinct value of their own
+    if counts:
+        expected = full.groupby(keys, dropna=False).size().rename('count').reset_index()
+    else:
+        expected = full[keys].drop_duplicates()
+    assert list(result.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(_sorted(result), _sorted(expected), check_dtype=False)
+
+def test_distinct_spilled(fixture_dir):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1)
+    expected = _get_distinct(path, 'C5', 'chunksize=500, counts=true')
+
+    result = _get_distinct(path, 'C5', 'chunksize=500, counts=true, max_groups=50')
+    assert result['count'].sum() == 3000
+    pd.testing.assert_frame_equal(_sorted(result), _sorted(expected), check_dtype=False)
+
+def test_distinct_requires_columns(fixture_dir):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12)
+
+    with pytest.raises(AggregationError):
+        _get_distinct(path, ' , ')
+    with pytest.raises(AggregationError):
+        _get_distinct(path, 'XX')
+
+def test_distinct_through_service(fixture_dir, start_service):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1)
+    service, stub = start_service()
+    expected = _get_distinct(path, 'C3', 'counts=true')
+
+    header = SSE.FunctionRequestHeader(functionId=3, version='1').SerializeToString()
+    call = stub.ExecuteFunction(iter(_distinct_request(path, 'C3', 'counts=true')),\
+        metadata=[('qlik-functionrequestheader-bin', header)])
+    rows = [row for bundle in call for row in bundle.rows]
+
+    table = SSE.TableDescription()
+    table.ParseFromString(dict(call.initial_metadata())['qlik-tabledescription-bin'])
+    assert [field.name for field in table.fields] == ['C3', 'count']
+
+    assert len(rows) == len(expected)
+    assert sum(row.duals[1].numData for row in rows) == 3000
+
+    with pytest.raises(grpc.RpcError) as e:
+        list(stub.ExecuteFunction(iter(_distinct_request(path, '', '')),\
+            metadata=[('qlik-functionrequestheader-bin', header)]))
+    assert e.value.code() == grpc.StatusCode.INVALID_ARGUMENT
@@ -0,0 +1,129 @@
+import itertools
+import sys
+import tracemalloc
+
+import grpc
+import pytest
+
+import _memory
+import fixtures
+from conftest import execute, make_reader, read_frame
+from _memory import MemoryLimitError, MemoryTracker
+from _sas_reader import SASReader
+
+class _CountingTracker:
+    """
+    A stand-in for MemoryTracker that counts samples and fails after a number of them.
+    """
+
+    def __init__(self, fail_after=None):
+        self.samples = 0
+        self.fail_after = fail_after
+
+    def sample(self):
+        self.samples += 1
+        if self.fail_after is not None and self.samples > self.fail_after:
+            raise MemoryLimitError('over the limit')
+
+def _growing_rss(monkeypatch, step):
+    """
+    Make the resident memory grow by a step each time it is sampled.
+    """
+    counter = itertools.count()
+    monkeypatch.setattr(_memory, 'get_rss', lambda: next(counter) * step)
+
+def _fail_pandas(monkeypatch):
+    """
+    Make pandas fail to open files, so that they are loaded with the SAS7BDAT module.
+    """
+    def fail(self, **kwargs):
+        raise ValueError('not supported by pandas')
+    monkeypatch.setattr(SASReader, '_open_sas', fail)
+
+def test_sampled_for_each_chunk(fixture_dir):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1)
+    tracker = _CountingTracker()
+
+    assert len(read_frame(make_reader(path, 'chunksize=500', memory=tracker))) == 3000
+    assert tracker.samples == 6
+
+def test_limit_stops_read_of_chunk(fixture_dir):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1)
+    chunks = []
+
+    with pytest.raises(MemoryLimitError):
+        read_frame(make_reader(path, 'chunksize=500', memory=_CountingTracker(2)), lambda reader: chunks.append(1))
+    assert len(chunks) == 2
+
+def test_limit_stops_load_with_sas7bdat_module(fixture_dir, monkeypatch):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1)
+    _fail_pandas(monkeypatch)
+    tracker = _CountingTracker(2)
+
+    # The file is loaded before the first chunk, so the limit is checked while it loads
+    with pytest.raises(MemoryLimitError):
+        make_reader(path, 'chunksize=500, read_ahead=0', memory=tracker).read(describe=False)
+    assert tracker.samples == 3
+
+def test_limit_returns_resource_exhausted(fixture_dir, start_service, monkeypatch):
+    path = fixtures.get_fixture(fixture_dir, rows=20000, columns=10, string_length=16)
+    service, stub = start_service(max_request_memory=10)
+    _growing_rss(monkeypatch, 1024 * 1024)
+
+    rows = 0
+    with pytest.raises(grpc.RpcError) as e:
+        for bundle in execute(stub, path, 'chunksize=1000'):
+            rows += len(bundle.rows)
+
+    assert e.value.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+    assert rows < 10000
+    assert service.metrics.counters[('sse_requests_memory_limit_total', (('function', 'Read_SAS'),))] == 1
+
+def test_limit_returns_resource_exhausted_before_rows(fixture_dir, start_service, monkeypatch):
+    path = fixtures.get_fixture(fixture_dir, rows=20000, columns=10, string_length=16)
+    service, stub = start_service(max_request_memory=10)
+    _growing_rss(monkeypatch, 1024 * 1024)
+    _fail_pandas(monkeypatch)
+
+    with pytest.raises(grpc.RpcError) as e:
+        list(execute(stub, path, 'chunksize=1000, read_ahead=0'))
+
+    assert e.value.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+    assert 'before sending any rows' in e.value.details()
+    assert service.admission.active == 0
+
+@pytest.mark.skipif(sys.version_info < (3, 9), reason='tracemalloc.reset_peak needs Python 3.9')
+def test_traced_peak_between_samples():
+    started = not tracemalloc.is_tracing()
+    MemoryTracker.start_tracing()
+
+    try:
+        # The peak from before the request started is not counted
+        data = bytearray(20 * 1024 * 1024)
+        del data
+        tracker = MemoryTracker()
+
+        # Allocations freed before the next sample still count towards the peak for the request
+        data = bytearray(8 * 1024 * 1024)
+        del data
+        tracker.sample()
+
+        assert 8 * 1024 * 1024 <= tracker.traced_growth < 12 * 1024 * 1024
+    finally:
+        if started:
+            tracemalloc.stop()
+
+def test_limit_while_opening_returns_resource_exhausted(fixture_dir, start_service, monkeypatch):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1)
+    service, stub = start_service(max_request_memory=10)
+
+    def fail(self, *args, **kwargs):
+        raise MemoryLimitError('over the limit')
+    monkeypatch.setattr(SASReader, '__init__', fail)
+
+    with pytest.raises(grpc.RpcError) as e:
+        list(execute(stub, path))
+
+    assert e.value.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+    assert path in e.value.details()
+    assert service.admission.active == 0
@@ -0,0 +1,34 @@
+import urllib.request
+
+from _metrics import Metrics
+
+def test_label_values_escaped():
+    metrics = Metrics()
+    metrics.gauges.clear()
+    metrics.inc('sse_requests_total', function='a\\b "c"\nd')
+
+    assert 'sse_requests_total{function="a\\\\b \\"c\\"\\nd"} 1\n' in metrics.render()
+
+def test_histogram_labels():
+    metrics = Metrics()
+    metrics.observe('sse_chunk_decode_seconds', 0.02, function='Read_SAS')
+    text = metrics.render()
+
+    assert 'sse_chunk_decode_seconds_bucket{function="Read_SAS",le="0.01"} 0\n' in text
+    assert 'sse_chunk_decode_seconds_bucket{function="Read_SAS",le="0.025"} 1\n' in text
+    assert 'sse_chunk_decode_seconds_count{function="Read_SAS"} 1\n' in text
+
+def test_serve_binds_to_localhost():
+    metrics = Metrics()
+    metrics.inc('sse_requests_total', function='Read_SAS')
+    server = metrics.serve(0)
+
+    try:
+        host, port = server.server_address[:2]
+        assert host == '127.0.0.1'
+
+        with urllib.request.urlopen('http://127.0.0.1:{}/metrics'.format(port), timeout=10) as response:
+            assert 'sse_requests_total{function="Read_SAS"} 1' in response.read().decode('utf-8')
+    finally:
+        server.shutdown()
+        server.server_close()
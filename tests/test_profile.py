@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+from _profile import _ColumnState
+
+def _noisy_chunks(chunks, frequent=10, noise=3, repeats=3):
+    """
+    Build chunks with a frequent value, and noise values that each appear in a single chunk but more often than the
+    frequent value does in that chunk.
+    """
+    return [pd.Series(['A'] * frequent + ['N{0}_{1}'.format(i, j) for j in range(noise) for _ in range(repeats)])\
+        for i in range(chunks)]
+
+def test_counts_exact_within_capacity():
+    rng = np.random.RandomState(0)
+    chunks = [pd.Series(rng.choice(['A', 'B', 'C', 'D', None], 500)) for _ in range(6)]
+    state = _ColumnState('string', 5)
+
+    for chunk in chunks:
+        state.add(chunk)
+
+    expected = pd.concat(chunks).value_counts()
+    assert state.dropped == 0
+    assert state.counts.sort_index().to_dict() == expected.sort_index().to_dict()
+
+def test_frequent_value_kept_beyond_capacity():
+    chunks = _noisy_chunks(10)
+    state = _ColumnState('string', 3)
+
+    for chunk in chunks:
+        state.add(chunk)
+
+    # The frequent value is below the noise in every chunk, but is counted across all of them
+    assert 'A' in state.counts.index
+    assert state.counts['A'] - state.dropped <= 100 <= state.counts['A']
+    assert state.result(1)[-1] == 'A ({0}..{1})'.format(state.counts['A'] - state.dropped, state.counts['A'])
+
+def test_counts_bound_true_counts():
+    rng = np.random.RandomState(1)
+    values = pd.Series(rng.zipf(1.5, 20000).astype(str))
+    state = _ColumnState('string', 20)
+
+    for start in range(0, len(values), 1000):
+        state.add(values.iloc[start:start + 1000])
+
+    expected = values.value_counts()
+    assert state.dropped > 0
+    for value, count in state.counts.items():
+        assert count - state.dropped <= expected[value] <= count
+
+    # Values counted more often than the largest count dropped are always kept
+    assert set(expected.index[expected > state.dropped]) <= set(state.counts.index)
+
+def test_unique_values_not_listed():
+    state = _ColumnState('numeric', 100)
+
+    for start in range(0, 5000, 1000):
+        state.add(pd.Series(np.arange(start, start + 1000, dtype=np.float64)))
+
+    # Every value occurs once, so none of them can be reported as frequent
+    assert state.dropped > 0
+    assert state.result(3)[-1] == ''
+
+def test_counts_exact_in_result():
+    state = _ColumnState('string', 100)
+    state.add(pd.Series(['A', 'B', 'A', None, 'C', 'A', 'B']))
+
+    assert state.result(2)[-1] == 'A (3); B (2)'
@@ -0,0 +1,89 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import fixtures
+from conftest import make_reader, read_frame
+from _read_ahead import ReadAheadFile
+
+class _FailingFile(io.BytesIO):
+    """
+    A file that fails to read after a number of bytes.
+    """
+
+    def __init__(self, data, fail_at):
+        super().__init__(data)
+        self.fail_at = fail_at
+
+    def read(self, size=-1):
+        if self.tell() + (size if size >= 0 else len(self.getvalue())) > self.fail_at:
+            raise OSError('network share unavailable')
+        return super().read(size)
+
+@pytest.fixture(scope='module')
+def data():
+    return np.random.RandomState(0).bytes(100000)
+
+@pytest.mark.parametrize('block_size, depth', [(1000, 1), (4096, 4), (200000, 2)])
+def test_random_reads_match_file(data, block_size, depth):
+    rng = np.random.RandomState(1)
+    f = ReadAheadFile(io.BytesIO(data), block_size, depth)
+
+    try:
+        # Sequential reads, small seeks backwards and jumps to any position in the file
+        for _ in range(300):
+            choice = rng.random_sample()
+            if choice < 0.3:
+                f.seek(int(rng.randint(0, len(data) + 10)))
+            elif choice < 0.4:
+                f.seek(-min(f.tell(), int(rng.randint(0, 50))), io.SEEK_CUR)
+            position, size = f.tell(), int(rng.randint(0, 3 * block_size))
+            assert f.read(size) == data[position : position + size]
+            assert f.tell() == max(position, min(len(data), position + size))
+
+        f.seek(-10, io.SEEK_END)
+        assert f.read() == data[-10:]
+        assert f.read(5) == b''
+    finally:
+        f.close()
+
+def test_readinto_and_close(data, tmp_path):
+    path = str(tmp_path / 'data.bin')
+    with open(path, 'wb') as out:
+        out.write(data)
+
+    f = ReadAheadFile.open(path, block_size=4096)
+    buffer = bytearray(10000)
+    assert f.readinto(buffer) == 10000 and bytes(buffer) == data[:10000]
+    assert f.name == path
+
+    with pytest.raises(ValueError):
+        f.seek(-1)
+    f.close()
+    with pytest.raises(ValueError):
+        f.read(1)
+
+def test_read_error_raised(data):
+    f = ReadAheadFile(_FailingFile(data, 50000), block_size=10000, depth=2)
+
+    try:
+        assert f.read(20000) == data[:20000]
+        with pytest.raises(OSError):
+            f.seek(60000)
+            f.read(100)
+    finally:
+        f.close()
+
+@pytest.mark.parametrize('compression, file_format', [('none', 'sas7bdat'), ('rle', 'sas7bdat'), ('none', 'xport')])
+@pytest.mark.parametrize('args', ['block_size=1, read_ahead=1', 'block_size=8, read_ahead=3', 'read_ahead=4'])
+def test_read_ahead_matches_plain_read(fixture_dir, compression, file_format, args):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1,\
+        compression=compression, file_format=file_format)
+    expected = read_frame(make_reader(path, 'chunksize=700, read_ahead=0'))
+
+    # The smaller block sizes split the file into many blocks, so pages and rows span block boundaries
+    assert os.path.getsize(path) > 8 * 1024
+    pd.testing.assert_frame_equal(read_frame(make_reader(path, 'chunksize=700, ' + args)), expected)
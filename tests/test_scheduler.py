@@ -0,0 +1,82 @@
+import threading
+
+import grpc
+import pytest
+
+import fixtures
+from conftest import execute
+from test_cancellation import _wait_for
+from _scheduler import PRIORITIES, ChunkScheduler, PriorityError, parse_priority
+
+@pytest.mark.parametrize('value, weight', [('low', 0.5), ('Normal', 1.0), (' HIGH ', 2.0), ('3', 3.0), ('0.25', 0.25)])
+def test_parse_priority(value, weight):
+    assert parse_priority(value) == weight
+
+@pytest.mark.parametrize('value', ['0', '-1', 'urgent', '', 'nan', 'inf', '-inf', '1e400'])
+def test_parse_invalid_priority(value):
+    with pytest.raises(PriorityError):
+        parse_priority(value)
+
+@pytest.mark.parametrize('weight', [0, -1.0, float('nan'), float('inf')])
+def test_register_invalid_weight(weight):
+    with pytest.raises(PriorityError):
+        ChunkScheduler(1).register(weight)
+
+def test_turns_follow_weights():
+    scheduler = ChunkScheduler(1)
+    tickets = [scheduler.register(PRIORITIES['normal']), scheduler.register(PRIORITIES['high'])]
+
+    for ticket in tickets:
+        with scheduler.turn(ticket):
+            pass
+
+    assert [ticket.vtime for ticket in tickets] == [1.0, 0.5]
+    assert scheduler.busy == 0
+
+def test_free_slots_used_after_wakeup():
+    scheduler = ChunkScheduler(2)
+    holders = [scheduler.register(), scheduler.register()]
+    turns = [scheduler.turn(ticket) for ticket in holders]
+    for turn in turns:
+        turn.__enter__()
+
+    started, done = [], threading.Event()
+
+    def wait_for_turn(ticket):
+        with scheduler.turn(ticket):
+            started.append(ticket)
+            done.wait(10)
+
+    # B waits first, then A with a lower virtual time, so B is woken first but A is next in line
+    a, b = scheduler.register(), scheduler.register()
+    b.vtime = 5.0
+    threads = []
+    for ticket in (b, a):
+        threads.append(threading.Thread(target=wait_for_turn, args=(ticket,), daemon=True))
+        threads[-1].start()
+        assert _wait_for(lambda: ticket in scheduler.waiting)
+
+    # Both slots are freed before either waiting request runs
+    with scheduler._condition:
+        for turn in turns:
+            turn.__exit__(None, None, None)
+
+    try:
+        assert _wait_for(lambda: len(started) == 2, timeout=5)
+        assert started == [a, b]
+    finally:
+        done.set()
+        for thread in threads:
+            thread.join(5)
+
+@pytest.mark.parametrize('priority', ['0', '-2', 'urgent', 'nan'])
+def test_invalid_priority_rejected(fixture_dir, start_service, priority):
+    path = fixtures.get_fixture(fixture_dir, rows=3000, columns=7, string_length=12, missing=0.1)
+    service, stub = start_service()
+
+    with pytest.raises(grpc.RpcError) as e:
+        list(execute(stub, path, 'priority={}'.format(priority)))
+
+    assert e.value.code() == grpc.StatusCode.INVALID_ARGUMENT
+    assert 'priority' in e.value.details()
+    assert service.admission.active == 0